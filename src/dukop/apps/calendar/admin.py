@@ -51,6 +51,14 @@ class EventAdmin(admin.ModelAdmin):
         "venue_name",
     )
 
+    def get_queryset(self, request):
+        return (
+            super()
+            .get_queryset(request)
+            .defer("description")
+            .prefetch_related("times", "images")
+        )
+
     def short_description_truncated(self, instance):
         return truncatewords(instance.short_description, 100)
 
@@ -0,0 +1,213 @@
+"""
+A read-only JSON API of the public event times.
+
+``/api/events/`` takes the parameters of the feeds (``?from=``, ``?to=``,
+``?days=``, ``?limit=``, ``?host=`` and ``?location=``) and ``?sphere=``. The
+rows are read from OccurrenceListing and ``?fields=`` selects the columns, so
+fields of the Event are only joined when they are asked for.
+
+Pages are linked with a cursor on ``(start, id)`` of the last row instead of
+an offset, so every page is a range scan of the same size no matter how deep
+the client pages.
+
+Only stored times are listed. With ``DUKOP_VIRTUAL_RECURRENCES`` on, the
+occurrences that a recurrence does not store are missing, only its anchor and
+the times changed by hand are rows with an id that a cursor can point to.
+Clients that need the series should use the ICS feeds or CalDAV, which write
+recurrences as RRULEs.
+"""
+import hashlib
+import json
+
+from django.core.exceptions import BadRequest
+from django.db.models import Q
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils import translation
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_datetime
+from django.utils.http import quote_etag
+from django.utils.http import urlsafe_base64_decode
+from django.utils.http import urlsafe_base64_encode
+from django.views.decorators.http import require_safe
+
+from . import feeds
+from . import utils
+
+#: Rows per page when there is no ?limit=
+API_PAGE_SIZE = 50
+
+#: Most rows per page that can be asked for with ?limit=
+API_MAX_PAGE_SIZE = 200
+
+#: Fields that can be selected with ?fields= and the columns of
+#: OccurrenceListing that they are read from
+API_FIELDS = {
+    "id": "event_time_id",
+    "event_id": "event_id",
+    "url": "event_id",
+    "name": "name",
+    "start": "start",
+    "end": "end",
+    "venue_name": "venue_name",
+    "is_cancelled": "is_cancelled",
+    "featured": "featured",
+    "has_image": "has_image",
+    "host_id": "host_id",
+    "location_id": "location_id",
+    "spheres": "sphere_ids",
+    "short_description": "event__short_description",
+    "street": "event__street",
+    "city": "event__city",
+    "zip_code": "event__zip_code",
+    "online": "event__online",
+}
+
+#: Fields of a response without ?fields=
+API_DEFAULT_FIELDS = (
+    "id",
+    "event_id",
+    "url",
+    "name",
+    "start",
+    "end",
+    "venue_name",
+    "is_cancelled",
+)
+
+
+def get_fields(request):
+    value = request.GET.get("fields")
+    if not value:
+        return API_DEFAULT_FIELDS
+    fields = tuple(dict.fromkeys(name.strip() for name in value.split(",")))
+    unknown = [name for name in fields if name not in API_FIELDS]
+    if unknown:
+        raise BadRequest("Unknown ?fields=: {}".format(", ".join(unknown)))
+    return fields
+
+
+def encode_cursor(start, event_time_id):
+    return urlsafe_base64_encode(
+        "{}|{}".format(start.isoformat(), event_time_id).encode()
+    )
+
+
+def decode_cursor(cursor):
+    """The (start, id) of the last row of the previous page"""
+    try:
+        start, event_time_id = urlsafe_base64_decode(cursor).decode().split("|")
+        start = parse_datetime(start)
+        event_time_id = int(event_time_id)
+    except ValueError:
+        start = None
+    if not start:
+        raise BadRequest("Invalid ?cursor=")
+    return start, event_time_id
+
+
+def format_value(name, value, link_format):
+    if value is None:
+        return None
+    if name in ("start", "end"):
+        return timezone.localtime(value).isoformat()
+    if name == "url":
+        return link_format.format(value)
+    if name == "spheres":
+        return [
+            int(sphere_id) for sphere_id in value.strip(",").split(",") if sphere_id
+        ]
+    return value
+
+
+def get_page(query, fields, cursor=None):
+    """
+    The rows of a page as dicts of ``fields``, and the cursor of the next page
+    or None
+    """
+    columns = list(
+        dict.fromkeys(
+            ["start", "event_time_id"] + [API_FIELDS[name] for name in fields]
+        )
+    )
+    listings = feeds.get_listings(query).filter(published=True)
+    if cursor:
+        start, event_time_id = cursor
+        listings = listings.filter(
+            Q(start__gt=start) | Q(start=start, event_time_id__gt=event_time_id)
+        )
+    # One more row than asked for tells if there is a next page
+    rows = list(
+        listings.order_by("start", "event_time_id").values_list(*columns)[
+            : query.limit + 1
+        ]
+    )
+    next_cursor = None
+    if len(rows) > query.limit:
+        rows = rows[: query.limit]
+        next_cursor = encode_cursor(rows[-1][0], rows[-1][1])
+
+    link_format = feeds.get_share_link_format()
+    positions = [columns.index(API_FIELDS[name]) for name in fields]
+    results = [
+        {
+            name: format_value(name, row[position], link_format)
+            for name, position in zip(fields, positions)
+        }
+        for row in rows
+    ]
+    return results, next_cursor
+
+
+def get_etag(request):
+    """
+    Changes when any event changes, like the cached feeds, and when the day
+    changes, which moves the default window
+    """
+    return quote_etag(
+        hashlib.md5(
+            ":".join(
+                [
+                    str(utils.get_cache_version(feeds.FEED_VERSION_CACHE_KEY)),
+                    translation.get_language() or "",
+                    timezone.localtime(utils.get_now()).date().isoformat(),
+                    request.get_full_path(),
+                ]
+            ).encode()
+        ).hexdigest()
+    )
+
+
+@require_safe
+def event_list(request):
+    etag = get_etag(request)
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+
+    query = feeds.get_feed_query(
+        request,
+        sphere_id=feeds.get_query_int(request, "sphere"),
+        default_limit=API_PAGE_SIZE,
+        max_limit=API_MAX_PAGE_SIZE,
+    )
+    cursor = request.GET.get("cursor")
+    results, next_cursor = get_page(
+        query, get_fields(request), decode_cursor(cursor) if cursor else None
+    )
+
+    next_url = None
+    if next_cursor:
+        params = request.GET.copy()
+        params["cursor"] = next_cursor
+        next_url = request.build_absolute_uri("?" + params.urlencode())
+
+    response = HttpResponse(
+        json.dumps(
+            {"results": results, "next": next_url, "cursor": next_cursor},
+            separators=(",", ":"),
+        ),
+        content_type="application/json",
+    )
+    response["ETag"] = etag
+    return response
@@ -0,0 +1,450 @@
+"""
+A read-only CalDAV collection per sphere.
+
+``/caldav/<sphere id>/`` holds a resource ``<event id>.ics`` per event of the
+sphere's ICS feed with the same VEVENTs as the feed. Clients discover the
+collection with PROPFIND and fetch resources with GET or a calendar-multiget
+REPORT.
+
+The point of the collection is the sync-collection REPORT (RFC 6578): Every
+change of an event, its times, recurrences or spheres is written to the
+EventChange journal, and the id of the latest settled row is the sync token
+(see get_sync_token()). A client
+that sends its last token only gets the events that changed since, and the
+ones that left the collection as 404. Tokens from before the oldest row that
+was kept by ``calendar_prune_changes`` are rejected, so the client starts over
+with a full sync.
+"""
+import copy
+import hashlib
+import io
+from collections import defaultdict
+from datetime import timedelta
+from urllib.parse import urlsplit
+from xml.etree import ElementTree
+
+from django.conf import settings
+from django.db.models import Min
+from django.http import Http404
+from django.http import HttpResponse
+from django.http import HttpResponseBadRequest
+from django.shortcuts import get_object_or_404
+from django.shortcuts import redirect
+from django.urls import resolve
+from django.urls import Resolver404
+from django.urls.base import reverse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
+from django.views.generic.base import View
+
+from . import feeds
+from . import models
+from . import utils
+
+DAV = "DAV:"
+CALDAV = "urn:ietf:params:xml:ns:caldav"
+CALENDARSERVER = "http://calendarserver.org/ns/"
+
+ElementTree.register_namespace("D", DAV)
+ElementTree.register_namespace("C", CALDAV)
+ElementTree.register_namespace("CS", CALENDARSERVER)
+
+SYNC_TOKEN_PREFIX = "urn:x-dukop:sync:"
+
+#: Days that the change journal is kept, older sync tokens are invalid
+CHANGES_MAX_AGE_DAYS = getattr(settings, "DUKOP_CALDAV_CHANGES_MAX_AGE_DAYS", 90)
+
+#: Seconds that a journal row is left out of the sync token, so transactions
+#: that are still open can commit their older rows
+CHANGES_SETTLE_SECONDS = getattr(settings, "DUKOP_CALDAV_CHANGES_SETTLE_SECONDS", 30)
+
+
+def dav(name):
+    return "{%s}%s" % (DAV, name)
+
+
+def caldav(name):
+    return "{%s}%s" % (CALDAV, name)
+
+
+def record_changes(event_ids):
+    """
+    Adds the events to the journal when the transaction is committed, one row
+    per event. Called by the signals in signals.py.
+    """
+    utils.on_commit_batch(write_changes, event_ids)
+
+
+def write_changes(event_ids):
+    models.EventChange.objects.bulk_create(
+        models.EventChange(event_id=event_id) for event_id in set(event_ids)
+    )
+
+
+def prune_changes(days=CHANGES_MAX_AGE_DAYS):
+    """
+    Removes journal rows older than ``days``. The latest row is always kept,
+    it is the current sync token. Returns the number of removed rows.
+    """
+    latest = get_sync_token()
+    removed, __ = (
+        models.EventChange.objects.filter(
+            created__lt=utils.get_now() - timedelta(days=days)
+        )
+        .exclude(pk=latest)
+        .delete()
+    )
+    return removed
+
+
+def get_sync_token():
+    """
+    The id of the latest journal row that is older than CHANGES_SETTLE_SECONDS.
+    Ids are taken when a row is written, but transactions can commit them out
+    of order. A token of the very latest row could be above a row that is not
+    visible yet, and a client would never get that change.
+    """
+    return (
+        models.EventChange.objects.filter(
+            created__lte=timezone.now() - timedelta(seconds=CHANGES_SETTLE_SECONDS)
+        )
+        .order_by("-pk")
+        .values_list("pk", flat=True)
+        .first()
+        or 0
+    )
+
+
+def format_sync_token(token):
+    return "{}{}".format(SYNC_TOKEN_PREFIX, token)
+
+
+def parse_sync_token(value):
+    """
+    The journal id of a sync token, None for an empty token (the initial
+    sync) and -1 for tokens that are not valid (anymore)
+    """
+    if not value:
+        return None
+    prefix, __, token = value.rpartition(":")
+    if prefix + ":" != SYNC_TOKEN_PREFIX or not token.isdigit():
+        return -1
+    token = int(token)
+    if token > get_sync_token():
+        return -1
+    oldest = models.EventChange.objects.aggregate(Min("pk"))["pk__min"]
+    if oldest and token < oldest - 1:
+        return -1
+    return token
+
+
+def get_changed_event_ids(token, latest):
+    return set(
+        models.EventChange.objects.filter(pk__gt=token, pk__lte=latest).values_list(
+            "event_id", flat=True
+        )
+    )
+
+
+def render_resources(request, sphere, event_ids=None):
+    """
+    Maps the ids of the events of the collection to the iCalendar body of
+    their resource, optionally only some events. The items come from the ICS
+    feed of the sphere, so recurrences are series like in the feed. Like in
+    the JSON API, only published events are in the collection.
+    """
+    feed = feeds.EventFeed()
+    feed.request = request
+    query = feeds.FeedQuery(
+        sphere=sphere,
+        start=feeds.get_today_start(),
+        end=None,
+        limit=None,
+        host=None,
+        location=None,
+        event_ids=event_ids,
+    )
+    items = defaultdict(list)
+    for item in feed.items(query):
+        if item.event.published:
+            items[item.event.pk].append(item)
+
+    resources = {}
+    for event_id, event_items in items.items():
+        resource = copy.copy(feed)
+        resource.items = event_items
+        resource.series_timezone = any(map(feed.item_rrule, event_items))
+        content = io.BytesIO()
+        resource.get_feed(query, request).write(content, "utf-8")
+        resources[event_id] = content.getvalue()
+    return resources
+
+
+def get_etag(content):
+    return '"{}"'.format(hashlib.md5(content).hexdigest())
+
+
+class Multistatus:
+    """Builds a 207 Multi-Status response"""
+
+    def __init__(self):
+        self.root = ElementTree.Element(dav("multistatus"))
+
+    def add(self, href, props=None, requested=(), status=None):
+        """
+        Adds a response for ``href``. ``props`` maps property names to
+        functions that fill the element of the property. Requested properties
+        that aren't in ``props`` are answered with 404, and a resource without
+        properties with ``status``.
+        """
+        response = ElementTree.SubElement(self.root, dav("response"))
+        ElementTree.SubElement(response, dav("href")).text = href
+        if status:
+            ElementTree.SubElement(response, dav("status")).text = status
+            return
+        requested = list(requested) or list(props)
+        found = [name for name in requested if name in props]
+        missing = [name for name in requested if name not in props]
+        for names, names_status in ((found, "200 OK"), (missing, "404 Not Found")):
+            if not names:
+                continue
+            propstat = ElementTree.SubElement(response, dav("propstat"))
+            prop = ElementTree.SubElement(propstat, dav("prop"))
+            for name in names:
+                element = ElementTree.SubElement(prop, name)
+                if name in props:
+                    props[name](element)
+            ElementTree.SubElement(propstat, dav("status")).text = (
+                "HTTP/1.1 " + names_status
+            )
+
+    def response(self):
+        return HttpResponse(
+            ElementTree.tostring(self.root, encoding="utf-8", xml_declaration=True),
+            status=207,
+            content_type='application/xml; charset="utf-8"',
+        )
+
+
+def set_text(text):
+    def fill(element):
+        element.text = text
+
+    return fill
+
+
+def add_children(*names, **attributes):
+    def fill(element):
+        for name in names:
+            ElementTree.SubElement(element, name, **attributes)
+
+    return fill
+
+
+def get_requested_props(body):
+    """The property names of a <prop> element, an empty list for <allprop>"""
+    prop = body.find(dav("prop")) if body is not None else None
+    if prop is None:
+        return []
+    return [child.tag for child in prop]
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class CalendarView(View):
+    """Common methods of the collection and its resources"""
+
+    http_method_names = ["get", "head", "options", "propfind", "report"]
+
+    def dispatch(self, request, sphere_id, *args, **kwargs):
+        self.sphere = get_object_or_404(models.Sphere, pk=sphere_id)
+        return super().dispatch(request, sphere_id, *args, **kwargs)
+
+    def options(self, request, *args, **kwargs):
+        response = super().options(request, *args, **kwargs)
+        response["DAV"] = "1, 3, calendar-access"
+        return response
+
+    def get_body(self):
+        """The parsed XML body, None if there is none"""
+        if not self.request.body:
+            return None
+        try:
+            return ElementTree.fromstring(self.request.body)
+        except ElementTree.ParseError:
+            return None
+
+    def get_href(self, event_id):
+        return reverse(
+            "calendar:caldav_event",
+            kwargs={"sphere_id": self.sphere.pk, "event_id": event_id},
+        )
+
+    def get_event_id(self, href):
+        """The id of the event of a resource URL of this collection or None"""
+        try:
+            match = resolve(urlsplit(href).path)
+        except Resolver404:
+            return None
+        if (
+            match.url_name != "caldav_event"
+            or match.kwargs["sphere_id"] != self.sphere.pk
+        ):
+            return None
+        return match.kwargs["event_id"]
+
+    def get_resource_props(self, content):
+        return {
+            dav("getetag"): set_text(get_etag(content)),
+            dav("getcontenttype"): set_text("text/calendar; charset=utf-8"),
+            dav("resourcetype"): add_children(),
+            caldav("calendar-data"): set_text(content.decode("utf-8")),
+        }
+
+    def add_resources(self, multistatus, resources, event_ids, requested):
+        for event_id in event_ids:
+            if event_id in resources:
+                multistatus.add(
+                    self.get_href(event_id),
+                    self.get_resource_props(resources[event_id]),
+                    requested or [dav("getetag")],
+                )
+            else:
+                multistatus.add(
+                    self.get_href(event_id), status="HTTP/1.1 404 Not Found"
+                )
+
+    def report(self, request, *args, **kwargs):
+        body = self.get_body()
+        if body is None:
+            return HttpResponseBadRequest("Expected an XML body")
+        if body.tag == caldav("calendar-multiget"):
+            return self.calendar_multiget(body)
+        if body.tag == dav("sync-collection"):
+            return self.sync_collection(body)
+        return self.error(dav("supported-report"))
+
+    def calendar_multiget(self, body):
+        event_ids = [
+            self.get_event_id(href.text or "") for href in body.iter(dav("href"))
+        ]
+        resources = render_resources(
+            self.request, self.sphere, [pk for pk in event_ids if pk]
+        )
+        multistatus = Multistatus()
+        for href, event_id in zip(body.iter(dav("href")), event_ids):
+            if event_id:
+                self.add_resources(
+                    multistatus, resources, [event_id], get_requested_props(body)
+                )
+            else:
+                multistatus.add(href.text, status="HTTP/1.1 404 Not Found")
+        return multistatus.response()
+
+    def sync_collection(self, body):
+        return self.error(dav("supported-report"))
+
+    def error(self, condition, status=403):
+        """A response with a precondition of RFC 4918 or 6578"""
+        root = ElementTree.Element(dav("error"))
+        ElementTree.SubElement(root, condition)
+        return HttpResponse(
+            ElementTree.tostring(root, encoding="utf-8", xml_declaration=True),
+            status=status,
+            content_type='application/xml; charset="utf-8"',
+        )
+
+
+class CollectionView(CalendarView):
+    """The calendar collection of a sphere"""
+
+    def get(self, request, *args, **kwargs):
+        return redirect("calendar:feed_ical", sphere_id=self.sphere.pk)
+
+    def get_props(self, token):
+        token = format_sync_token(token)
+        return {
+            dav("resourcetype"): add_children(dav("collection"), caldav("calendar")),
+            dav("displayname"): set_text(str(self.sphere.name)),
+            dav("sync-token"): set_text(token),
+            "{%s}getctag" % CALENDARSERVER: set_text(token),
+            caldav("supported-calendar-component-set"): add_children(
+                caldav("comp"), name="VEVENT"
+            ),
+            dav("supported-report-set"): self.add_supported_reports,
+            dav("current-user-privilege-set"): self.add_read_privilege,
+        }
+
+    @staticmethod
+    def add_supported_reports(element):
+        for report in (dav("sync-collection"), caldav("calendar-multiget")):
+            supported = ElementTree.SubElement(element, dav("supported-report"))
+            ElementTree.SubElement(
+                ElementTree.SubElement(supported, dav("report")), report
+            )
+
+    @staticmethod
+    def add_read_privilege(element):
+        privilege = ElementTree.SubElement(element, dav("privilege"))
+        ElementTree.SubElement(privilege, dav("read"))
+
+    def propfind(self, request, *args, **kwargs):
+        requested = get_requested_props(self.get_body())
+        multistatus = Multistatus()
+        multistatus.add(request.path, self.get_props(get_sync_token()), requested)
+        if request.headers.get("Depth", "infinity") != "0":
+            resources = render_resources(request, self.sphere)
+            self.add_resources(multistatus, resources, resources, requested)
+        return multistatus.response()
+
+    def sync_collection(self, body):
+        token = parse_sync_token(body.findtext(dav("sync-token")))
+        if token == -1:
+            return self.error(dav("valid-sync-token"))
+        if body.findtext(dav("sync-level"), "1") != "1":
+            return self.error(dav("supported-sync-level"))
+
+        # Taken before rendering, so changes while rendering are sent again
+        latest = get_sync_token()
+        if token is None:
+            resources = render_resources(self.request, self.sphere)
+            event_ids = resources
+        else:
+            event_ids = sorted(get_changed_event_ids(token, latest))
+            resources = render_resources(self.request, self.sphere, event_ids)
+
+        multistatus = Multistatus()
+        self.add_resources(multistatus, resources, event_ids, get_requested_props(body))
+        ElementTree.SubElement(multistatus.root, dav("sync-token")).text = (
+            format_sync_token(latest)
+        )
+        return multistatus.response()
+
+
+class ResourceView(CalendarView):
+    """The resource of a single event"""
+
+    def get_content(self):
+        content = render_resources(
+            self.request, self.sphere, [self.kwargs["event_id"]]
+        ).get(self.kwargs["event_id"])
+        if content is None:
+            raise Http404("No such event in this calendar")
+        return content
+
+    def get(self, request, *args, **kwargs):
+        content = self.get_content()
+        response = HttpResponse(content, content_type="text/calendar; charset=utf-8")
+        etag = get_etag(content)
+        response["ETag"] = etag
+        return get_conditional_response(request, etag=etag, response=response)
+
+    def propfind(self, request, *args, **kwargs):
+        multistatus = Multistatus()
+        multistatus.add(
+            request.path,
+            self.get_resource_props(self.get_content()),
+            get_requested_props(self.get_body()),
+        )
+        return multistatus.response()
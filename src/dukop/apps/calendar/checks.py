@@ -0,0 +1,25 @@
+from django.core import checks
+
+from . import utils
+
+
+@checks.register(checks.Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    The sphere registry, the feed and page caches and their version counters
+    need a cache that all workers share, a process-local cache keeps every
+    worker on its own stale copy
+    """
+    if utils.is_cache_shared():
+        return []
+    return [
+        checks.Error(
+            "The default cache is local to each process.",
+            hint=(
+                "Configure a shared cache like Memcached or Redis in CACHES, "
+                "otherwise edits of spheres and events only reach the worker "
+                "that handled them."
+            ),
+            id="calendar.E001",
+        )
+    ]
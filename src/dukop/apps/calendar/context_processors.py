@@ -1,8 +1,8 @@
-from . import models
+from . import spheres
 
 
 def dukop_sphere(request):
     return {
         "SPHERE": request.sphere,
-        "SPHERES": models.Sphere.get_all_cached(),
+        "SPHERES": spheres.registry.get_all(),
     }
@@ -1,25 +1,469 @@
+import copy
+import hashlib
+import io
+from calendar import timegm
+from collections import namedtuple
+from datetime import date
+from datetime import datetime
+from datetime import timedelta
+from functools import lru_cache
+from itertools import chain
+from itertools import groupby
+from itertools import islice
+from operator import attrgetter
+
 import pytz
+from django.conf import settings
+from django.contrib.sites.models import Site
 from django.contrib.syndication.views import Feed
+from django.core.cache import cache
+from django.core.exceptions import BadRequest
+from django.db.models import Max
+from django.db.models import OuterRef
+from django.db.models import Prefetch
+from django.db.models import Q
+from django.db.models import Subquery
+from django.http import HttpResponse
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.urls.base import reverse
 from django.utils import feedgenerator
+from django.utils import timezone
+from django.utils import translation
+from django.utils.cache import get_conditional_response
+from django.utils.cache import patch_cache_control
+from django.utils.dateparse import parse_date
 from django.utils.feedgenerator import rfc2822_date
+from django.utils.http import http_date
+from django.utils.http import quote_etag
 from django.utils.translation import gettext as _
+from django_ical.feedgenerator import ICal20Feed
 from django_ical.views import ICalFeed
+from dukop.apps.users.models import Group
+from dukop.apps.users.models import Location
+from icalendar import Calendar
+from icalendar import Timezone
 from sorl.thumbnail.shortcuts import get_thumbnail
 
 from . import models
+from . import occurrences
+from . import utils
+
+#: Seconds that a rendered feed is cached. Entries are also replaced when
+#: events change or the day changes.
+FEED_CACHE_TIMEOUT = getattr(settings, "DUKOP_FEED_CACHE_TIMEOUT", 60 * 60 * 24)
+
+#: Most seconds that a feed is cached when each process has its own cache.
+#: Other processes do not see the version bump of a change, so their copy
+#: stays stale until it expires.
+FEED_LOCAL_CACHE_TIMEOUT = 60
+
+#: Key of the version counter of all cached feeds, see invalidate_feeds()
+FEED_VERSION_CACHE_KEY = "dukop_feeds_version"
+
+#: Streamed feeds up to this many bytes are also stored in the cache
+FEED_CACHE_MAX_SIZE = getattr(settings, "DUKOP_FEED_CACHE_MAX_SIZE", 2 * 1024 * 1024)
+
+#: Number of EventTime rows fetched at a time while a feed is streamed
+FEED_CHUNK_SIZE = 500
+
+#: Seconds that the thumbnail of a feed enclosure is remembered. Entries are
+#: keyed by the modification time of the image.
+ENCLOSURE_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+
+#: Longest window of days that a feed can be asked for with ?to= or ?days=
+FEED_MAX_DAYS = getattr(settings, "DUKOP_FEED_MAX_DAYS", 366)
+
+CALENDAR_END = b"END:VCALENDAR\r\n"
+
+#: The normalized parameters of a feed request, see get_feed_query(). The
+#: window is from ``start`` to ``end`` (inclusive), which is None when the feed
+#: has no end. ``event_ids`` restricts the feed to some events, see caldav.py.
+FeedQuery = namedtuple(
+    "FeedQuery",
+    ["sphere", "start", "end", "limit", "host", "location", "event_ids"],
+    defaults=[None],
+)
+
+
+def get_feed_cache_timeout():
+    if utils.is_cache_shared():
+        return FEED_CACHE_TIMEOUT
+    return min(FEED_CACHE_TIMEOUT, FEED_LOCAL_CACHE_TIMEOUT)
+
+
+def invalidate_feeds():
+    """Makes all cached feeds stale, called by the signals in signals.py"""
+    utils.bump_cache_version(FEED_VERSION_CACHE_KEY)
+
+
+def get_query_int(request, name):
+    value = request.GET.get(name)
+    if not value:
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        raise BadRequest("?{}= must be a number".format(name))
+    if value < 1:
+        raise BadRequest("?{}= must be positive".format(name))
+    return value
+
+
+def get_query_date(request, name):
+    value = request.GET.get(name)
+    if not value:
+        return None
+    try:
+        value = parse_date(value)
+    except ValueError:
+        value = None
+    if not value:
+        raise BadRequest("?{}= must be a date like 2021-12-24".format(name))
+    return value
+
+
+def get_today_start():
+    """The start of a feed without ?from="""
+    return timezone.make_aware(
+        datetime.combine(
+            timezone.localtime(utils.get_now()).date(), datetime.min.time()
+        )
+    )
+
+
+def get_feed_query(request, sphere_id=None, default_limit=None, max_limit=None):
+    """
+    Reads ?from=, ?to=, ?days=, ?limit=, ?host= and ?location= of a feed
+    request. The window starts today at the earliest and is no longer than
+    FEED_MAX_DAYS, and the limit is no larger than ``max_limit``.
+
+    Raises Http404 for unknown objects and BadRequest for invalid values.
+    """
+    today = timezone.localtime(utils.get_now()).date()
+    from_date = get_query_date(request, "from") or today
+    from_date = min(max(from_date, today), today + timedelta(days=FEED_MAX_DAYS))
+
+    to_date = get_query_date(request, "to")
+    days = get_query_int(request, "days")
+    if days and not to_date:
+        to_date = from_date + timedelta(days=days - 1)
+    if to_date:
+        if to_date < from_date:
+            raise BadRequest("?to= is before ?from=")
+        to_date = min(to_date, from_date + timedelta(days=FEED_MAX_DAYS - 1))
+
+    limit = get_query_int(request, "limit") or default_limit
+    if limit and max_limit:
+        limit = min(limit, max_limit)
+
+    host_id = get_query_int(request, "host")
+    location_id = get_query_int(request, "location")
+    return FeedQuery(
+        sphere=get_object_or_404(models.Sphere, pk=sphere_id) if sphere_id else None,
+        start=timezone.make_aware(datetime.combine(from_date, datetime.min.time())),
+        end=(
+            timezone.make_aware(datetime.combine(to_date, datetime.max.time()))
+            if to_date
+            else None
+        ),
+        limit=limit,
+        host=get_object_or_404(Group, pk=host_id) if host_id else None,
+        location=get_object_or_404(Location, pk=location_id) if location_id else None,
+    )
+
+
+def get_query_cache_key(query):
+    """A string that is the same for all requests with the same FeedQuery"""
+    return ":".join(
+        [
+            str(query.sphere.pk) if query.sphere else "all",
+            query.start.date().isoformat(),
+            query.end.date().isoformat() if query.end else "",
+            str(query.limit or ""),
+            str(query.host.pk) if query.host else "",
+            str(query.location.pk) if query.location else "",
+            (
+                ",".join(map(str, sorted(query.event_ids)))
+                if query.event_ids is not None
+                else ""
+            ),
+        ]
+    )
+
+
+def get_listings(query):
+    """The OccurrenceListing rows of a feed, without the limit"""
+    listings = models.OccurrenceListing.objects.filter(effective_end__gte=query.start)
+    if query.end:
+        listings = listings.filter(start__lte=query.end)
+    if query.sphere:
+        listings = listings.for_sphere(query.sphere)
+    if query.host:
+        listings = listings.filter(host_id=query.host.pk)
+    if query.location:
+        listings = listings.filter(location_id=query.location.pk)
+    if query.event_ids is not None:
+        listings = listings.filter(event_id__in=query.event_ids)
+    return listings
+
+
+def filter_recurrences(recurrences, query):
+    """Filters EventRecurrence objects by the events of a feed"""
+    if query.sphere:
+        recurrences = recurrences.filter(event__spheres=query.sphere)
+    if query.host:
+        recurrences = recurrences.filter(event__host=query.host)
+    if query.location:
+        recurrences = recurrences.filter(event__location=query.location)
+    if query.event_ids is not None:
+        recurrences = recurrences.filter(event_id__in=query.event_ids)
+    return recurrences
+
+
+def get_share_link_format():
+    """
+    Event.share_link() as a format string for the pk, so the site and the URL
+    are only looked up once per feed
+    """
+    path = reverse("calendar:event_detail", kwargs={"pk": 0})
+    assert path.endswith("/0/")
+    return "https://{}{}{{}}/".format(Site.objects.get_current().domain, path[:-2])
+
+
+def get_enclosures(images, geometry_string):
+    """
+    Maps the ids of EventImage objects to a tuple of the URL, size and mime
+    type of their thumbnail. Thumbnails that are already known are fetched
+    from the cache in one round trip, only new and changed images go through
+    sorl and the storage.
+    """
+    keys = {
+        "dukop_feed_enclosure:{}:{}:{}".format(
+            image.pk, image.modified.timestamp(), geometry_string
+        ): image
+        for image in images
+    }
+    enclosures = cache.get_many(keys)
+    missing = {}
+    for key, image in keys.items():
+        if key not in enclosures:
+            thumbnail = get_thumbnail(image.image, geometry_string, quality=90)
+            missing[key] = (
+                thumbnail.url,
+                str(image.image.size),
+                "image/{}".format(thumbnail.name.split(".")[-1]),
+            )
+    cache.set_many(missing, ENCLOSURE_CACHE_TIMEOUT)
+    enclosures.update(missing)
+    return {image.pk: enclosures[key] for key, image in keys.items()}
+
+
+def load_feed_items(event_times, thumbnail_geometry=None):
+    """
+    Prepares the events of a batch of feed items, so the item methods don't
+    query per item. ``event.feed_link`` is set from a single URL format, and
+    with ``thumbnail_geometry``, ``event.feed_enclosures`` holds the
+    thumbnails of the prefetched images. Returns ``event_times``.
+    """
+    link_format = get_share_link_format()
+    # Items of the same event don't always share the Event object
+    events = {}
+    for event_time in event_times:
+        event_time.event.feed_link = link_format.format(event_time.event.pk)
+        events.setdefault(event_time.event.pk, event_time.event)
+
+    if thumbnail_geometry:
+        enclosures = get_enclosures(
+            [image for event in events.values() for image in event.images.all()],
+            thumbnail_geometry,
+        )
+        for event_time in event_times:
+            event_time.event.feed_enclosures = [
+                enclosures[image.pk]
+                for image in events[event_time.event.pk].images.all()
+            ]
+    return event_times
+
+
+@lru_cache(maxsize=8)
+def get_vtimezone(tz, year):
+    """
+    VTIMEZONE component with the transitions of a few years, expensive to
+    compute
+    """
+    return Timezone.from_tzinfo(
+        tz, first_date=date(year - 1, 1, 1), last_date=date(year + 5, 1, 1)
+    )
+
+
+class DukOpICalGenerator(ICal20Feed):
+    """
+    Adds the VTIMEZONE that series are written in and the RECURRENCE-ID of
+    changed occurrences, which django_ical doesn't know about
+    """
+
+    def write_items(self, calendar):
+        if self.feed.get("vtimezone"):
+            calendar.add_component(self.feed["vtimezone"])
+        first_event = len(calendar.subcomponents)
+        super().write_items(calendar)
+        for item, event in zip(self.items, calendar.subcomponents[first_event:]):
+            if item.get("recurrence_id"):
+                event.add("recurrence-id", item["recurrence_id"])
 
 
 class EventFeed(ICalFeed):
     """
     A simple event calender
+
+    Calendar clients poll the feeds constantly, so the rendered feed is cached
+    per sphere, language and day. The entries are keyed by a version that is
+    bumped when events change, and unchanged feeds are answered with 304.
+    Feeds that are not cached are streamed, see streaming_response().
     """
 
+    feed_type = DukOpICalGenerator
     product_id = "-//dukop.dk//Kalender"
     timezone = "UTC"
     file_name = "dukop.ics"
 
+    #: Most occurrences that can be asked for with ?limit=
+    max_limit = 1000
+
+    #: Set on the copy of a feed that has series, see write_chunks()
+    series_timezone = False
+
+    def get_cache_key(self, obj):
+        return "dukop_feed_ical:{}:{}:{}:{}".format(
+            utils.get_cache_version(FEED_VERSION_CACHE_KEY),
+            get_query_cache_key(obj),
+            translation.get_language(),
+            utils.get_now().date().isoformat(),
+        )
+
+    def __call__(self, request, *args, **kwargs):
+        obj = self.get_object(request, *args, **kwargs)
+        cache_key = self.get_cache_key(obj)
+        cached = cache.get(cache_key)
+        if cached is None:
+            return self.streaming_response(request, obj, cache_key)
+
+        response = HttpResponse(cached["content"])
+        for header, value in cached["headers"].items():
+            response[header] = value
+        response["ETag"] = cached["etag"]
+        return get_conditional_response(request, etag=cached["etag"], response=response)
+
+    def streaming_response(self, request, obj, cache_key):
+        """
+        Writes the feed one chunk of VEVENTs at a time, so memory stays flat
+        no matter how many occurrences there are. The output is the same as
+        django_ical's, and small feeds are stored in the cache on the way.
+
+        The ETag is derived from the cache key, so it is known before the body
+        is rendered, and it changes with every change of the events, deletions
+        included. Last-Modified is found with a single aggregate, but it is
+        only informational: It is the newest change of the items that are
+        left, so it does not move when one is deleted, and conditional
+        requests are only answered from the ETag.
+        """
+        recurrences = self.get_series_recurrences(obj)
+        if occurrences.virtual_recurrences_enabled():
+            # Virtual occurrences are expanded in memory anyway, but only up
+            # to the horizon
+            items = list(self.get_items(obj, recurrences))
+            latest = max(map(self.item_updateddate, items), default=None)
+        else:
+            event_times = self.get_event_times(obj)
+            latest = max(
+                filter(
+                    None,
+                    event_times.aggregate(
+                        Max("modified"), Max("event__modified")
+                    ).values(),
+                ),
+                default=None,
+            )
+            items = self.get_items(obj, recurrences)
+        # Same fallback as SyndicationFeed.latest_post_date()
+        last_modified = timegm((latest or utils.get_now()).utctimetuple())
+        etag = quote_etag(hashlib.md5(cache_key.encode()).hexdigest())
+
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+
+        headers = {
+            "Content-Type": self.feed_type.mime_type,
+            "Last-Modified": http_date(last_modified),
+        }
+        filename = self._get_dynamic_attr("file_name", obj)
+        if filename:
+            headers["Content-Disposition"] = 'attachment; filename="%s"' % filename
+
+        response = StreamingHttpResponse(
+            self.write_cached(
+                self.write_chunks(request, obj, items, bool(recurrences)),
+                cache_key,
+                {"headers": headers, "etag": etag},
+            )
+        )
+        for header, value in headers.items():
+            response[header] = value
+        response["ETag"] = etag
+        return response
+
+    def write_chunks(self, request, obj, items, series_timezone=False):
+        """
+        Yields the calendar as byte strings: The header, the VEVENTs of every
+        chunk of ``items`` and the footer. Each chunk goes through get_feed()
+        and django_ical's write_items() like a complete feed would.
+        """
+        feed = copy.copy(self)
+        feed.items = []
+        feed.series_timezone = series_timezone
+        header = io.BytesIO()
+        feed.get_feed(obj, request).write(header, "utf-8")
+        header = header.getvalue()
+        assert header.endswith(CALENDAR_END)
+        language = translation.get_language()
+
+        yield header[: -len(CALENDAR_END)]
+        items = iter(items)
+        with translation.override(language):
+            while True:
+                feed.items = load_feed_items(list(islice(items, FEED_CHUNK_SIZE)))
+                if not feed.items:
+                    break
+                calendar = Calendar()
+                feed.get_feed(obj, request).write_items(calendar)
+                yield b"".join(
+                    component.to_ical()
+                    for component in calendar.subcomponents
+                    if component.name == "VEVENT"
+                )
+        yield CALENDAR_END
+
+    def write_cached(self, chunks, cache_key, cached):
+        """
+        Passes on ``chunks`` and caches the whole body if it was streamed to
+        the end and is no larger than FEED_CACHE_MAX_SIZE
+        """
+        content = []
+        size = 0
+        for chunk in chunks:
+            if content is not None:
+                size += len(chunk)
+                if size <= FEED_CACHE_MAX_SIZE:
+                    content.append(chunk)
+                else:
+                    content = None
+            yield chunk
+        if content is not None:
+            cached["content"] = b"".join(content)
+            cache.set(cache_key, cached, get_feed_cache_timeout())
+
     def get_object(self, request, *args, **kwargs):
         """
         This gets the primary object that the feed revolves around. For instance:
@@ -29,25 +473,226 @@ class EventFeed(ICalFeed):
          * etc...
         """
         self.request = request
-        sphere_id = kwargs.get("sphere_id")
-        if sphere_id:
-            return get_object_or_404(models.Sphere, pk=sphere_id)
-        return None
+        return get_feed_query(
+            request, kwargs.get("sphere_id"), max_limit=self.max_limit
+        )
 
     def title(self, obj):
-        if obj:
-            return _("Duk Op calendar for {}".format(obj.name))
+        if obj.sphere:
+            return _("Duk Op calendar for {}".format(obj.sphere.name))
         else:
             return _("Duk Op future events")
 
+    def feed_extra_kwargs(self, obj):
+        kwargs = super().feed_extra_kwargs(obj)
+        if self.series_timezone:
+            kwargs["vtimezone"] = get_vtimezone(
+                timezone.get_current_timezone(), utils.get_now().year
+            )
+        return kwargs
+
+    def get_event_times(self, obj):
+        """
+        The stored times of the feed with their events joined in, so they can
+        be streamed with iterator(), which does not support prefetching
+        """
+        listings = get_listings(obj)[: obj.limit]
+        return (
+            models.EventTime.objects.filter(pk__in=listings.values("event_time_id"))
+            .select_related("event")
+            .only(
+                "start",
+                "end",
+                "modified",
+                "is_cancelled",
+                "recurrence",
+                "event",
+                *("event__" + field for field in models.EVENT_CARD_FIELDS)
+            )
+            .order_by("start", "end", "pk")
+        )
+
+    def get_series_recurrences(self, obj):
+        """
+        Recurrences of the feed that are written as one VEVENT with an RRULE
+        instead of a VEVENT per occurrence, mapped by id. A feed with a limit
+        lists single occurrences, there is no way to cut a series short after
+        a number of occurrences of the whole feed.
+        """
+        if obj.limit:
+            return {}
+        recurrences = models.EventRecurrence.objects.exclude(
+            event_time_anchor=None
+        ).select_related("event_time_anchor", "event")
+        if occurrences.virtual_recurrences_enabled():
+            recurrences = filter_recurrences(recurrences, obj)
+        else:
+            recurrences = recurrences.filter(
+                pk__in=self.get_event_times(obj).values("recurrence")
+            )
+        return {
+            recurrence.pk: recurrence
+            for recurrence in recurrences
+            if occurrences.ical_rrule(recurrence)
+        }
+
+    def get_items(self, obj, recurrences):
+        """
+        All items of the feed: The single times sorted by start, then the
+        series of ``recurrences``. Stored times are fetched in chunks.
+        """
+        anchor_ids = [
+            recurrence.event_time_anchor_id for recurrence in recurrences.values()
+        ]
+        if occurrences.virtual_recurrences_enabled():
+            virtual_recurrences = filter_recurrences(
+                models.EventRecurrence.objects.prefetch_related(
+                    Prefetch("event", queryset=models.Event.objects.for_card())
+                ),
+                obj,
+            )
+            event_times = occurrences.merge_virtual(
+                list(self.get_event_times(obj)), virtual_recurrences, obj.start, obj.end
+            )[: obj.limit]
+            singles = []
+            series_times = []
+            for event_time in event_times:
+                if (
+                    event_time.recurrence_id in recurrences
+                    and event_time.pk not in anchor_ids
+                ):
+                    series_times.append(event_time)
+                else:
+                    singles.append(event_time)
+            series_times.sort(key=attrgetter("recurrence_id", "start"))
+        else:
+            event_times = self.get_event_times(obj)
+            in_series = Q(recurrence__in=list(recurrences)) & ~Q(pk__in=anchor_ids)
+            singles = event_times.exclude(in_series).iterator(
+                chunk_size=FEED_CHUNK_SIZE
+            )
+            series_times = (
+                event_times.filter(in_series)
+                .order_by("recurrence", "start", "pk")
+                .iterator(chunk_size=FEED_CHUNK_SIZE)
+            )
+        return chain(singles, self.series_items(obj, recurrences, series_times))
+
+    def series_items(self, obj, recurrences, event_times):
+        """
+        Turns the times of each series into one item with an RRULE, starting
+        at the first occurrence of the feed. Cancelled and deleted occurrences
+        become EXDATEs, and occurrences that were changed by hand are added
+        with a RECURRENCE-ID. Times that aren't on a date of the rule are
+        passed on as they are.
+
+        ``event_times`` must be sorted by recurrence.
+        """
+        for recurrence_id, series_times in groupby(
+            event_times, key=attrgetter("recurrence_id")
+        ):
+            yield from self.get_series(
+                obj, recurrences[recurrence_id], list(series_times)
+            )
+
+    def get_series(self, obj, recurrence, event_times):
+        """The items of one series, see series_items()"""
+        if occurrences.virtual_recurrences_enabled():
+            end = obj.start + timedelta(days=occurrences.VIRTUAL_HORIZON_DAYS)
+        else:
+            # Only the materialized part can tell which times were deleted
+            end = timezone.make_aware(
+                datetime.combine(
+                    recurrence.get_materialized_until(), datetime.min.time()
+                )
+            ) - timedelta(microseconds=1)
+        if obj.end:
+            end = min(end, obj.end)
+        expected = occurrences.virtual_event_times([recurrence], obj.start, end)
+        if not expected:
+            yield from event_times
+            return
+
+        by_date = {}
+        others = []
+        for event_time in event_times:
+            event_time_date = timezone.localtime(event_time.start).date()
+            if event_time_date in by_date:
+                others.append(event_time)
+            else:
+                by_date[event_time_date] = event_time
+
+        rrule = occurrences.ical_rrule(recurrence)
+        until = self.get_series_until(obj, recurrence)
+        if until:
+            rrule["until"] = until
+
+        series = models.EventTime(
+            event=recurrence.event,
+            recurrence=recurrence,
+            start=expected[0].start,
+            end=expected[0].end,
+            modified=max(
+                filter(None, (event_time.modified for event_time in event_times)),
+                default=None,
+            ),
+        )
+        series.feed_uid = "{}#recurrence-{}".format(
+            recurrence.event.share_link(), recurrence.pk
+        )
+        series.feed_rrule = rrule
+        series.feed_exdates = []
+
+        changed = []
+        for occurrence in expected:
+            event_time = by_date.pop(timezone.localtime(occurrence.start).date(), None)
+            if event_time is None or event_time.is_cancelled:
+                series.feed_exdates.append(timezone.localtime(occurrence.start))
+            elif (event_time.start, event_time.end) != (
+                occurrence.start,
+                occurrence.end,
+            ):
+                event_time.feed_uid = series.feed_uid
+                event_time.feed_recurrence_id = timezone.localtime(occurrence.start)
+                changed.append(event_time)
+
+        yield series
+        yield from changed
+        yield from sorted(chain(by_date.values(), others), key=attrgetter("start"))
+
+    def get_series_until(self, obj, recurrence):
+        """The end of the feed or of the recurrence in UTC, None if neither"""
+        until = obj.end
+        if recurrence.end:
+            recurrence_end = timezone.make_aware(
+                datetime.combine(recurrence.end, datetime.min.time())
+            ) - timedelta(seconds=1)
+            until = min(until, recurrence_end) if until else recurrence_end
+        return until.astimezone(pytz.utc).replace(microsecond=0) if until else None
+
     def items(self, obj):
-        event_times = models.EventTime.objects.all()
-        if obj:
-            event_times = event_times.filter(event__spheres=obj)
-        return event_times.future()
+        return load_feed_items(
+            list(self.get_items(obj, self.get_series_recurrences(obj)))
+        )
+
+    def item_guid(self, item):
+        return getattr(item, "feed_uid", None) or self.item_link(item)
+
+    def item_rrule(self, item):
+        return getattr(item, "feed_rrule", None)
+
+    def item_exdate(self, item):
+        return getattr(item, "feed_exdates", None)
+
+    def item_extra_kwargs(self, item):
+        kwargs = super().item_extra_kwargs(item)
+        recurrence_id = getattr(item, "feed_recurrence_id", None)
+        if recurrence_id:
+            kwargs["recurrence_id"] = recurrence_id
+        return kwargs
 
     def item_link(self, item):
-        return item.event.share_link()
+        return item.event.feed_link
 
     def item_title(self, item):
         return item.event.name
@@ -57,10 +702,33 @@ class EventFeed(ICalFeed):
             self.item_link(item)
         )
 
+    def item_updateddate(self, item):
+        """
+        The newest change of the event or the time, also used for the
+        Last-Modified header of the feed
+        """
+        if item.modified:
+            return max(item.modified, item.event.modified)
+        return item.event.modified
+
+    def item_timestamp(self, item):
+        """
+        DTSTAMP, django_ical uses the time of rendering, which would make every
+        rendering of the same feed different
+        """
+        return self.item_updateddate(item)
+
     def item_start_datetime(self, item):
+        # Series repeat in local time, so daylight saving time is followed
+        if self.item_rrule(item):
+            return timezone.localtime(item.start)
         return item.start.astimezone(pytz.timezone("UTC"))
 
     def item_end_datetime(self, item):
+        if not item.end:
+            return None
+        if self.item_rrule(item):
+            return timezone.localtime(item.end)
         return item.end.astimezone(pytz.timezone("UTC"))
 
     def item_location(self, item):
@@ -74,7 +742,80 @@ class EventFeed(ICalFeed):
         return location
 
 
+class EventICalFeed(EventFeed):
+    """
+    The download of a single event with all its future times, and series for
+    its recurrences like in the feeds
+    """
+
+    def get_object(self, request, pk):
+        self.request = request
+        return FeedQuery(
+            sphere=None,
+            start=get_today_start(),
+            end=None,
+            limit=None,
+            host=None,
+            location=None,
+            event_ids=[pk],
+        )
+
+    def get_cache_key(self, obj):
+        """
+        Keyed by Event.modified and, because changes of the times don't touch
+        the event, the latest change of the event in the journal of caldav.py
+        """
+        modified, latest_change = (
+            models.Event.objects.filter(pk=obj.event_ids[0])
+            .annotate(
+                latest_change=Subquery(
+                    models.EventChange.objects.filter(event_id=OuterRef("pk"))
+                    .order_by("-pk")
+                    .values("pk")[:1]
+                )
+            )
+            .values_list("modified", "latest_change")
+            .get()
+        )
+        return "dukop_event_ical:{}:{}:{}:{}:{}".format(
+            obj.event_ids[0],
+            modified.timestamp(),
+            latest_change,
+            translation.get_language(),
+            utils.get_now().date().isoformat(),
+        )
+
+    def __call__(self, request, pk):
+        """
+        Only events that the user can see on the event page. The download is
+        revalidated every time, the ETag changes with the event and its times.
+        """
+        event = get_object_or_404(
+            models.Event.objects.visible_to(request.user).only("published"), pk=pk
+        )
+        response = super().__call__(request, pk=pk)
+        patch_cache_control(response, no_cache=True)
+        if not event.published:
+            patch_cache_control(response, private=True)
+        return response
+
+    def title(self, obj):
+        return models.Event.objects.only("name").get(pk=obj.event_ids[0]).name
+
+    def file_name(self, obj):
+        return "dukop-{}.ics".format(obj.event_ids[0])
+
+
 class DukOpEventRssGenerator(feedgenerator.Rss201rev2Feed):
+    def latest_post_date(self):
+        """
+        The start of the day for feeds without items instead of the time of
+        rendering, so an empty feed is the same all day, see publish.py
+        """
+        if not self.items:
+            return get_today_start()
+        return super().latest_post_date()
+
     def add_item_elements(self, handler, item):
         super().add_item_elements(handler, item)
         handler.addQuickElement("start_datetime", str(item["start_datetime"]))
@@ -88,6 +829,10 @@ class RssFeed(Feed):
     feed_type = DukOpEventRssGenerator
     description_template = "calendar/feeds/future.html"
 
+    #: Items without ?limit= and the most that can be asked for
+    default_limit = 30
+    max_limit = 100
+
     def get_object(self, request, *args, **kwargs):
         """
         This gets the primary object that the feed revolves around. For instance:
@@ -97,10 +842,12 @@ class RssFeed(Feed):
          * etc...
         """
         self.request = request
-        sphere_id = kwargs.get("sphere_id")
-        if sphere_id:
-            return get_object_or_404(models.Sphere, pk=sphere_id)
-        return None
+        return get_feed_query(
+            request,
+            kwargs.get("sphere_id"),
+            default_limit=self.default_limit,
+            max_limit=self.max_limit,
+        )
 
     def item_extra_kwargs(self, item):
         """
@@ -120,32 +867,41 @@ class RssFeed(Feed):
         """
         See: https://stackoverflow.com/questions/60227116/django-rss-feed-add-image-to-description
         """
-        images = []
-        for image in item.event.images.all():
-            thumbnail = get_thumbnail(image.image, "800x800", quality=90)
-            images.append(
-                feedgenerator.Enclosure(
-                    self.get_image_url(thumbnail.url),
-                    str(image.image.size),
-                    "image/{}".format(thumbnail.name.split(".")[-1]),
-                )
-            )
-        return images
+        return [
+            feedgenerator.Enclosure(self.get_image_url(url), size, mime_type)
+            for url, size, mime_type in item.event.feed_enclosures
+        ]
 
     def title(self):
         return _("Duk Op's next 30 events")
 
     def description(self, obj):
         """
-        obj: Needs to be a Sphere object
+        obj: The FeedQuery of the request
         """
         return _("RSS feed of the latest events on Duk Op")
 
     def items(self, obj):
-        event_times = models.EventTime.objects.all()
-        if obj:
-            event_times = event_times.filter(event__spheres=obj)
-        return event_times.future()[:30]
+        # The description is the fallback of the short description in the
+        # description template
+        events = (
+            models.Event.objects.for_card()
+            .only(*models.EVENT_CARD_FIELDS, "description")
+            .select_related("owner_user")
+        )
+        recurrences = filter_recurrences(
+            models.EventRecurrence.objects.prefetch_related(
+                Prefetch("event", queryset=events)
+            ),
+            obj,
+        )
+        event_times = occurrences.merge_virtual(
+            get_listings(obj)[: obj.limit].event_times(events),
+            recurrences,
+            obj.start,
+            obj.end,
+        )
+        return load_feed_items(event_times[: obj.limit], thumbnail_geometry="800x800")
 
     def feed_url(self):
         return reverse("calendar:feed_rss")
@@ -164,7 +920,7 @@ class RssFeed(Feed):
     ttl = 600  # Hard-coded Time To Live.
 
     def item_link(self, item):
-        return item.event.share_link()
+        return item.event.feed_link
 
     def item_title(self, item):
         return item.event.name
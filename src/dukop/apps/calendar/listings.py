@@ -0,0 +1,120 @@
+"""
+Maintenance of the denormalized OccurrenceListing table.
+
+Rows are never updated in place: All the rows of the affected EventTime
+objects are deleted and inserted again with a constant number of queries, no
+matter how many times an event has.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+
+from . import models
+
+
+def format_sphere_ids(sphere_ids):
+    """Turns [3, 1] into ",1,3," so a single sphere can be matched with LIKE"""
+    if not sphere_ids:
+        return ""
+    return ",{},".format(",".join(str(sphere_id) for sphere_id in sorted(sphere_ids)))
+
+
+def get_first_images(event_ids):
+    """Maps event ids to the id of their first image"""
+    first_images = {}
+    for event_id, image_id in (
+        models.EventImage.objects.filter(event_id__in=event_ids)
+        .order_by("priority", "id")
+        .values_list("event_id", "id")
+    ):
+        first_images.setdefault(event_id, image_id)
+    return first_images
+
+
+def build_listings(event_times):
+    """
+    Unsaved OccurrenceListing objects for a queryset of EventTime objects
+    """
+    event_times = list(event_times)
+    event_ids = {event_time.event_id for event_time in event_times}
+    if not event_ids:
+        return []
+
+    events = models.Event.objects.filter(pk__in=event_ids).only(
+        *models.EVENT_CARD_FIELDS
+    )
+    events = {event.pk: event for event in events}
+
+    first_images = get_first_images(event_ids)
+
+    sphere_ids = defaultdict(list)
+    for event_id, sphere_id in models.Event.spheres.through.objects.filter(
+        event_id__in=event_ids
+    ).values_list("event_id", "sphere_id"):
+        sphere_ids[event_id].append(sphere_id)
+
+    listings = []
+    for event_time in event_times:
+        event = events[event_time.event_id]
+        first_image_id = first_images.get(event.pk)
+        listings.append(
+            models.OccurrenceListing(
+                event_time_id=event_time.pk,
+                event_id=event.pk,
+                start=event_time.start,
+                end=event_time.end,
+                effective_end=event_time.effective_end,
+                name=event.name,
+                slug=event.slug,
+                venue_name=event.venue_name,
+                published=event.published,
+                featured=event.featured,
+                is_cancelled=event.is_cancelled or event_time.is_cancelled,
+                host_id=event.host_id,
+                location_id=event.location_id,
+                first_image_id=first_image_id,
+                has_image=first_image_id is not None,
+                sphere_ids=format_sphere_ids(sphere_ids[event.pk]),
+            )
+        )
+    return listings
+
+
+@transaction.atomic
+def refresh_events(event_ids):
+    """Replaces the rows of all the times of the given events"""
+    event_ids = list(event_ids)
+    models.OccurrenceListing.objects.filter(event_id__in=event_ids).delete()
+    models.OccurrenceListing.objects.bulk_create(
+        build_listings(models.EventTime.objects.filter(event_id__in=event_ids))
+    )
+
+
+@transaction.atomic
+def refresh_event_time(event_time):
+    """Replaces the row of a single EventTime"""
+    models.OccurrenceListing.objects.filter(event_time_id=event_time.pk).delete()
+    models.OccurrenceListing.objects.bulk_create(build_listings([event_time]))
+
+
+def refresh_image(event_id):
+    """
+    Updates the image fields of the existing rows of an event. Nothing is
+    inserted, so this is safe while the event is being deleted.
+    """
+    first_image_id = get_first_images([event_id]).get(event_id)
+    models.OccurrenceListing.objects.filter(event_id=event_id).update(
+        first_image_id=first_image_id, has_image=first_image_id is not None
+    )
+
+
+def rebuild(batch_size=500):
+    """
+    Rebuilds the whole table, one batch of events per transaction. Returns
+    the number of rows.
+    """
+    models.OccurrenceListing.objects.all().delete()
+    event_ids = list(models.Event.objects.order_by("pk").values_list("pk", flat=True))
+    for offset in range(0, len(event_ids), batch_size):
+        refresh_events(event_ids[offset:][:batch_size])
+    return models.OccurrenceListing.objects.all().count()
@@ -0,0 +1,186 @@
+"""
+For development purposes: Compare the speed of the occurrence expansion
+engine with the original generators that step from one occurrence to the next.
+
+Nothing is written to the database, the recurrences are built in memory.
+
+Notice that the original monthly generators only replace the date of an aware
+datetime without resolving its UTC offset again. That is why they are cheap,
+but also why their occurrences are an hour off after a DST change.
+"""
+import calendar
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from dukop.apps.calendar import models
+from dukop.apps.calendar import utils
+from dukop.apps.calendar.utils import timedelta_fixed_time
+
+
+def stepwise_occurrences(recurrence, start, end):
+    """
+    The original implementation of EventRecurrence.occurrence_generator,
+    stepping from one occurrence to the next. Kept as the reference for the
+    benchmark and the tests of occurrences.expand().
+    """
+    # We store the duration of the anchor event in order to create dynamic
+    # end times of each EventTime in the recurrence.
+    anchor = recurrence.event_time_anchor
+    duration = anchor.end - anchor.start if anchor.end else None
+
+    if recurrence.every_week:
+        yield from every_week_generator(start, end, duration)
+        return
+
+    if recurrence.biweekly_even or recurrence.biweekly_odd:
+        yield from biweekly_generator(
+            start, end, duration, even_not_odd=recurrence.biweekly_even
+        )
+    weekday = anchor.start.weekday()
+    if recurrence.first_week_of_month:
+        yield from monthly_generator(start, end, duration, weekday, offset_weeks=0)
+    if recurrence.second_week_of_month:
+        yield from monthly_generator(start, end, duration, weekday, offset_weeks=1)
+    if recurrence.third_week_of_month:
+        yield from monthly_generator(start, end, duration, weekday, offset_weeks=2)
+    if recurrence.last_week_of_month:
+        yield from last_day_of_month_generator(start, end, duration)
+
+
+def every_week_generator(start, end, duration):
+    current_start = timedelta_fixed_time(start, days=7)
+    while current_start < end:
+        current_end = current_start + duration if duration else None
+        yield current_start, current_end
+        current_start = timedelta_fixed_time(current_start, days=7)
+
+
+def biweekly_generator(start, end, duration, even_not_odd=True):
+    current_start = start
+    __, week, __ = current_start.date().isocalendar()
+
+    # We account for a case where the anchor date is in fact NOT the same
+    # even/odd week number of the series.
+    if week % 2 != (0 if even_not_odd else 1):
+        current_start = timedelta_fixed_time(current_start, days=7)
+    else:
+        current_start = timedelta_fixed_time(current_start, days=14)
+    while current_start < end:
+        current_end = current_start + duration if duration else None
+        yield current_start, current_end
+        current_start = timedelta_fixed_time(current_start, days=14)
+
+
+def monthly_generator(start, end, duration, weekday, offset_weeks=0):
+    """
+    :param: offset_weeks: The number of weeks from the beginning, 0=first week
+    """
+    current_start = start
+    while True:
+        if current_start.month == 12:
+            first_day_in_month = current_start.replace(
+                year=current_start.year + 1,
+                month=1,
+                day=1,
+            )
+        else:
+            first_day_in_month = current_start.replace(
+                month=current_start.month + 1,
+                day=1,
+            )
+        offset = weekday - first_day_in_month.weekday()
+        if offset < 0:
+            offset += 7
+        offset += 7 * offset_weeks
+        current_start = first_day_in_month.replace(
+            day=1 + offset,
+        )
+        current_end = current_start + duration if duration else None
+        if current_start >= end:
+            break
+        yield current_start, current_end
+
+
+def last_day_of_month_generator(start, end, duration):
+    current_start = start
+    target_weekday = current_start.weekday()
+    while True:
+        if current_start.month == 12:
+            next_month = 1
+            next_year = current_start.year + 1
+        else:
+            next_month = current_start.month + 1
+            next_year = current_start.year
+        # The weekday index is different in the "calendar" package so disregard
+        __, last_day = calendar.monthrange(next_year, next_month)
+        current_start = current_start.replace(
+            year=next_year, month=next_month, day=last_day
+        )
+        last_day_weekday = current_start.weekday()
+        diff = target_weekday - last_day_weekday
+        if diff > 0:
+            diff = -7 + diff
+        current_start = current_start.replace(
+            day=last_day + diff,
+        )
+        current_end = current_start + duration if duration else None
+        if current_start >= end:
+            break
+        yield current_start, current_end
+
+
+class Command(BaseCommand):
+    help = "Benchmark occurrence expansion of all recurrence types"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=365,
+            help="Length of the window that is expanded",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=100,
+            help="Number of expansions per recurrence type",
+        )
+
+    def handle(self, *args, **options):
+        days = options["days"]
+        repeat = options["repeat"]
+
+        start = utils.get_now().replace(hour=19, minute=30, second=0, microsecond=0)
+        end = start + timedelta(days=days)
+        anchor = models.EventTime(start=start, end=start + timedelta(hours=2))
+
+        self.stdout.write(
+            "{:<22} {:>6} {:>12} {:>12} {:>8}".format(
+                "type", "count", "stepwise ms", "engine ms", "speedup"
+            )
+        )
+        for type_id, __ in models.EventRecurrence.RECURRENCE_TYPES:
+            recurrence = models.EventRecurrence(
+                event_time_anchor=anchor, **{type_id: True}
+            )
+            stepwise = self.timed(
+                lambda: list(stepwise_occurrences(recurrence, start, end)),
+                repeat,
+            )
+            engine = self.timed(
+                lambda: list(recurrence.occurrence_generator(start, end)), repeat
+            )
+            count = len(list(recurrence.occurrence_generator(start, end)))
+            self.stdout.write(
+                "{:<22} {:>6} {:>12.3f} {:>12.3f} {:>7.1f}x".format(
+                    type_id, count, stepwise, engine, stepwise / engine
+                )
+            )
+
+    def timed(self, func, repeat):
+        """Average milliseconds per call"""
+        began = time.perf_counter()
+        for __ in range(repeat):
+            func()
+        return (time.perf_counter() - began) * 1000 / repeat
@@ -0,0 +1,141 @@
+"""
+Extends all recurrences with EventTime objects up until a rolling horizon.
+
+Meant to be run nightly. Every EventRecurrence knows how far it has been
+materialized, so only the tail of each series is generated and already
+existing EventTime objects are never touched.
+"""
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from itertools import repeat
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db import transaction
+from django.db.models import F
+from django.db.models import Q
+from django.utils import timezone
+from dukop.apps.calendar import models
+from dukop.apps.calendar import occurrences
+from dukop.apps.calendar import utils
+
+
+def extend_recurrences(recurrence_ids, horizon, batch_size=500):
+    """
+    Extends the given recurrences in batches. Each batch costs a constant
+    number of queries, regardless of how many times are created.
+
+    Returns the number of created EventTime objects.
+    """
+    created = 0
+    for offset in range(0, len(recurrence_ids), batch_size):
+        batch_end = offset + batch_size
+        batch = recurrence_ids[offset:batch_end]
+        with transaction.atomic():
+            recurrences = (
+                models.EventRecurrence.objects.filter(pk__in=batch)
+                .select_related("event_time_anchor")
+                .select_for_update(of=("self",))
+            )
+
+            # Dates that are already occupied beyond the watermark, for
+            # instance by an overlapping recurrence type.
+            existing_dates = defaultdict(set)
+            for recurrence_id, start in models.EventTime.objects.filter(
+                recurrence_id__in=batch,
+                start__date__gte=F("recurrence__materialized_until"),
+            ).values_list("recurrence_id", "start"):
+                existing_dates[recurrence_id].add(timezone.localtime(start).date())
+
+            new_times = []
+            extended = []
+            for recurrence in recurrences:
+                event_times, watermark = recurrence.tail_event_times(
+                    horizon=horizon,
+                    existing_dates=existing_dates[recurrence.pk],
+                )
+                new_times += event_times
+                if watermark != recurrence.materialized_until:
+                    recurrence.materialized_until = watermark
+                    extended.append(recurrence)
+
+            models.EventTime.objects.bulk_create(new_times)
+            models.EventRecurrence.objects.bulk_update(extended, ["materialized_until"])
+            if new_times:
+                models.event_times_bulk_changed.send(
+                    sender=models.EventRecurrence,
+                    event_ids={event_time.event_id for event_time in new_times},
+                )
+            created += len(new_times)
+    return created
+
+
+class Command(BaseCommand):
+    help = "Extend recurring events with new times up until a rolling horizon"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--horizon",
+            type=int,
+            default=180,
+            help="Number of days from now that recurrences are materialized",
+        )
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=1,
+            help="Number of worker processes, recurrences are sharded by their ID. Use 1 with SQLite.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of recurrences handled per transaction",
+        )
+
+    def handle(self, *args, **options):
+        horizon = options["horizon"]
+        processes = max(1, options["processes"])
+        batch_size = options["batch_size"]
+
+        if occurrences.virtual_recurrences_enabled():
+            self.stdout.write("Virtual recurrences are enabled, nothing to extend")
+            return
+
+        horizon_date = (utils.get_now() + timedelta(days=horizon)).date()
+        recurrence_ids = list(
+            models.EventRecurrence.objects.exclude(event_time_anchor=None)
+            .filter(Q(materialized_until=None) | Q(materialized_until__lt=horizon_date))
+            .exclude(end__isnull=False, end__lte=F("materialized_until"))
+            .order_by("pk")
+            .values_list("pk", flat=True)
+        )
+        self.stdout.write(
+            "Extending {} recurrences until {}".format(
+                len(recurrence_ids), horizon_date
+            )
+        )
+
+        if processes == 1:
+            created = extend_recurrences(recurrence_ids, horizon, batch_size)
+        else:
+            shards = [
+                [pk for pk in recurrence_ids if pk % processes == shard]
+                for shard in range(processes)
+            ]
+            # Workers must not share the database connection of this process
+            connections.close_all()
+            with ProcessPoolExecutor(
+                max_workers=processes, initializer=django.setup
+            ) as pool:
+                created = sum(
+                    pool.map(
+                        extend_recurrences, shards, repeat(horizon), repeat(batch_size)
+                    )
+                )
+
+        self.stdout.write(
+            self.style.SUCCESS("Created {} new event times".format(created))
+        )
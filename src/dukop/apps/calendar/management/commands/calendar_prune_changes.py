@@ -0,0 +1,23 @@
+"""
+Removes old rows of the change journal of the CalDAV collections, see
+:mod:`dukop.apps.calendar.caldav`. Clients with a sync token from before the
+oldest kept row do a full sync.
+"""
+from django.core.management.base import BaseCommand
+from dukop.apps.calendar import caldav
+
+
+class Command(BaseCommand):
+    help = "Remove old rows of the change journal of the CalDAV collections"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=caldav.CHANGES_MAX_AGE_DAYS,
+            help="Keep changes of this many days",
+        )
+
+    def handle(self, *args, **options):
+        removed = caldav.prune_changes(options["days"])
+        self.stdout.write(self.style.SUCCESS("Removed {} changes".format(removed)))
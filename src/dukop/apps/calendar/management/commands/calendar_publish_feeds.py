@@ -0,0 +1,34 @@
+"""
+Writes the feeds as static files, see :mod:`dukop.apps.calendar.publish`.
+
+Meant to be run every minute. Nothing is rendered unless the feeds have
+changed and the changes have settled, or the day has changed.
+"""
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from dukop.apps.calendar import publish
+
+
+class Command(BaseCommand):
+    help = "Publish the feeds as static files if they have changed"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Publish even if nothing has changed",
+        )
+
+    def handle(self, *args, **options):
+        root = publish.get_publish_root()
+        if not root:
+            raise CommandError("DUKOP_FEED_PUBLISH_ROOT is not set")
+
+        if not options["force"] and not publish.is_due(root):
+            self.stdout.write("Nothing to publish")
+            return
+
+        changed = publish.publish_feeds(root)
+        self.stdout.write(
+            self.style.SUCCESS("Published feeds, {} changed".format(changed))
+        )
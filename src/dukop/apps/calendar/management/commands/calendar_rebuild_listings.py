@@ -0,0 +1,23 @@
+"""
+Rebuilds the denormalized OccurrenceListing table from scratch. The table is
+kept in sync by signals, so this is only needed after changing data without
+them, e.g. with raw SQL or ``QuerySet.update()``.
+"""
+from django.core.management.base import BaseCommand
+from dukop.apps.calendar import listings
+
+
+class Command(BaseCommand):
+    help = "Rebuild the denormalized listing of all event times"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of events handled per transaction",
+        )
+
+    def handle(self, *args, **options):
+        count = listings.rebuild(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS("Rebuilt {} listings".format(count)))
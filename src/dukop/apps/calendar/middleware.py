@@ -1,4 +1,4 @@
-from . import models
+from . import spheres
 
 
 def sphere_middleware(get_response):
@@ -8,7 +8,8 @@ def sphere_middleware(get_response):
 
     def middleware(request):
 
-        request.sphere = models.Sphere.get_by_id_or_default_cached(
+        spheres.registry.check()
+        request.sphere = spheres.registry.get_by_id_or_default(
             sphere_id=request.session.get("dukop_sphere", None)
         )
         request.session["dukop_sphere"] = request.sphere.id
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calendar', '0023_alter_eventrecurrence_end'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eventrecurrence',
+            name='materialized_until',
+            field=models.DateField(blank=True, editable=False, null=True, verbose_name='materialized until'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:40
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def deduplicate_slugs(apps, schema_editor):
+    """
+    Before the slugs are made unique, rows that share a slug keep it on the
+    oldest row and get a free numeric suffix on the others. Empty slugs are
+    cleared, they are displayed the same as no slug.
+    """
+    for model_name in ("Event", "Sphere"):
+        Model = apps.get_model('calendar', model_name)
+        duplicates = (
+            Model.objects.exclude(slug=None)
+            .values('slug')
+            .annotate(count=Count('id'))
+            .filter(count__gt=1)
+            .values_list('slug', flat=True)
+        )
+        for slug in list(duplicates):
+            rows = Model.objects.filter(slug=slug).order_by('id')[1:]
+            taken = set(
+                Model.objects.filter(slug__startswith=slug[:40]).values_list('slug', flat=True)
+            )
+            suffix_number = 1
+            for row in rows:
+                if not slug:
+                    row.slug = None
+                else:
+                    proposal = slug
+                    while proposal in taken:
+                        suffix_number += 1
+                        suffix = "-{}".format(suffix_number)
+                        proposal = slug[:50 - len(suffix)] + suffix
+                    taken.add(proposal)
+                    row.slug = proposal
+                row.save(update_fields=['slug'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calendar', '0024_recurrence_materialized_until'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate_slugs, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='event',
+            name='slug',
+            field=models.SlugField(blank=True, help_text='The part of a URL that is displayed in dukop.dk/event/<slug>/', null=True, unique=True, verbose_name='slug'),
+        ),
+        migrations.AlterField(
+            model_name='sphere',
+            name='slug',
+            field=models.SlugField(blank=True, help_text='The part of a URL that is displayed in dukop.dk/sphere/<slug>/', null=True, unique=True, verbose_name='slug'),
+        ),
+    ]
@@ -0,0 +1,88 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_listings(apps, schema_editor):
+    """Same as the calendar_rebuild_listings command"""
+    Event = apps.get_model('calendar', 'Event')
+    EventImage = apps.get_model('calendar', 'EventImage')
+    EventTime = apps.get_model('calendar', 'EventTime')
+    OccurrenceListing = apps.get_model('calendar', 'OccurrenceListing')
+
+    first_images = {}
+    for event_id, image_id in EventImage.objects.order_by('priority', 'id').values_list('event_id', 'id'):
+        first_images.setdefault(event_id, image_id)
+    sphere_ids = {}
+    for event_id, sphere_id in Event.spheres.through.objects.order_by('sphere_id').values_list('event_id', 'sphere_id'):
+        sphere_ids.setdefault(event_id, []).append(str(sphere_id))
+
+    listings = []
+    for event_time in EventTime.objects.select_related('event').iterator():
+        event = event_time.event
+        first_image_id = first_images.get(event.pk)
+        listings.append(
+            OccurrenceListing(
+                event_time_id=event_time.pk,
+                event_id=event.pk,
+                start=event_time.start,
+                end=event_time.end,
+                effective_end=event_time.end or event_time.start,
+                name=event.name,
+                slug=event.slug,
+                venue_name=event.venue_name,
+                published=event.published,
+                featured=event.featured,
+                is_cancelled=event.is_cancelled or event_time.is_cancelled,
+                host_id=event.host_id,
+                location_id=event.location_id,
+                first_image_id=first_image_id,
+                has_image=first_image_id is not None,
+                sphere_ids=",{},".format(",".join(sphere_ids[event.pk])) if event.pk in sphere_ids else "",
+            )
+        )
+    OccurrenceListing.objects.bulk_create(listings, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calendar', '0025_unique_slugs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OccurrenceListing',
+            fields=[
+                ('event_time', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='listing', serialize=False, to='calendar.eventtime')),
+                ('start', models.DateTimeField()),
+                ('end', models.DateTimeField(null=True)),
+                ('effective_end', models.DateTimeField()),
+                ('name', models.CharField(max_length=255)),
+                ('slug', models.SlugField(null=True)),
+                ('venue_name', models.CharField(max_length=255, null=True)),
+                ('published', models.BooleanField()),
+                ('featured', models.BooleanField()),
+                ('is_cancelled', models.BooleanField()),
+                ('host_id', models.IntegerField(null=True)),
+                ('location_id', models.IntegerField(null=True)),
+                ('has_image', models.BooleanField()),
+                ('sphere_ids', models.CharField(blank=True, max_length=255)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='calendar.event')),
+                ('first_image', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='calendar.eventimage')),
+            ],
+            options={
+                'ordering': ('start', 'end'),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='occurrencelisting',
+            index=models.Index(fields=['start', 'end'], name='calendar_oc_start_d8d6a4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='occurrencelisting',
+            index=models.Index(fields=['effective_end'], name='calendar_oc_effecti_fd8405_idx'),
+        ),
+        migrations.RunPython(populate_listings, migrations.RunPython.noop),
+    ]
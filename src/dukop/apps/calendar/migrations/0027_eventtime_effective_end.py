@@ -0,0 +1,42 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:48
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def backfill_effective_end(apps, schema_editor):
+    EventTime = apps.get_model('calendar', 'EventTime')
+    EventTime.objects.update(effective_end=Coalesce('end', 'start'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calendar', '0026_occurrence_listing'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='occurrencelisting',
+            name='calendar_oc_effecti_fd8405_idx',
+        ),
+        migrations.AddField(
+            model_name='eventtime',
+            name='effective_end',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_effective_end, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='eventtime',
+            name='effective_end',
+            field=models.DateTimeField(editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='eventtime',
+            index=models.Index(fields=['effective_end', 'start'], name='calendar_ev_effecti_9c3a42_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='occurrencelisting',
+            index=models.Index(fields=['effective_end', 'start'], name='calendar_oc_effecti_225863_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("calendar", "0027_eventtime_effective_end"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="occurrencelisting",
+            index=models.Index(
+                fields=["start", "event_time"], name="calendar_oc_start_aee091_idx"
+            ),
+        ),
+    ]
@@ -1,17 +1,19 @@
-import calendar
 import os
-import random
-import string
 import uuid
 from builtins import staticmethod
+from collections import namedtuple
 from datetime import datetime
-from functools import lru_cache
+from datetime import timedelta
+from functools import partial
 
 from django.contrib.sites.models import Site
-from django.core.cache import cache
+from django.db import IntegrityError
 from django.db import models
 from django.db import transaction
+from django.db.models import Prefetch
 from django.db.models import Q
+from django.db.models.functions import Substr
+from django.dispatch import Signal
 from django.template.defaultfilters import truncatewords
 from django.urls.base import reverse
 from django.utils import timezone
@@ -23,6 +25,7 @@ from dukop.apps.calendar.utils import display_time
 from dukop.apps.calendar.utils import timedelta_fixed_time
 from sorl.thumbnail import get_thumbnail
 
+from . import occurrences
 from . import utils
 
 
@@ -32,31 +35,148 @@ def image_upload_to(instance, filename):
     return os.path.join("uploads/events", filename)
 
 
+#: Max length of the slug fields
+SLUG_MAX_LENGTH = 50
+
+#: Number of times a slug is allocated again when another worker took it first
+SLUG_ALLOCATION_ATTEMPTS = 5
+
+
 def sluggify_instance(instance, ModelClass, name_field, slug_field):
     """
     Auto-populates a slug field if it isn't filled in.
+
+    When the slugified name is taken, the lowest free suffix is appended, e.g.
+    "faellesspisning-3". All the taken slugs with the same prefix are fetched
+    in one query.
     """
     if not instance.pk and not getattr(instance, slug_field, None):
-        proposal = slugify(getattr(instance, name_field))[:50]
+        base = slugify(getattr(instance, name_field)) or ModelClass._meta.model_name
+        prefix = base[: SLUG_MAX_LENGTH - 10]
+        taken = set(
+            ModelClass.objects.filter(
+                **{slug_field + "__startswith": prefix}
+            ).values_list(slug_field, flat=True)
+        )
+        proposal = base[:SLUG_MAX_LENGTH]
+        suffix_number = 1
+        while proposal in taken:
+            suffix_number += 1
+            suffix = "-{}".format(suffix_number)
+            proposal = base[: SLUG_MAX_LENGTH - len(suffix)] + suffix
+        setattr(instance, slug_field, proposal)
+
 
-        def _proposal_exists():
-            return ModelClass.objects.filter(**{slug_field: proposal}).exists()
+def save_sluggified(instance, ModelClass, name_field, slug_field, save):
+    """
+    Calls ``save()`` after auto-populating the slug of a new instance.
 
-        proposal_exists = _proposal_exists()
-        while proposal_exists:
-            to_append = "".join(
-                random.choice(string.ascii_uppercase + string.digits) for _ in range(10)
+    The slug fields are unique, so if another worker saves the same slug
+    between the allocation and our insert, the IntegrityError is caught and
+    the next free slug is allocated.
+    """
+    if instance.pk or getattr(instance, slug_field, None):
+        return save()
+    for attempt in range(SLUG_ALLOCATION_ATTEMPTS):
+        sluggify_instance(instance, ModelClass, name_field, slug_field)
+        try:
+            with transaction.atomic():
+                return save()
+        except IntegrityError:
+            proposal = getattr(instance, slug_field)
+            slug_taken = ModelClass.objects.filter(**{slug_field: proposal}).exists()
+            if not slug_taken or attempt == SLUG_ALLOCATION_ATTEMPTS - 1:
+                raise
+            setattr(instance, slug_field, None)
+
+
+#: Columns needed to link to an event in a listing
+EVENT_BARE_FIELDS = (
+    "id",
+    "name",
+    "slug",
+    "venue_name",
+    "published",
+    "is_cancelled",
+)
+
+#: Columns needed for event cards and feed items, without the description
+EVENT_CARD_FIELDS = EVENT_BARE_FIELDS + (
+    "short_description",
+    "host",
+    "location",
+    "owner_user",
+    "featured",
+    "online",
+    "location_tba",
+    "street",
+    "city",
+    "zip_code",
+    "created",
+    "modified",
+)
+
+#: Length of the description excerpt that cards are annotated with, so
+#: descriptions can be truncated without loading the whole text
+CARD_DESCRIPTION_LENGTH = 200
+
+
+class EventQuerySet(models.QuerySet):
+    def bare(self):
+        """Only what it takes to link to the events, no relations"""
+        return self.only(*EVENT_BARE_FIELDS)
+
+    def for_card(self):
+        """
+        Everything the truncated event card and the feeds show. Instead of the
+        description, the events are annotated with ``description_excerpt``.
+        """
+        return (
+            self.only(*EVENT_CARD_FIELDS)
+            .annotate(
+                description_excerpt=Substr("description", 1, CARD_DESCRIPTION_LENGTH)
             )
-            proposal = proposal[:40] + to_append
-            proposal_exists = _proposal_exists()
-        setattr(instance, slug_field, proposal)
+            .select_related("host")
+            .prefetch_related("images", "recurrences")
+        )
+
+    def for_detail(self):
+        """All columns and the relations shown on the event page"""
+        return self.select_related("host", "location", "owner_user").prefetch_related(
+            "images", "links", "recurrences"
+        )
+
+    def visible_to(self, user):
+        """
+        Published events, and for logged-in users also the ones they or their
+        groups own. Staff can see all events.
+        """
+        if user.is_staff:
+            return self
+        if not user.is_authenticated:
+            return self.filter(published=True)
+        # A subquery, so events of several groups of the user are not repeated
+        group_events = self.model.objects.filter(owner_group__members=user)
+        return self.filter(
+            Q(published=True) | Q(owner_user=user) | Q(pk__in=group_events.values("pk"))
+        )
 
 
 class EventManager(models.Manager):
     def get_queryset(self):
-        return (
-            super().get_queryset().prefetch_related("times").prefetch_related("images")
-        )
+        return EventQuerySet(self.model, using=self._db)
+
+    def bare(self):
+        return self.get_queryset().bare()
+
+    def for_card(self):
+        return self.get_queryset().for_card()
+
+    def for_detail(self):
+        return self.get_queryset().for_detail()
+
+    def visible_to(self, user):
+        return self.get_queryset().visible_to(user)
 
 
 class EventTimeQuerySet(models.QuerySet):
@@ -65,7 +185,21 @@ class EventTimeQuerySet(models.QuerySet):
             now = utils.get_now().replace(minute=0, hour=0, second=0)
         else:
             now = utils.get_now()
-        return self.filter(Q(start__gte=now) | Q(end__gte=now))
+        return self.filter(effective_end__gte=now)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        """Sets effective_end, bulk_create() does not call save()"""
+        objs = list(objs)
+        for event_time in objs:
+            event_time.effective_end = event_time.end or event_time.start
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def with_events(self, event_queryset):
+        """
+        Loads the events with one of the querysets of EventQuerySet, e.g.
+        ``with_events(Event.objects.for_card())``
+        """
+        return self.prefetch_related(Prefetch("event", queryset=event_queryset))
 
 
 class EventTimeManager(models.Manager):
@@ -87,6 +221,8 @@ class Sphere(models.Model):
     slug = models.SlugField(
         null=True,
         blank=True,
+        unique=True,
+        max_length=SLUG_MAX_LENGTH,
         verbose_name=_("slug"),
         help_text=_("The part of a URL that is displayed in dukop.dk/sphere/<slug>/"),
     )
@@ -104,8 +240,9 @@ class Sphere(models.Model):
         verbose_name_plural = _("Spheres")
 
     def save(self, *args, **kwargs):
-        sluggify_instance(self, Sphere, "name", "slug")
-        return super().save(*args, **kwargs)
+        return save_sluggified(
+            self, Sphere, "name", "slug", partial(super().save, *args, **kwargs)
+        )
 
     def __str__(self):
         return self.name
@@ -113,8 +250,8 @@ class Sphere(models.Model):
     @staticmethod
     def get_default():
         """
-        This can be cached in-memory insofar that we don't do any more funky
-        stuff with the Spheres, like related querysets etc.
+        Fetches or creates the default sphere. Use
+        ``spheres.registry.get_default()`` for the in-memory version.
         """
         try:
             return Sphere.objects.get(default=True)
@@ -123,31 +260,6 @@ class Sphere(models.Model):
                 name="Auto-created sphere", slug="auto", default=True
             )
 
-    @staticmethod
-    def get_default_cached():
-        """
-        This can be cached in-memory insofar that we don't do any more funky
-        stuff with the Spheres, like related querysets etc.
-        """
-        if hasattr(Sphere, "_cached_default"):
-            return Sphere._cached_default
-        else:
-            Sphere._cached_default = Sphere.get_default()
-            return Sphere._cached_default
-
-    @staticmethod
-    def get_all_cached():
-        """
-        This can be cached in-memory insofar that we don't do any more funky
-        stuff with the Spheres, like related querysets etc.
-        """
-        spheres = cache.get("dukop_all_spheres", None)
-        if not spheres:
-            spheres = list(Sphere.objects.all().order_by("default"))
-            cache.set("dukop_all_spheres", spheres)
-
-        return spheres
-
     @staticmethod
     def get_by_id_or_default(sphere_id=None):
         """
@@ -160,14 +272,6 @@ class Sphere(models.Model):
         except Sphere.DoesNotExist:
             return Sphere.get_default()
 
-    @staticmethod
-    @lru_cache(maxsize=128)
-    def get_by_id_or_default_cached(sphere_id=None):
-        """
-        Fetches a sphere by its ID or returns the default sphere
-        """
-        return Sphere.get_by_id_or_default(sphere_id=sphere_id)
-
 
 class Event(models.Model):
     """
@@ -213,6 +317,8 @@ class Event(models.Model):
     slug = models.SlugField(
         null=True,
         blank=True,
+        unique=True,
+        max_length=SLUG_MAX_LENGTH,
         verbose_name=_("slug"),
         help_text=_("The part of a URL that is displayed in dukop.dk/event/<slug>/"),
     )
@@ -319,8 +425,9 @@ class Event(models.Model):
         """
         Auto-populates the slug field if it isn't filled in.
         """
-        sluggify_instance(self, Event, "name", "slug")
-        return super().save(*args, **kwargs)
+        return save_sluggified(
+            self, Event, "name", "slug", partial(super().save, *args, **kwargs)
+        )
 
     def __str__(self):
         return self.name
@@ -384,6 +491,9 @@ class EventTime(models.Model):
         blank=True,
         null=True,
     )
+    #: The end or, if there is none, the start. Maintained by save() and
+    #: bulk_create(), so "has not ended yet" is one range predicate.
+    effective_end = models.DateTimeField(editable=False)
     created = models.DateTimeField(auto_now_add=True)
     modified = models.DateTimeField(auto_now=True)
     is_cancelled = models.BooleanField(default=False)
@@ -415,6 +525,11 @@ class EventTime(models.Model):
     class Meta:
         verbose_name = _("Event time")
         ordering = ("start", "end")
+        indexes = [models.Index(fields=["effective_end", "start"])]
+
+    def save(self, *args, **kwargs):
+        self.effective_end = self.end or self.start
+        return super().save(*args, **kwargs)
 
     def __str__(self):
         representation = display_datetime(self.start)
@@ -505,6 +620,109 @@ class EventLink(models.Model):
         ordering = ("priority", "link")
 
 
+class OccurrenceListingQuerySet(models.QuerySet):
+    def future(self, truncate_time_today=True):
+        """Same as ``EventTimeQuerySet.future()``"""
+        if truncate_time_today:
+            now = utils.get_now().replace(minute=0, hour=0, second=0)
+        else:
+            now = utils.get_now()
+        return self.filter(effective_end__gte=now)
+
+    def for_sphere(self, sphere):
+        return self.filter(sphere_ids__contains=",{},".format(sphere.pk))
+
+    def event_times(self, event_queryset=None):
+        """
+        Fetches the EventTime objects of the listings, in the same order. The
+        events are loaded with ``event_queryset``, see EventQuerySet.
+        """
+        event_time_ids = list(self.values_list("event_time_id", flat=True))
+        event_times = EventTime.objects.filter(pk__in=event_time_ids)
+        if event_queryset is not None:
+            event_times = event_times.with_events(event_queryset)
+        by_id = {event_time.pk: event_time for event_time in event_times}
+        return [by_id[pk] for pk in event_time_ids if pk in by_id]
+
+
+class OccurrenceListing(models.Model):
+    """
+    A denormalized copy of every EventTime with the fields of its Event that
+    the public listings filter on. Listings are single-table range scans on
+    ``start`` instead of joins through events, spheres and images.
+
+    The rows are maintained by the signals in ``signals.py`` and can be rebuilt
+    with the ``calendar_rebuild_listings`` command.
+    """
+
+    event_time = models.OneToOneField(
+        EventTime,
+        primary_key=True,
+        on_delete=models.CASCADE,
+        related_name="listing",
+    )
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name="+")
+
+    start = models.DateTimeField()
+    end = models.DateTimeField(null=True)
+    #: The end or, if there is none, the start
+    effective_end = models.DateTimeField()
+
+    name = models.CharField(max_length=255)
+    slug = models.SlugField(null=True, max_length=SLUG_MAX_LENGTH)
+    venue_name = models.CharField(max_length=255, null=True)
+
+    published = models.BooleanField()
+    featured = models.BooleanField()
+    #: The event or just this time is cancelled
+    is_cancelled = models.BooleanField()
+    host_id = models.IntegerField(null=True)
+    location_id = models.IntegerField(null=True)
+
+    first_image = models.ForeignKey(
+        EventImage, null=True, on_delete=models.SET_NULL, related_name="+"
+    )
+    has_image = models.BooleanField()
+    #: All sphere ids of the event in the form ",1,3,"
+    sphere_ids = models.CharField(max_length=255, blank=True)
+
+    objects = OccurrenceListingQuerySet.as_manager()
+
+    class Meta:
+        ordering = ("start", "end")
+        indexes = [
+            models.Index(fields=["start", "end"]),
+            models.Index(fields=["effective_end", "start"]),
+            # The order of the pages of the JSON API, see api.py
+            models.Index(fields=["start", "event_time"]),
+        ]
+
+
+class EventChange(models.Model):
+    """
+    A journal of the changes of events, their times and recurrences, written
+    by the signals in ``signals.py``. The id of the latest row is the sync
+    token of the CalDAV collections, see ``caldav.py``.
+
+    Deleted events stay in the journal, so ``event_id`` is not a foreign key.
+    Old rows are removed with the ``calendar_prune_changes`` command.
+    """
+
+    event_id = models.IntegerField(db_index=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+
+#: Sent after EventTime objects of the events in ``event_ids`` have been
+#: created, updated or deleted in bulk, which does not send post_save
+event_times_bulk_changed = Signal()
+
+
+#: Summary of the rows written by ``EventRecurrence.sync()``
+RecurrenceSyncResult = namedtuple(
+    "RecurrenceSyncResult", ["inserted", "updated", "removed"]
+)
+
+
 class EventRecurrence(models.Model):
     """
     Inspired by RRULE for iCal format:
@@ -562,6 +780,16 @@ class EventRecurrence(models.Model):
         verbose_name=_("End of series"),
     )
 
+    #: The date until which EventTime objects of this recurrence have been
+    #: created (exclusive). Everything before it has been materialized, and
+    #: extending the series only needs to generate what comes after.
+    materialized_until = models.DateField(
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name=_("materialized until"),
+    )
+
     created = models.DateTimeField(auto_now_add=True)
     modified = models.DateTimeField(auto_now=True)
 
@@ -590,31 +818,139 @@ class EventRecurrence(models.Model):
         Creates the necessary EventTime objects for an Event.
         That is to say: Given a "main" or "prototype" event, populate a series
         of copied EventTime for some maximum, respecting
+
+        The difference between the existing and the generated series is
+        computed in memory and written with one bulk insert, one bulk update
+        and one delete. Returns a ``RecurrenceSyncResult`` with the counts.
+
+        With virtual recurrences enabled, nothing but the anchor is stored.
         """
         if create_old_times:
             start = self.event_time_anchor.start
         else:
             start = max(utils.get_now(), self.event_time_anchor.start)
 
+        # Virtual occurrences are expanded when listed, so only the anchor is
+        # kept and automatically created times are removed.
+        if occurrences.virtual_recurrences_enabled():
+            maximum = 0
+
         existing_times = {
-            et.start.date(): et
+            timezone.localtime(et.start).date(): et
             for et in self.times.filter(
                 recurrence_auto=True, start__date__gte=start.date()
             )
         }
-        updated_times = []
+
+        # Snapshot of the fields that the generator may touch, so we can tell
+        # which of the existing rows actually need to be written.
+        original_state = {
+            et.pk: self._sync_state(et)
+            for et in list(existing_times.values()) + [self.event_time_anchor]
+        }
+
+        new_times = {}
+        changed_times = {}
+        seen_ids = set()
         for event_time in self.event_time_generator(start, maximum, existing_times):
-            event_time.save()
-            updated_times.append(event_time)
+            if event_time.pk:
+                seen_ids.add(event_time.pk)
+                if self._sync_state(event_time) != original_state.get(event_time.pk):
+                    changed_times[event_time.pk] = event_time
+            else:
+                # Overlapping recurrence types may yield the same date twice
+                new_times.setdefault(event_time.start, event_time)
+
+        EventTime.objects.bulk_create(new_times.values())
+
+        now = timezone.now()
+        for event_time in changed_times.values():
+            event_time.modified = now
+        EventTime.objects.bulk_update(
+            changed_times.values(), ["recurrence", "recurrence_auto", "modified"]
+        )
 
         # Delete everything that existed before but is not part of this generated series
-        for et in existing_times.values():
-            if et not in updated_times:
-                et.delete()
+        stale_ids = [et.pk for et in existing_times.values() if et.pk not in seen_ids]
+        removed = 0
+        if stale_ids:
+            __, removed_per_model = EventTime.objects.filter(pk__in=stale_ids).delete()
+            removed = removed_per_model.get(EventTime._meta.label, 0)
+
+        self.materialized_until = self.series_end(start, maximum).date()
+        EventRecurrence.objects.filter(pk=self.pk).update(
+            materialized_until=self.materialized_until
+        )
+        if new_times or changed_times or removed:
+            event_times_bulk_changed.send(
+                sender=EventRecurrence, event_ids=[self.event_id]
+            )
 
-    def event_time_generator(  # noqa: max-complexity: 16
-        self, start, maximum, existing_times
-    ):
+        return RecurrenceSyncResult(
+            inserted=len(new_times), updated=len(changed_times), removed=removed
+        )
+
+    def get_materialized_until(self):
+        """
+        Returns the watermark of the series. Recurrences that were synced
+        before the watermark existed get it from their latest EventTime.
+        """
+        if self.materialized_until:
+            return self.materialized_until
+        latest = self.times.aggregate(latest=models.Max("start"))["latest"]
+        latest = latest or self.event_time_anchor.start
+        return timezone.localtime(latest).date() + timedelta(days=1)
+
+    def tail_event_times(self, horizon=180, existing_dates=None):
+        """
+        Creates unsaved EventTime objects for the part of the series that lies
+        between the watermark and ``horizon`` days from now. Times that are
+        already materialized are never touched, and dates in ``existing_dates``
+        are skipped. A watermark in the past does not backfill old times, the
+        tail starts today at the earliest like sync() does.
+
+        Returns the list of new EventTime objects and the new watermark.
+        """
+        assert self.event_time_anchor, "Needs event_time_anchor (the first occurrence)"
+        existing_dates = existing_dates or set()
+        watermark = self.get_materialized_until()
+        end = self.series_end(utils.get_now(), horizon)
+        if end.date() <= watermark:
+            return [], watermark
+
+        start = timezone.make_aware(
+            datetime.combine(
+                max(watermark, timezone.localtime(utils.get_now()).date()),
+                datetime.min.time(),
+            )
+        )
+        event_times = []
+        for event_time_start, event_time_end in self.occurrence_generator(start, end):
+            event_time_date = timezone.localtime(event_time_start).date()
+            if event_time_date in existing_dates:
+                continue
+            existing_dates.add(event_time_date)
+            event_times.append(
+                EventTime(
+                    event_id=self.event_id,
+                    recurrence=self,
+                    recurrence_auto=True,
+                    start=event_time_start,
+                    end=event_time_end,
+                )
+            )
+        return event_times, end.date()
+
+    @staticmethod
+    def _sync_state(event_time):
+        return (
+            event_time.recurrence_id,
+            event_time.recurrence_auto,
+            event_time.start,
+            event_time.end,
+        )
+
+    def event_time_generator(self, start, maximum, existing_times):
         """A generator that yields new EventTime objects (unsaved)"""
         assert self.event_time_anchor, "Needs event_time_anchor (the first occurrence)"
 
@@ -625,68 +961,30 @@ class EventRecurrence(models.Model):
                 existing_times, event_time=self.event_time_anchor
             )
 
-        # The end of the recurrence, either as given by an explicit user-defined
-        # end datetime or as a number of days relative to the start of the
-        # recurrence.
+        end = self.series_end(start, maximum)
+        for event_time_start, event_time_end in self.occurrence_generator(start, end):
+            yield self.update_or_add_to_recurrence(
+                existing_times, event_time_start, event_time_end
+            )
+
+    def series_end(self, start, maximum):
+        """
+        The end of the recurrence, either as given by an explicit user-defined
+        end datetime or as a number of days relative to the start of the
+        recurrence.
+        """
         system_wide_maximum = timedelta_fixed_time(start, days=maximum).date()
         end = self.end or system_wide_maximum
-        end = timezone.make_aware(
+        return timezone.make_aware(
             datetime.combine(min(end, system_wide_maximum), datetime.min.time())
         )
 
-        # We store the duration of the anchor event in order to create dynamic
-        # end times of each EventTime in the recurrence.
-        if self.event_time_anchor.end:
-            duration = self.event_time_anchor.end - self.event_time_anchor.start
-        else:
-            duration = None
-
-        if self.every_week:
-            for event_time_start, event_time_end in self._every_week_generator(
-                start, end, duration
-            ):
-                yield self.update_or_add_to_recurrence(
-                    existing_times, event_time_start, event_time_end
-                )
-
-        else:
-            if self.biweekly_even or self.biweekly_odd:
-                for event_time_start, event_time_end in self._biweekly_generator(
-                    start, end, duration, even_not_odd=self.biweekly_even
-                ):
-                    yield self.update_or_add_to_recurrence(
-                        existing_times, event_time_start, event_time_end
-                    )
-
-            if self.first_week_of_month:
-                for event_time_start, event_time_end in self._monthly_generator(
-                    start, end, duration, offset_weeks=0
-                ):
-                    yield self.update_or_add_to_recurrence(
-                        existing_times, event_time_start, event_time_end
-                    )
-            if self.second_week_of_month:
-                for event_time_start, event_time_end in self._monthly_generator(
-                    start, end, duration, offset_weeks=1
-                ):
-                    yield self.update_or_add_to_recurrence(
-                        existing_times, event_time_start, event_time_end
-                    )
-            if self.third_week_of_month:
-                for event_time_start, event_time_end in self._monthly_generator(
-                    start, end, duration, offset_weeks=2
-                ):
-                    yield self.update_or_add_to_recurrence(
-                        existing_times, event_time_start, event_time_end
-                    )
-            if self.last_week_of_month:
-                for (
-                    event_time_start,
-                    event_time_end,
-                ) in self._last_day_of_month_generator(start, end, duration):
-                    yield self.update_or_add_to_recurrence(
-                        existing_times, event_time_start, event_time_end
-                    )
+    def occurrence_generator(self, start, end):
+        """
+        Yields (start, end) tuples of the occurrences from the date of
+        ``start`` and before ``end``, not including the anchor itself.
+        """
+        yield from occurrences.expand(self, start, end)
 
     def update_or_add_to_recurrence(
         self,
@@ -701,8 +999,9 @@ class EventRecurrence(models.Model):
         """
         assert event_time_start or event_time
         if event_time_start:
-            if event_time_start.date() in existing_times:
-                event_time = existing_times[event_time_start.date()]
+            event_time_date = timezone.localtime(event_time_start).date()
+            if event_time_date in existing_times:
+                event_time = existing_times[event_time_date]
             else:
                 event_time = EventTime(event=self.event)
                 event_time.start = event_time_start
@@ -711,86 +1010,6 @@ class EventRecurrence(models.Model):
         event_time.recurrence_auto = True
         return event_time
 
-    def _every_week_generator(self, start, end, duration):
-        current_start = timedelta_fixed_time(start, days=7)
-        while current_start < end:
-            current_end = current_start + duration if duration else None
-            yield current_start, current_end
-            current_start = timedelta_fixed_time(current_start, days=7)
-
-    def _biweekly_generator(self, start, end, duration, even_not_odd=True):
-        current_start = start
-        __, week, __ = current_start.date().isocalendar()
-
-        # We account for a case where the anchor date is in fact NOT the same
-        # even/odd week number of the series.
-        if week % 2 != (0 if even_not_odd else 1):
-            current_start = timedelta_fixed_time(current_start, days=7)
-        else:
-            current_start = timedelta_fixed_time(current_start, days=14)
-        while current_start < end:
-            current_end = current_start + duration if duration else None
-            yield current_start, current_end
-            current_start = timedelta_fixed_time(current_start, days=14)
-
-    def _monthly_generator(self, start, end, duration, offset_weeks=0):
-        """
-        :param: offset_weeks: The number of weeks from the beginning, 0=first week
-        """
-        current_start = start
-        while True:
-            if current_start.month == 12:
-                first_day_in_month = current_start.replace(
-                    year=current_start.year + 1,
-                    month=1,
-                    day=1,
-                )
-            else:
-                first_day_in_month = current_start.replace(
-                    month=current_start.month + 1,
-                    day=1,
-                )
-            offset = (
-                self.event_time_anchor.start.weekday() - first_day_in_month.weekday()
-            )
-            if offset < 0:
-                offset += 7
-            offset += 7 * offset_weeks
-            current_start = first_day_in_month.replace(
-                day=1 + offset,
-            )
-            current_end = current_start + duration if duration else None
-            if current_start >= end:
-                break
-            yield current_start, current_end
-
-    def _last_day_of_month_generator(self, start, end, duration):
-        current_start = start
-        target_weekday = current_start.weekday()
-        while True:
-            if current_start.month == 12:
-                next_month = 1
-                next_year = current_start.year + 1
-            else:
-                next_month = current_start.month + 1
-                next_year = current_start.year
-            # The weekday index is different in the "calendar" package so disregard
-            __, last_day = calendar.monthrange(next_year, next_month)
-            current_start = current_start.replace(
-                year=next_year, month=next_month, day=last_day
-            )
-            last_day_weekday = current_start.weekday()
-            diff = target_weekday - last_day_weekday
-            if diff > 0:
-                diff = -7 + diff
-            current_start = current_start.replace(
-                day=last_day + diff,
-            )
-            current_end = current_start + duration if duration else None
-            if current_start >= end:
-                break
-            yield current_start, current_end
-
 
 class Weekday(models.Model):
 
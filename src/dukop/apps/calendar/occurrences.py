@@ -0,0 +1,283 @@
+"""
+Expansion of EventRecurrence rules into occurrences.
+
+Instead of stepping from one occurrence to the next, the local dates of a rule
+within a window are computed in one pass from date ordinals and a table of
+months. The dates are then combined with the wall-clock time of the anchor and
+localized in bulk with the transition table from
+:mod:`dukop.apps.calendar.timezones`.
+
+Occurrences follow the anchor: They have the weekday, wall-clock time and
+duration of the anchor EventTime, which is itself never part of the expansion.
+"""
+import calendar
+from datetime import date
+from datetime import datetime
+from datetime import timedelta
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import timezones
+
+#: How many days ahead virtual occurrences are expanded when a listing has no
+#: end, same as the default maximum of ``EventRecurrence.sync()``
+VIRTUAL_HORIZON_DAYS = 180
+
+#: Week offsets of the "n'th week of month" recurrence types
+MONTHLY_OFFSETS = (
+    ("first_week_of_month", 0),
+    ("second_week_of_month", 1),
+    ("third_week_of_month", 2),
+)
+
+#: iCalendar weekday codes, Monday first like date.weekday()
+ICAL_WEEKDAYS = ("MO", "TU", "WE", "TH", "FR", "SA", "SU")
+
+#: BYDAY prefixes of the monthly recurrence types
+ICAL_MONTHLY_PREFIXES = (
+    ("first_week_of_month", "1"),
+    ("second_week_of_month", "2"),
+    ("third_week_of_month", "3"),
+    ("last_week_of_month", "-1"),
+)
+
+
+@lru_cache(maxsize=2048)
+def month_table(year, month):
+    """Weekday of the first day in a month and the number of days"""
+    return calendar.monthrange(year, month)
+
+
+def _months(first, last):
+    """All (year, month) from the month of ``first`` to the month of ``last``"""
+    for index in range(first.year * 12 + first.month - 1, last.year * 12 + last.month):
+        year, month = divmod(index, 12)
+        yield year, month + 1
+
+
+def weekly_dates(weekday, first, last):
+    """Dates with the given weekday, from ``first`` and before ``last``"""
+    first_ordinal = first.toordinal() + (weekday - first.weekday()) % 7
+    return [
+        date.fromordinal(ordinal)
+        for ordinal in range(first_ordinal, last.toordinal(), 7)
+    ]
+
+
+def biweekly_dates(weekday, first, last, even=True):
+    """Dates with the given weekday in even or odd ISO week numbers"""
+    parity = 0 if even else 1
+    return [
+        day
+        for day in weekly_dates(weekday, first, last)
+        if day.isocalendar()[1] % 2 == parity
+    ]
+
+
+def monthly_dates(weekday, offset_weeks, first, last):
+    """
+    The ``offset_weeks``'th (0=first) date with the given weekday in every
+    month
+    """
+    dates = []
+    for year, month in _months(first, last):
+        first_weekday, __ = month_table(year, month)
+        day = date(year, month, 1 + (weekday - first_weekday) % 7 + 7 * offset_weeks)
+        if first <= day < last:
+            dates.append(day)
+    return dates
+
+
+def last_of_month_dates(weekday, first, last):
+    """The last date with the given weekday in every month"""
+    dates = []
+    for year, month in _months(first, last):
+        first_weekday, days = month_table(year, month)
+        last_weekday = (first_weekday + days - 1) % 7
+        day = date(year, month, days - (last_weekday - weekday) % 7)
+        if first <= day < last:
+            dates.append(day)
+    return dates
+
+
+def rule_dates(recurrence, weekday, first, last):
+    """
+    All local dates of a recurrence from ``first`` and before ``last``, sorted
+    and without duplicates. Weekly recurrences exclude all other types.
+    """
+    if recurrence.every_week:
+        return weekly_dates(weekday, first, last)
+
+    dates = set()
+    if recurrence.biweekly_even or recurrence.biweekly_odd:
+        dates.update(
+            biweekly_dates(weekday, first, last, even=recurrence.biweekly_even)
+        )
+    for type_id, offset_weeks in MONTHLY_OFFSETS:
+        if getattr(recurrence, type_id):
+            dates.update(monthly_dates(weekday, offset_weeks, first, last))
+    if recurrence.last_week_of_month:
+        dates.update(last_of_month_dates(weekday, first, last))
+    return sorted(dates)
+
+
+def expand(recurrence, start, end):
+    """
+    Returns a sorted list of (start, end) tuples for the occurrences of a
+    recurrence from the date of ``start`` and before ``end``. The end of an
+    occurrence is None if the anchor has no end.
+    """
+    anchor = recurrence.event_time_anchor
+    assert anchor, "Needs event_time_anchor (the first occurrence)"
+    tz = timezone.get_current_timezone()
+    anchor_start = timezone.localtime(anchor.start, tz)
+    duration = anchor.end - anchor.start if anchor.end else None
+
+    first = max(
+        timezone.localtime(start, tz).date(), anchor_start.date() + timedelta(days=1)
+    )
+    last = timezone.localtime(end, tz).date() + timedelta(days=1)
+    if first >= last:
+        return []
+
+    wall_clock = anchor_start.time()
+    starts = timezones.localize_many(
+        [
+            datetime.combine(day, wall_clock)
+            for day in rule_dates(recurrence, anchor_start.weekday(), first, last)
+        ],
+        tz,
+    )
+    return [
+        (occurrence_start, occurrence_start + duration if duration else None)
+        for occurrence_start in starts
+        if occurrence_start < end
+    ]
+
+
+def ical_rrule(recurrence):
+    """
+    The RRULE of a recurrence as a dict for icalendar, or None if its types
+    can't be expressed as a single rule. Even and odd weeks are ISO week
+    numbers, which is what BYWEEKNO counts with WKST=MO. UNTIL is left to the
+    caller.
+    """
+    anchor_start = timezone.localtime(recurrence.event_time_anchor.start)
+    weekday = ICAL_WEEKDAYS[anchor_start.weekday()]
+    monthly = [
+        prefix + weekday
+        for type_id, prefix in ICAL_MONTHLY_PREFIXES
+        if getattr(recurrence, type_id)
+    ]
+
+    if recurrence.every_week or (recurrence.biweekly_even and recurrence.biweekly_odd):
+        return {"freq": "weekly", "byday": weekday}
+    if recurrence.biweekly_even or recurrence.biweekly_odd:
+        if monthly:
+            return None
+        return {
+            "freq": "yearly",
+            "byweekno": list(range(2 if recurrence.biweekly_even else 1, 54, 2)),
+            "byday": weekday,
+            "wkst": "MO",
+        }
+    if monthly:
+        return {"freq": "monthly", "byday": monthly}
+    return None
+
+
+def virtual_recurrences_enabled():
+    """
+    With ``DUKOP_VIRTUAL_RECURRENCES = True``, recurrences only store their
+    anchor and the times that have been changed by hand. All other occurrences
+    are expanded when they are listed. The JSON API only lists stored times,
+    see api.py, the feeds and CalDAV write the recurrences as RRULEs.
+    """
+    return getattr(settings, "DUKOP_VIRTUAL_RECURRENCES", False)
+
+
+def virtual_event_times(recurrences, start, end, by_start=False):
+    """
+    Unsaved EventTime objects for the occurrences of ``recurrences`` that
+    overlap the interval from ``start`` to ``end`` (both inclusive). With
+    ``by_start``, occurrences have to start inside the interval.
+    """
+    event_times = []
+    for recurrence in recurrences:
+        anchor = recurrence.event_time_anchor
+        duration = anchor.end - anchor.start if anchor.end else timedelta(0)
+        expand_start = start if by_start else start - duration
+        expand_end = end + timedelta(days=1)
+        if recurrence.end:
+            expand_end = min(
+                expand_end,
+                timezone.make_aware(
+                    datetime.combine(recurrence.end, datetime.min.time())
+                ),
+            )
+        for occurrence_start, occurrence_end in expand(
+            recurrence, expand_start, expand_end
+        ):
+            if occurrence_start > end:
+                break
+            if by_start and occurrence_start < start:
+                continue
+            if (occurrence_end or occurrence_start) < start:
+                continue
+            event_times.append(
+                recurrence.times.model(
+                    event=recurrence.event,
+                    recurrence=recurrence,
+                    recurrence_auto=True,
+                    start=occurrence_start,
+                    end=occurrence_end,
+                )
+            )
+    return event_times
+
+
+def occurrence_stream(event_times, recurrences, start, end=None, by_start=False):
+    """
+    Merges stored EventTime objects with the virtual occurrences of
+    ``recurrences`` into one list sorted by start.
+
+    A stored time that belongs to a recurrence replaces the virtual occurrence
+    on the same date. This is how changed or cancelled occurrences are kept.
+    """
+    event_times = list(event_times)
+    if end is None:
+        end = start + timedelta(days=VIRTUAL_HORIZON_DAYS)
+    replaced = {
+        (event_time.recurrence_id, timezone.localtime(event_time.start).date())
+        for event_time in event_times
+        if event_time.recurrence_id
+    }
+    event_times += [
+        event_time
+        for event_time in virtual_event_times(recurrences, start, end, by_start)
+        if (event_time.recurrence_id, timezone.localtime(event_time.start).date())
+        not in replaced
+    ]
+    event_times.sort(
+        key=lambda event_time: (event_time.start, event_time.end or event_time.start)
+    )
+    return event_times
+
+
+def merge_virtual(event_times, recurrences, start, end=None, by_start=False):
+    """
+    Adds virtual occurrences to a listing of EventTime objects if they are
+    enabled, otherwise ``event_times`` is returned untouched.
+
+    ``recurrences`` should be filtered on the same Event fields as
+    ``event_times`` and load the events the same way. It is only evaluated
+    when virtual occurrences are enabled.
+    """
+    if not virtual_recurrences_enabled():
+        return event_times
+    recurrences = recurrences.exclude(event_time_anchor=None).select_related(
+        "event_time_anchor"
+    )
+    return occurrence_stream(event_times, recurrences, start, end, by_start)
@@ -0,0 +1,235 @@
+"""
+A full-page cache of the public listings for anonymous visitors.
+
+Views decorated with ``cache_anonymous_page`` are cached by URL, language,
+sphere of the session and date. While rendering, the view tags the page with
+surrogate keys for what it shows:
+
+* ``pages`` on every page, since all pages list the spheres in the header
+* ``sphere-<id>`` for the sphere that is listed, or ``sphere-all``
+* ``week-<year>-W<week>`` for every ISO week that the listing covers
+* ``event-<id>`` for every event on the page
+
+Every key has a version counter in the shared cache, and a cached page is
+only used while the versions of all its keys are the same as when it was
+stored. The signals in signals.py purge keys by bumping their versions, see
+``purge_events``, so a change of an event drops the pages that show it and
+the pages of the weeks that it is now in.
+
+The keys are also sent in a ``Surrogate-Key`` header, so a reverse proxy in
+front of the site can cache and purge the pages in the same way.
+
+Logged-in users and requests with pending messages always get a fresh page.
+``DUKOP_PAGE_CACHE_TIMEOUT`` is the lifetime of a page in seconds, 0 turns the
+cache off. The cache is also off when each process has its own cache, since a
+purge would only reach the worker that handled the change.
+"""
+import hashlib
+import time
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils import translation
+from django.utils.cache import patch_cache_control
+
+from . import models
+from . import utils
+
+PAGE_CACHE_KEY_PREFIX = "dukop_page:"
+PAGE_TAG_VERSION_KEY_PREFIX = "dukop_page_tag:"
+
+PAGES_TAG = "pages"
+
+
+def get_page_cache_timeout():
+    if not utils.is_cache_shared():
+        return 0
+    return getattr(settings, "DUKOP_PAGE_CACHE_TIMEOUT", 300)
+
+
+def sphere_tag(sphere):
+    return "sphere-{}".format(sphere.pk if sphere else "all")
+
+
+def event_tag(event_id):
+    return "event-{}".format(event_id)
+
+
+def week_tag(day):
+    year, week, __ = day.isocalendar()
+    return "week-{}-W{:02d}".format(year, week)
+
+
+def week_tags(from_date, to_date):
+    """Tags of the weeks from ``from_date`` to ``to_date``, both inclusive"""
+    # Mondays, so every week is only visited once
+    day = from_date - timedelta(days=from_date.weekday())
+    tags = []
+    while day <= to_date:
+        tags.append(week_tag(day))
+        day += timedelta(days=7)
+    return tags
+
+
+def add_tags(request, tags):
+    """
+    Tags the page that is rendered for ``request``. The versions of the tags
+    are read right away, so views should add the tags of the sphere and weeks
+    before they query the listings. A change while the page is rendered then
+    makes it stale at once, because purge_events also purges the weeks.
+    """
+    if hasattr(request, "page_cache_tags"):
+        tags = set(tags) - set(request.page_cache_tags)
+        if tags:
+            request.page_cache_tags.update(get_tag_versions(tags))
+
+
+def add_event_tags(request, event_times):
+    add_tags(request, {event_tag(event_time.event_id) for event_time in event_times})
+
+
+def get_tag_versions(tags):
+    """The current versions of ``tags``, missing counters are started"""
+    keys = {PAGE_TAG_VERSION_KEY_PREFIX + tag: tag for tag in tags}
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        for key in missing:
+            cache.add(key, time.time_ns())
+        versions.update(cache.get_many(missing))
+    return {keys[key]: version for key, version in versions.items()}
+
+
+def purge_tags(tags):
+    for tag in tags:
+        utils.bump_cache_version(PAGE_TAG_VERSION_KEY_PREFIX + tag)
+
+
+def purge_events(event_ids):
+    """
+    Purges the pages that show the events, and the pages of the weeks that the
+    events are listed in now, which may not show them yet. Called after the
+    listings are refreshed.
+    """
+    event_ids = list(event_ids)
+    if not event_ids:
+        return
+    tags = {event_tag(event_id) for event_id in event_ids}
+    for start in (
+        models.OccurrenceListing.objects.filter(event_id__in=event_ids)
+        .values_list("start", flat=True)
+        .distinct()
+    ):
+        tags.add(week_tag(timezone.localtime(start).date()))
+    purge_tags(tags)
+
+
+def purge_spheres(sphere_ids):
+    """Purges the listings of the spheres, and the ones of all spheres"""
+    purge_tags(
+        [sphere_tag(None)] + ["sphere-{}".format(sphere_id) for sphere_id in sphere_ids]
+    )
+
+
+def purge_all():
+    purge_tags([PAGES_TAG])
+
+
+def has_messages(request):
+    # len() loads the messages without marking them as used
+    return bool(len(messages.get_messages(request)))
+
+
+def is_cacheable(request):
+    return (
+        request.method in ("GET", "HEAD")
+        and not request.user.is_authenticated
+        and not has_messages(request)
+        and get_page_cache_timeout() > 0
+    )
+
+
+def get_page_key(request):
+    sphere = getattr(request, "sphere", None)
+    return (
+        PAGE_CACHE_KEY_PREFIX
+        + hashlib.md5(
+            ":".join(
+                [
+                    request.build_absolute_uri(),
+                    translation.get_language() or "",
+                    str(sphere.pk if sphere else ""),
+                    timezone.localtime(utils.get_now()).date().isoformat(),
+                ]
+            ).encode()
+        ).hexdigest()
+    )
+
+
+def get_cached_page(key):
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    if get_tag_versions(entry["versions"]) != entry["versions"]:
+        return None
+    return entry
+
+
+def set_headers(response, tags):
+    response["Surrogate-Key"] = " ".join(sorted(tags))
+    patch_cache_control(response, max_age=0, s_maxage=get_page_cache_timeout())
+
+
+def cache_anonymous_page(view):
+    """
+    Caches the pages of ``view`` for anonymous visitors. The view tags the
+    page with ``add_tags`` while it is rendered.
+    """
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not is_cacheable(request):
+            response = view(request, *args, **kwargs)
+            patch_cache_control(response, private=True)
+            return response
+
+        key = get_page_key(request)
+        entry = get_cached_page(key)
+        if entry is not None:
+            response = HttpResponse(
+                entry["content"], content_type=entry["content_type"]
+            )
+            set_headers(response, entry["versions"])
+            return response
+
+        request.page_cache_tags = get_tag_versions([PAGES_TAG])
+        response = view(request, *args, **kwargs)
+        if hasattr(response, "render"):
+            response.render()
+        versions = request.page_cache_tags
+        set_headers(response, versions)
+
+        if (
+            response.status_code == 200
+            and not response.streaming
+            and not response.cookies
+            and not request.META.get("CSRF_COOKIE_USED")
+            and not has_messages(request)
+        ):
+            cache.set(
+                key,
+                {
+                    "content": response.content,
+                    "content_type": response["Content-Type"],
+                    "versions": versions,
+                },
+                get_page_cache_timeout(),
+            )
+        return response
+
+    return wrapper
@@ -0,0 +1,165 @@
+"""
+Pre-rendered copies of the feeds that a web server can serve as static files.
+
+Publishing is enabled by setting ``DUKOP_FEED_PUBLISH_ROOT``, e.g. to
+``MEDIA_ROOT / "feeds"``. Every change of the feeds touches a marker file in
+that directory, and the ``calendar_publish_feeds`` command, which is meant to
+run every minute, renders all feeds again once nothing has changed for
+``DUKOP_FEED_PUBLISH_DEBOUNCE`` seconds. The content comes from EventFeed and
+RssFeed, so the files are the same as the dynamic feeds.
+
+Feeds are written as ``<language>/<sphere id or "all">.ics`` and ``.rss``, with
+precompressed ``.gz`` siblings and ``.br`` ones if brotli is installed. Files
+are only replaced when their content changes, so the mtime and size, and thus
+the ETag of nginx, stay the same for unchanged feeds.
+"""
+import gzip
+import os
+import time
+from datetime import datetime
+
+import pytz
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.test.client import RequestFactory
+from django.urls.base import reverse
+from django.utils import timezone
+from django.utils import translation
+
+from . import feeds
+from . import spheres
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+CHANGED_MARKER = ".changed"
+PUBLISHED_MARKER = ".published"
+
+#: URL names and file extensions of the published feeds
+PUBLISHED_FEEDS = (
+    ("calendar:feed_ical", feeds.EventFeed, ".ics"),
+    ("calendar:feed_rss", feeds.RssFeed, ".rss"),
+)
+
+
+def get_publish_root():
+    root = getattr(settings, "DUKOP_FEED_PUBLISH_ROOT", None)
+    return str(root) if root else None
+
+
+def get_debounce():
+    return getattr(settings, "DUKOP_FEED_PUBLISH_DEBOUNCE", 30)
+
+
+def get_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except FileNotFoundError:
+        return None
+
+
+def mark_changed():
+    """Called by the signals in signals.py when the feeds change"""
+    root = get_publish_root()
+    if not root:
+        return
+    os.makedirs(root, exist_ok=True)
+    path = os.path.join(root, CHANGED_MARKER)
+    with open(path, "a"):
+        os.utime(path)
+
+
+def is_due(root, now=None):
+    """
+    Whether the feeds need to be published: They have changed since the last
+    time and nothing has changed for the debounce period, or they were last
+    published on another day, so past events have to be dropped.
+    """
+    now = now or time.time()
+    published = get_mtime(os.path.join(root, PUBLISHED_MARKER))
+    if published is None:
+        return True
+
+    def local_date(timestamp):
+        return timezone.localtime(datetime.fromtimestamp(timestamp, tz=pytz.utc)).date()
+
+    if local_date(published) != local_date(now):
+        return True
+    changed = get_mtime(os.path.join(root, CHANGED_MARKER))
+    if changed is None or changed < published:
+        return False
+    return now - changed >= get_debounce()
+
+
+def write_file(path, content):
+    """
+    Writes ``content`` and its compressed siblings, unless the file already
+    has that content. Returns True if anything was written.
+    """
+    try:
+        with open(path, "rb") as existing:
+            if existing.read() == content:
+                return False
+    except FileNotFoundError:
+        pass
+
+    versions = [(path + ".gz", gzip.compress(content, mtime=0))]
+    if brotli:
+        versions.append((path + ".br", brotli.compress(content)))
+    # The uncompressed file is replaced last, it decides if this is repeated
+    versions.append((path, content))
+    for version_path, version_content in versions:
+        temporary_path = version_path + ".tmp"
+        with open(temporary_path, "wb") as temporary:
+            temporary.write(version_content)
+        os.replace(temporary_path, version_path)
+    return True
+
+
+def render_feed(url_name, feed_class, sphere):
+    """The body of a feed as the current language and site would serve it"""
+    kwargs = {"sphere_id": sphere.pk} if sphere else {}
+    request = RequestFactory().get(
+        reverse(url_name, kwargs=kwargs),
+        secure=True,
+        HTTP_HOST=Site.objects.get_current().domain,
+    )
+    # Set by sphere_middleware and used by the templates
+    request.sphere = sphere or spheres.registry.get_default()
+    return feed_class()(request, **kwargs).getvalue()
+
+
+def publish_feeds(root):
+    """
+    Writes the feeds of all spheres and languages to ``root``, and removes the
+    files of spheres that no longer exist. Returns the number of feeds whose
+    content changed.
+    """
+    started = time.time()
+    changed = 0
+    for language, __ in settings.LANGUAGES:
+        directory = os.path.join(root, language)
+        os.makedirs(directory, exist_ok=True)
+        file_names = set()
+        with translation.override(language):
+            for sphere in [None] + spheres.registry.get_all():
+                for url_name, feed_class, extension in PUBLISHED_FEEDS:
+                    file_name = "{}{}".format(sphere.pk if sphere else "all", extension)
+                    file_names.update(
+                        file_name + suffix for suffix in ("", ".gz", ".br")
+                    )
+                    changed += write_file(
+                        os.path.join(directory, file_name),
+                        render_feed(url_name, feed_class, sphere),
+                    )
+        for file_name in os.listdir(directory):
+            if file_name not in file_names:
+                os.remove(os.path.join(directory, file_name))
+
+    # Changes that happen while rendering are newer than the marker
+    path = os.path.join(root, PUBLISHED_MARKER)
+    with open(path, "a"):
+        os.utime(path, (started, started))
+    return changed
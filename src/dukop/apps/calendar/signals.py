@@ -1,9 +1,20 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_migrate
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from dukop.apps.users import email
 from dukop.apps.users.models import User
 
+from . import caldav
+from . import feeds
+from . import listings
 from . import models
+from . import pagecache
+from . import publish
+from . import spheres
+from . import utils
 
 
 @receiver(post_save, sender=models.Event)
@@ -28,3 +39,233 @@ def event_created(**kwargs):
         for user in admins.values():
             mail = email.AdminEventCreated(user=user, context={"event": event})
             mail.send()
+
+
+@receiver(post_save, sender=models.Sphere)
+@receiver(post_delete, sender=models.Sphere)
+def sphere_changed(**kwargs):
+    """
+    Reloads the sphere registry in all processes. The version is bumped again
+    when the transaction is committed, so other processes cannot keep what
+    they loaded before the commit.
+    """
+    spheres.registry.invalidate()
+    transaction.on_commit(spheres.registry.invalidate)
+
+
+@receiver(post_migrate)
+def spheres_migrated(**kwargs):
+    """Migrations and flushing the database change spheres without signals"""
+    spheres.registry.invalidate()
+
+
+@receiver(post_save, sender=models.Event)
+def event_listings(instance, raw=False, **kwargs):
+    if not raw:
+        listings.refresh_events([instance.pk])
+
+
+@receiver(post_save, sender=models.EventTime)
+def event_time_listing(instance, raw=False, **kwargs):
+    if not raw:
+        listings.refresh_event_time(instance)
+
+
+@receiver(post_save, sender=models.EventImage)
+@receiver(post_delete, sender=models.EventImage)
+def event_image_listings(instance, raw=False, **kwargs):
+    if not raw:
+        listings.refresh_image(instance.event_id)
+
+
+def touch_events(event_ids):
+    models.Event.objects.filter(pk__in=event_ids).update(modified=utils.get_now())
+
+
+@receiver(post_save, sender=models.EventImage)
+@receiver(post_delete, sender=models.EventImage)
+@receiver(post_save, sender=models.EventLink)
+@receiver(post_delete, sender=models.EventLink)
+@receiver(post_save, sender=models.EventRecurrence)
+@receiver(post_delete, sender=models.EventRecurrence)
+def event_related_changed(instance, raw=False, **kwargs):
+    """
+    Touches the event, so the cached event cards, which are keyed by
+    Event.modified, show the new images, links and recurrences
+    """
+    if not raw:
+        touch_events([instance.event_id])
+
+
+@receiver(post_save, sender=models.EventTime)
+@receiver(post_delete, sender=models.EventTime)
+def event_time_touched(instance, raw=False, **kwargs):
+    """
+    Touches the event for the cards that list the upcoming times, once per
+    transaction, since a sync removes the times one row at a time
+    """
+    if not raw:
+        utils.on_commit_batch(touch_events, [instance.event_id])
+
+
+@receiver(models.event_times_bulk_changed)
+def event_times_bulk_touched(event_ids, **kwargs):
+    utils.on_commit_batch(touch_events, event_ids)
+
+
+@receiver(m2m_changed, sender=models.Event.spheres.through)
+def event_spheres_listings(instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        listings.refresh_events([instance.pk])
+    elif action == "post_clear":
+        # The ids of the removed events are not known after a clear
+        listings.refresh_events(
+            models.OccurrenceListing.objects.for_sphere(instance)
+            .values_list("event_id", flat=True)
+            .distinct()
+        )
+    else:
+        listings.refresh_events(pk_set)
+
+
+@receiver(post_delete, sender=models.Sphere)
+def sphere_deleted_listings(instance, **kwargs):
+    listings.refresh_events(
+        models.OccurrenceListing.objects.for_sphere(instance)
+        .values_list("event_id", flat=True)
+        .distinct()
+    )
+
+
+@receiver(models.event_times_bulk_changed)
+def event_times_bulk_listings(event_ids, **kwargs):
+    listings.refresh_events(event_ids)
+
+
+@receiver(post_save, sender=models.Event)
+@receiver(post_delete, sender=models.Event)
+def event_changes(instance, raw=False, **kwargs):
+    if not raw:
+        caldav.record_changes([instance.pk])
+
+
+@receiver(post_save, sender=models.EventTime)
+@receiver(post_delete, sender=models.EventTime)
+@receiver(post_save, sender=models.EventRecurrence)
+@receiver(post_delete, sender=models.EventRecurrence)
+def event_time_changes(instance, raw=False, **kwargs):
+    if not raw:
+        caldav.record_changes([instance.event_id])
+
+
+@receiver(m2m_changed, sender=models.Event.spheres.through)
+def event_spheres_changes(instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            caldav.record_changes([instance.pk])
+    elif action == "pre_clear":
+        # The ids of the removed events are not known after a clear
+        caldav.record_changes(instance.event_set.values_list("pk", flat=True))
+    elif action in ("post_add", "post_remove"):
+        caldav.record_changes(pk_set)
+
+
+@receiver(models.event_times_bulk_changed)
+def event_times_bulk_changes(event_ids, **kwargs):
+    caldav.record_changes(event_ids)
+
+
+@receiver(post_save, sender=models.Event)
+@receiver(post_delete, sender=models.Event)
+@receiver(post_save, sender=models.EventTime)
+@receiver(post_delete, sender=models.EventTime)
+@receiver(post_save, sender=models.EventRecurrence)
+@receiver(post_delete, sender=models.EventRecurrence)
+@receiver(post_save, sender=models.EventImage)
+@receiver(post_delete, sender=models.EventImage)
+@receiver(post_save, sender=models.Sphere)
+@receiver(post_delete, sender=models.Sphere)
+@receiver(m2m_changed, sender=models.Event.spheres.through)
+@receiver(models.event_times_bulk_changed)
+def feeds_changed(raw=False, **kwargs):
+    """
+    Makes the cached feeds stale. Like the sphere registry, the version is
+    bumped again on commit, so no other process keeps a feed that was
+    rendered before the commit. Published feeds are marked as changed on
+    commit, see publish.py.
+    """
+    if not raw:
+        feeds.invalidate_feeds()
+        transaction.on_commit(feeds.invalidate_feeds)
+        transaction.on_commit(publish.mark_changed)
+
+
+def purge_pages(event_ids):
+    """
+    Purges the cached pages of the events once the transaction is committed,
+    when the listings that purge_events reads are visible to other processes.
+    All events of a transaction are purged together.
+    """
+    utils.on_commit_batch(pagecache.purge_events, event_ids)
+
+
+@receiver(post_save, sender=models.Event)
+@receiver(post_delete, sender=models.Event)
+def event_pages(instance, raw=False, **kwargs):
+    if not raw:
+        purge_pages([instance.pk])
+
+
+@receiver(post_save, sender=models.EventTime)
+@receiver(post_delete, sender=models.EventTime)
+@receiver(post_save, sender=models.EventImage)
+@receiver(post_delete, sender=models.EventImage)
+@receiver(post_save, sender=models.EventLink)
+@receiver(post_delete, sender=models.EventLink)
+def event_related_pages(instance, raw=False, **kwargs):
+    if not raw:
+        purge_pages([instance.event_id])
+
+
+@receiver(post_save, sender=models.EventRecurrence)
+@receiver(post_delete, sender=models.EventRecurrence)
+def event_recurrence_pages(instance, raw=False, **kwargs):
+    """
+    Virtual occurrences are not in the listings, so the pages of all weeks of
+    the spheres of the event are purged
+    """
+    if not raw:
+        purge_pages([instance.event_id])
+        utils.on_commit_batch(
+            pagecache.purge_spheres,
+            models.Event.spheres.through.objects.filter(
+                event_id=instance.event_id
+            ).values_list("sphere_id", flat=True),
+        )
+
+
+@receiver(m2m_changed, sender=models.Event.spheres.through)
+def event_spheres_pages(instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            purge_pages([instance.pk])
+    elif action == "pre_clear":
+        # The ids of the removed events are not known after a clear
+        purge_pages(instance.event_set.values_list("pk", flat=True))
+    elif action in ("post_add", "post_remove"):
+        purge_pages(pk_set)
+
+
+@receiver(models.event_times_bulk_changed)
+def event_times_bulk_pages(event_ids, **kwargs):
+    purge_pages(event_ids)
+
+
+@receiver(post_save, sender=models.Sphere)
+@receiver(post_delete, sender=models.Sphere)
+def sphere_pages(raw=False, **kwargs):
+    """All pages list the spheres"""
+    if not raw:
+        pagecache.purge_all()
@@ -0,0 +1,82 @@
+"""
+In-process registry of all spheres.
+
+There are very few spheres and they are needed on every request, so every
+worker keeps all of them in memory, keyed by id and slug. A version counter in
+the shared cache is bumped whenever a sphere is saved or deleted (see
+``signals.py``). The sphere middleware checks the counter once per request and
+the registry is only reloaded when it has changed.
+
+The cache has to be shared by all workers, see checks.py.
+"""
+from collections import namedtuple
+
+from . import models
+from . import utils
+
+#: Key of the version counter in the shared cache
+VERSION_CACHE_KEY = "dukop_spheres_version"
+
+
+#: One loaded version of the spheres, never changed after it is built
+Spheres = namedtuple("Spheres", ["version", "by_id", "by_slug", "all", "default"])
+
+
+class SphereRegistry:
+    def __init__(self):
+        self.spheres = None
+
+    def check(self):
+        """Reloads the spheres if another process has changed them"""
+        version = utils.get_cache_version(VERSION_CACHE_KEY)
+        if self.spheres is None or version != self.spheres.version:
+            self.load(version)
+        return self.spheres
+
+    def load(self, version):
+        """
+        Builds the new state aside and swaps it in with one assignment, so
+        other threads see either the old or the new spheres, never a mix.
+        """
+        default = models.Sphere.get_default()
+        spheres = list(models.Sphere.objects.all().order_by("default"))
+        by_id = {sphere.id: sphere for sphere in spheres}
+        self.spheres = Spheres(
+            version=version,
+            by_id=by_id,
+            by_slug={sphere.slug: sphere for sphere in spheres if sphere.slug},
+            all=spheres,
+            default=by_id.get(default.id, default),
+        )
+
+    def ensure_loaded(self):
+        spheres = self.spheres
+        if spheres is None:
+            spheres = self.check()
+        return spheres
+
+    def invalidate(self):
+        """Bumps the version, which reloads the registry in all processes"""
+        utils.bump_cache_version(VERSION_CACHE_KEY)
+        self.spheres = None
+
+    def get_default(self):
+        return self.ensure_loaded().default
+
+    def get_all(self):
+        """All spheres, the default sphere last"""
+        return self.ensure_loaded().all
+
+    def get_by_id_or_default(self, sphere_id=None):
+        """
+        Fetches a sphere by its ID or returns the default sphere
+        """
+        spheres = self.ensure_loaded()
+        return spheres.by_id.get(sphere_id, spheres.default)
+
+    def get_by_slug(self, slug):
+        """Returns None if no sphere has the slug"""
+        return self.ensure_loaded().by_slug.get(slug)
+
+
+registry = SphereRegistry()
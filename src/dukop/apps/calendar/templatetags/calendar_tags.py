@@ -1,25 +1,46 @@
+import heapq
 from datetime import timedelta
+from operator import itemgetter
 
 from django import template
+from django.conf import settings
 from django.contrib.sites.models import Site
+from django.db.models import Exists
+from django.db.models import OuterRef
+from django.db.models import Prefetch
 from django.db.models import Q
 from django.template.defaultfilters import truncatechars
 from django.urls.base import reverse
+from django.utils import timezone
+from django.utils import translation
 from django.utils.html import linebreaks
 from django.utils.safestring import mark_safe
 
 from .. import models
+from .. import occurrences
 from .. import utils
 
 register = template.Library()
 
+#: Most occurrences of get_event_times() without ``max_count``
+DEFAULT_MAX_COUNT = 100
 
-@register.simple_tag
-def get_event_times(  # noqa: max-complexity=12
+#: The hours of the day that the timeline of today shows
+TIMELINE_HOURS_MIN = 8
+TIMELINE_HOURS_MAX = 24
+
+#: Shortest duration that an event takes up in a lane of the timeline
+TIMELINE_MIN_LANE_HOURS = 1
+
+#: Seconds that a rendered event card is cached. Hosts and locations are
+#: shown by name, their changes are not in the key.
+EVENT_CARD_CACHE_TIMEOUT = getattr(settings, "DUKOP_EVENT_CARD_CACHE_TIMEOUT", 60 * 60)
+
+
+def get_event_time_lookups(  # noqa: max-complexity=12
     from_date=None,
     to_date=None,
     days=None,
-    max_count=100,
     featured=None,
     published=True,
     has_image=None,
@@ -27,11 +48,17 @@ def get_event_times(  # noqa: max-complexity=12
     host=None,
     location=None,
 ):
-
-    lookups = [Q(event__published=published)]
+    """
+    The filters of get_event_times(): The lookups of OccurrenceListing, the
+    same lookups on the Event for the recurrences of virtual occurrences, and
+    the window from ``from_date`` to ``to_date``, which may be None.
+    """
+    listing_lookups = {"published": published}
+    event_lookups = [Q(event__published=published)]
 
     if sphere:
-        lookups.append(Q(event__spheres=sphere))
+        listing_lookups["sphere_ids__contains"] = ",{},".format(sphere.pk)
+        event_lookups.append(Q(event__spheres=sphere))
 
     if from_date == "today":
         from_date = utils.get_now().replace(minute=0, hour=0, second=0)
@@ -44,31 +71,208 @@ def get_event_times(  # noqa: max-complexity=12
         to_date = from_date + timedelta(days=days)
 
     if from_date:
-        lookups.append((Q(start__gte=from_date) & Q(end=None)) | Q(end__gte=from_date))
+        listing_lookups["effective_end__gte"] = from_date
 
     if to_date:
-        lookups.append(Q(start__lte=to_date))
+        listing_lookups["start__lte"] = to_date
 
     if featured is not None:
-        lookups.append(Q(event__featured=bool(featured)))
+        listing_lookups["featured"] = bool(featured)
+        event_lookups.append(Q(event__featured=bool(featured)))
 
     if host is not None:
-        lookups.append(Q(event__host=host))
+        listing_lookups["host_id"] = host.pk
+        event_lookups.append(Q(event__host=host))
 
     if location is not None:
-        lookups.append(Q(event__location=location))
+        listing_lookups["location_id"] = location.pk
+        event_lookups.append(Q(event__location=location))
 
     if has_image is not None:
-        if has_image:
-            lookups.append(Q(event__images__id__gte=0))
+        listing_lookups["has_image"] = bool(has_image)
+        # A subquery, joining the images would repeat the rows per image
+        images = Exists(models.EventImage.objects.filter(event=OuterRef("event")))
+        event_lookups.append(images if has_image else ~images)
+
+    return listing_lookups, event_lookups, from_date, to_date
+
+
+def get_recurrences(event_lookups):
+    """The recurrences of the virtual occurrences of get_event_times()"""
+    return models.EventRecurrence.objects.filter(*event_lookups).prefetch_related(
+        Prefetch("event", queryset=models.Event.objects.for_card())
+    )
+
+
+@register.simple_tag
+def get_event_times(max_count=DEFAULT_MAX_COUNT, **kwargs):
+    """
+    The occurrences of a listing, see get_event_time_lookups() for the
+    filters. The occurrences are found in the denormalized OccurrenceListing
+    table.
+    """
+    listing_lookups, event_lookups, from_date, to_date = get_event_time_lookups(
+        **kwargs
+    )
+    event_times = (
+        models.OccurrenceListing.objects.filter(**listing_lookups)
+        .order_by("start", "end", "event_time_id")[:max_count]
+        .event_times(models.Event.objects.for_card())
+    )
+    event_times = occurrences.merge_virtual(
+        event_times, get_recurrences(event_lookups), from_date, to_date
+    )
+    return event_times[:max_count]
+
+
+def listing_matches(row, listing_lookups):
+    """Evaluates the lookups of get_event_time_lookups() on a row of values()"""
+    for lookup, value in listing_lookups.items():
+        field, __, operator = lookup.partition("__")
+        if operator == "gte":
+            matches = row[field] >= value
+        elif operator == "lte":
+            matches = row[field] <= value
+        elif operator == "contains":
+            matches = value in row[field]
         else:
-            lookups.append(Q(event__images=None))
+            matches = row[field] == value
+        if not matches:
+            return False
+    return True
+
 
-    return (
-        models.EventTime.objects.filter(*lookups)
-        .select_related("event")
-        .prefetch_related("event__images", "event__links")
-    ).distinct()[:max_count]
+def event_matches(event, featured=None, has_image=None, **window):
+    """The filters of get_event_times() that windows may differ in, on an Event"""
+    if featured is not None and event.featured != bool(featured):
+        return False
+    if has_image is not None and bool(event.images.all()) != bool(has_image):
+        return False
+    return True
+
+
+def scan_windows(windows, listing_lookups):
+    """
+    The event time ids of each window of get_event_time_windows(). The union
+    of the windows is scanned by start, until every window is full or over.
+    """
+    window_ids = [[] for __ in windows]
+    # The lookups that all windows share, and the union of their dates
+    scan_lookups = {
+        lookup: value
+        for lookup, value in listing_lookups[0].items()
+        if lookup not in ("effective_end__gte", "start__lte")
+        and all(lookups.get(lookup) == value for lookups in listing_lookups)
+    }
+    scan_lookups["effective_end__gte"] = min(
+        lookups["effective_end__gte"] for lookups in listing_lookups
+    )
+    if all("start__lte" in lookups for lookups in listing_lookups):
+        scan_lookups["start__lte"] = max(
+            lookups["start__lte"] for lookups in listing_lookups
+        )
+    fields = {"event_time_id", "start"} | {
+        lookup.partition("__")[0] for lookups in listing_lookups for lookup in lookups
+    }
+    rows = (
+        models.OccurrenceListing.objects.filter(**scan_lookups)
+        .order_by("start", "end", "event_time_id")
+        .values(*fields)
+        .iterator(chunk_size=100)
+    )
+    for row in rows:
+        is_open = False
+        for window, lookups, ids in zip(windows, listing_lookups, window_ids):
+            if len(ids) >= window.get("max_count", DEFAULT_MAX_COUNT):
+                continue
+            if "start__lte" in lookups and row["start"] > lookups["start__lte"]:
+                continue
+            is_open = True
+            if listing_matches(row, lookups):
+                ids.append(row["event_time_id"])
+        if not is_open:
+            break
+    return window_ids
+
+
+def get_event_time_windows(windows, **kwargs):
+    """
+    The same as calling get_event_times() once per window, e.g. for the
+    sections of the front page, with far fewer queries: The listings are
+    scanned once and the events of all windows are loaded together.
+
+    ``windows`` are dicts of the arguments that differ between the calls:
+    ``from_date``, ``to_date``, ``days``, ``max_count``, ``featured`` and
+    ``has_image``. The other arguments in ``kwargs`` are shared.
+    """
+    lookups = [
+        get_event_time_lookups(
+            **kwargs,
+            **{name: value for name, value in window.items() if name != "max_count"}
+        )
+        for window in windows
+    ]
+    window_ids = scan_windows(windows, [lookup[0] for lookup in lookups])
+
+    event_times = models.EventTime.objects.filter(
+        pk__in={pk for ids in window_ids for pk in ids}
+    ).with_events(models.Event.objects.for_card())
+    event_times = {event_time.pk: event_time for event_time in event_times}
+
+    recurrences = []
+    if occurrences.virtual_recurrences_enabled():
+        # Only the lookups that all windows share, the others are checked on
+        # the events
+        __, event_lookups, __, __ = get_event_time_lookups(**kwargs)
+        recurrences = list(
+            get_recurrences(event_lookups)
+            .exclude(event_time_anchor=None)
+            .select_related("event_time_anchor")
+        )
+
+    results = []
+    for window, (__, __, from_date, to_date), ids in zip(windows, lookups, window_ids):
+        window_times = [event_times[pk] for pk in ids if pk in event_times]
+        if occurrences.virtual_recurrences_enabled():
+            window_times = occurrences.occurrence_stream(
+                window_times,
+                [
+                    recurrence
+                    for recurrence in recurrences
+                    if event_matches(recurrence.event, **window)
+                ],
+                from_date,
+                to_date,
+            )
+        results.append(window_times[: window.get("max_count", DEFAULT_MAX_COUNT)])
+    return results
+
+
+@register.simple_tag
+def event_card_cache(event, event_time=None, truncate=None, hide_share=False):
+    """
+    The timeout and the key of the fragment cache of event_card.html. The key
+    changes with the event, including its times, recurrences, images and
+    links, which all touch Event.modified (see signals.py), and with the
+    language, the layout, the shown time and the day.
+    """
+    key = [
+        event.pk,
+        event.modified.timestamp(),
+        translation.get_language(),
+        truncate or "",
+        int(bool(hide_share)),
+        timezone.localtime(utils.get_now()).date().isoformat(),
+    ]
+    if event_time:
+        key += [
+            event_time.start.timestamp(),
+            event_time.end.timestamp() if event_time.end else "",
+        ]
+    return {
+        "timeout": EVENT_CARD_CACHE_TIMEOUT,
+        "key": ":".join(map(str, key)),
+    }
 
 
 @register.simple_tag
@@ -80,24 +284,27 @@ def event_timeline_properties(event_time, now=None):
     if not now:
         now = utils.get_now()
 
-    hours_x_min = 8
-    hours_x_max = 24
-    hours_x = hours_x_max - hours_x_min
+    hours_x = TIMELINE_HOURS_MAX - TIMELINE_HOURS_MIN
 
-    if event_time.start.date() < now.date() or event_time.start.hour < hours_x_min:
-        x_start = hours_x_min
+    if (
+        event_time.start.date() < now.date()
+        or event_time.start.hour < TIMELINE_HOURS_MIN
+    ):
+        x_start = TIMELINE_HOURS_MIN
     else:
         x_start = event_time.start.hour + (event_time.start.minute / 60.0)
 
     if not event_time.end:
         x_end = x_start
-    elif event_time.end.date() > now.date() or event_time.end.hour >= hours_x_max:
-        x_end = hours_x_max
+    elif (
+        event_time.end.date() > now.date() or event_time.end.hour >= TIMELINE_HOURS_MAX
+    ):
+        x_end = TIMELINE_HOURS_MAX
     else:
         x_end = event_time.end.hour + (event_time.end.minute / 60.0)
 
-    x_start_pct = 100.0 * float(x_start - hours_x_min) / hours_x
-    x_end_pct = 100.0 * float(x_end - hours_x_min) / hours_x
+    x_start_pct = 100.0 * float(x_start - TIMELINE_HOURS_MIN) / hours_x
+    x_end_pct = 100.0 * float(x_end - TIMELINE_HOURS_MIN) / hours_x
 
     width_pct = x_end_pct - x_start_pct
 
@@ -108,6 +315,43 @@ def event_timeline_properties(event_time, now=None):
     }
 
 
+@register.simple_tag
+def event_timeline(event_times, now=None):
+    """
+    Lays out the timeline of a day in one call: Returns lanes, which are
+    lists of the properties of event_timeline_properties() with the
+    ``event_time`` added. Events in the same lane don't overlap.
+
+    Events are sorted by start and put in the lane that became free first,
+    found in a heap of the ends of the lanes, so the fewest lanes are used.
+    Short events take up at least TIMELINE_MIN_LANE_HOURS, their names need
+    the room.
+    """
+    now = now or utils.get_now()
+    min_width_pct = (
+        100.0 * TIMELINE_MIN_LANE_HOURS / (TIMELINE_HOURS_MAX - TIMELINE_HOURS_MIN)
+    )
+    items = []
+    for event_time in event_times:
+        item = event_timeline_properties(event_time, now)
+        item["event_time"] = event_time
+        items.append(item)
+    items.sort(key=itemgetter("x_start_pct"))
+
+    lanes = []
+    lane_ends = []
+    for item in items:
+        if lane_ends and lane_ends[0][0] <= item["x_start_pct"]:
+            __, lane = heapq.heappop(lane_ends)
+        else:
+            lane = len(lanes)
+            lanes.append([])
+        lanes[lane].append(item)
+        end = max(item["x_end_pct"], item["x_start_pct"] + min_width_pct)
+        heapq.heappush(lane_ends, (end, lane))
+    return lanes
+
+
 @register.filter_function
 def dukop_date(dtm):
     return utils.display_date(dtm)
@@ -167,8 +411,15 @@ def event_can_edit(event, user):
 @mark_safe
 def event_description(event, truncate=100):
     truncated_description = ""
-    if event.description:
-        truncated_description = truncatechars(event.description, truncate)
+    # Events from Event.objects.for_card() only have an excerpt, which is
+    # too short for longer truncations
+    description = None
+    if truncate <= models.CARD_DESCRIPTION_LENGTH:
+        description = getattr(event, "description_excerpt", None)
+    if description is None:
+        description = event.description
+    if description:
+        truncated_description = truncatechars(description, truncate)
     else:
         truncated_description = truncatechars(event.short_description, truncate)
 
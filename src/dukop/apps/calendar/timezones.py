@@ -0,0 +1,151 @@
+"""
+Fast conversion of local wall-clock times to aware datetimes.
+
+pytz' ``localize()`` probes the transitions of a timezone twice and normalizes
+the result on every call. For recurrences, we localize hundreds of wall-clock
+times in the same zone, so instead we turn the UTC transitions of the zone
+into a table of wall-clock boundaries once per process and look up each time
+with a binary search.
+
+The result is identical to ``tz.localize(dtm)`` (``is_dst=False``): Times that
+do not exist because the clock is moved forward get the offset from before the
+transition, and ambiguous times get the standard time offset.
+
+The same table is used for local time arithmetic: ``local_days_later()`` is
+what ``utils.timedelta_fixed_time()`` does, without pytz calls.
+"""
+from bisect import bisect_right
+from datetime import datetime
+from datetime import timedelta
+from functools import lru_cache
+
+from django.utils import timezone
+
+
+class TransitionTable:
+    """
+    Wall-clock boundaries of a pytz timezone, each mapped to the tzinfo that
+    applies from that boundary and until the next one.
+    """
+
+    def __init__(self, tz):
+        self.tz = tz
+        infos = tz._transition_info
+        tzinfos = [tz._tzinfos[info] for info in infos]
+        self.utc_boundaries = tz._utc_transition_times
+        self.utc_tzinfos = tzinfos
+        self.boundaries = []
+        self.tzinfos = [tzinfos[0]]
+
+        for utc_time, before, after, before_tzinfo, after_tzinfo in zip(
+            tz._utc_transition_times[1:],
+            infos,
+            infos[1:],
+            tzinfos,
+            tzinfos[1:],
+        ):
+            wall_before = utc_time + before[0]
+            wall_after = utc_time + after[0]
+            if wall_after < wall_before:
+                # The clock is moved back and the times in between happen
+                # twice. Like pytz, prefer standard time, and otherwise the
+                # latest (by UTC) offset.
+                if bool(before[1]) != bool(after[1]):
+                    ambiguous_tzinfo = before_tzinfo if not before[1] else after_tzinfo
+                else:
+                    ambiguous_tzinfo = after_tzinfo
+                self.boundaries += [wall_after, wall_before]
+                self.tzinfos += [ambiguous_tzinfo, after_tzinfo]
+            else:
+                # The clock is moved forward (or only the name changes), times
+                # that do not exist keep the offset from before the transition.
+                self.boundaries.append(wall_after)
+                self.tzinfos.append(after_tzinfo)
+
+    def tzinfo_at(self, naive):
+        """The tzinfo of a naive wall-clock time in this timezone"""
+        return self.tzinfos[bisect_right(self.boundaries, naive)]
+
+    def localize(self, naive):
+        return naive.replace(tzinfo=self.tzinfo_at(naive))
+
+    def localtime(self, aware):
+        """Same as ``timezone.localtime(aware, tz)``"""
+        utc = aware.replace(tzinfo=None) - aware.utcoffset()
+        tzinfo = self.utc_tzinfos[max(0, bisect_right(self.utc_boundaries, utc) - 1)]
+        return (utc + tzinfo._utcoffset).replace(tzinfo=tzinfo)
+
+    def localize_many(self, naives):
+        """
+        Localizes a sequence of naive datetimes. When it is sorted, the table
+        is walked once instead of searched for every item.
+        """
+        result = []
+        lower = upper = None
+        for naive in naives:
+            if lower is None or not lower <= naive < upper:
+                index = bisect_right(self.boundaries, naive)
+                lower = self.boundaries[index - 1] if index else datetime.min
+                upper = (
+                    self.boundaries[index]
+                    if index < len(self.boundaries)
+                    else datetime.max
+                )
+            result.append(naive.replace(tzinfo=self.tzinfos[index]))
+        return result
+
+
+@lru_cache(maxsize=None)
+def get_transition_table(tz):
+    """
+    Returns the cached table of a timezone or None if the timezone has no
+    transitions to look up.
+    """
+    if not hasattr(tz, "_utc_transition_times"):
+        return None
+    return TransitionTable(tz)
+
+
+def localize(naive, tz=None):
+    """Same as ``tz.localize(naive)``, defaulting to the current timezone"""
+    tz = tz or timezone.get_current_timezone()
+    table = get_transition_table(tz)
+    if table:
+        return table.localize(naive)
+    if hasattr(tz, "localize"):
+        return tz.localize(naive)
+    return naive.replace(tzinfo=tz)
+
+
+def localtime(aware, tz=None):
+    """Same as ``timezone.localtime(aware, tz)``, using the cached table"""
+    tz = tz or timezone.get_current_timezone()
+    table = get_transition_table(tz)
+    if table:
+        return table.localtime(aware)
+    return timezone.localtime(aware, tz)
+
+
+def local_days_later(aware, tz=None, **kwargs):
+    """
+    The same wall-clock time a number of days (``timedelta(**kwargs)``) later
+    in local time, where the UTC offset follows the DST changes in between.
+    Both conversions are lookups in the cached transition table.
+    """
+    tz = tz or timezone.get_current_timezone()
+    local = localtime(aware, tz)
+    return localize(
+        datetime.combine(local.date() + timedelta(**kwargs), local.time()), tz
+    )
+
+
+def localize_many(naives, tz=None):
+    """
+    Localizes a list of naive datetimes in one pass. The list is expected to
+    be sorted, in which case the table is only walked once.
+    """
+    tz = tz or timezone.get_current_timezone()
+    table = get_transition_table(tz)
+    if table:
+        return table.localize_many(naives)
+    return [localize(naive, tz) for naive in naives]
@@ -4,6 +4,8 @@ from django.urls import path
 from django.urls import register_converter
 from django.views.i18n import JavaScriptCatalog
 
+from . import api
+from . import caldav
 from . import feeds
 from . import views
 
@@ -46,11 +48,23 @@ urlpatterns = [
         views.EventDetailView.as_view(),
         name="event_detail",
     ),
+    path("event/<int:pk>/ical/", feeds.EventICalFeed(), name="event_ical"),
     path("feeds/", views.FeedInstructionView.as_view(), name="feeds"),
     path("feed/ical/", feeds.EventFeed(), name="feed_ical"),
     path("feed/rss/", feeds.RssFeed(), name="feed_rss"),
     path("feed/sphere/ical/<int:sphere_id>/", feeds.EventFeed(), name="feed_ical"),
     path("feed/sphere/rss/<int:sphere_id>/", feeds.RssFeed(), name="feed_rss"),
+    path("api/events/", api.event_list, name="api_events"),
+    path(
+        "caldav/<int:sphere_id>/",
+        caldav.CollectionView.as_view(),
+        name="caldav_collection",
+    ),
+    path(
+        "caldav/<int:sphere_id>/<int:event_id>.ics",
+        caldav.ResourceView.as_view(),
+        name="caldav_event",
+    ),
     path("sphere/change/<int:pk>/", views.set_sphere_session, name="sphere_change"),
     path(
         "sphere/<int:sphere_id>/events/<date:pivot_date>/",
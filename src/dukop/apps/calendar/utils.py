@@ -1,11 +1,18 @@
+import time
 from datetime import datetime
 from datetime import timedelta
+from functools import lru_cache
 
 from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
 from django.utils import timezone
+from django.utils import translation
 from django.utils.formats import date_format
 from django.utils.translation import gettext as _
 
+from . import timezones
+
 
 def get_now():
     """
@@ -19,16 +26,127 @@ def get_now():
     return now
 
 
+#: Cache backends that only live in the memory of one process
+PROCESS_LOCAL_CACHE_BACKENDS = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+
+def is_cache_shared():
+    """
+    Whether all processes use the same default cache. The version counters
+    below only reach other workers through a shared cache, see checks.py.
+    """
+    return settings.CACHES["default"]["BACKEND"] not in PROCESS_LOCAL_CACHE_BACKENDS
+
+
+def get_cache_version(key):
+    """
+    Returns a version counter from the shared cache. If it is missing, e.g.
+    because it was evicted, a new counter is started from the current time, so
+    it cannot go back to a version that a process has already seen.
+    """
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns())
+        version = cache.get(key)
+    return version
+
+
+def bump_cache_version(key):
+    """Increments a version counter in the shared cache"""
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns())
+
+
+class CommitBatch:
+    """The values that are passed to a function when a transaction commits"""
+
+    def __init__(self, batches, func):
+        self.batches = batches
+        self.func = func
+        self.values = set()
+
+    def __call__(self):
+        if self.batches.get(self.func) is self:
+            del self.batches[self.func]
+        self.func(self.values)
+
+
+def on_commit_batch(func, values):
+    """
+    Calls ``func`` once with a set of all the ``values`` that are passed for
+    it until the transaction is committed. Without a transaction, ``func`` is
+    called right away. The signals use it, so a bulk delete does not write to
+    the journal or purge the pages once per row.
+    """
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        func(set(values))
+        return
+    batches = connection.__dict__.setdefault("dukop_commit_batches", {})
+    batch = batches.get(func)
+    # A rollback drops the callback, so the batch is started over
+    if batch is None or not any(
+        callback[1] is batch for callback in connection.run_on_commit
+    ):
+        batch = batches[func] = CommitBatch(batches, func)
+        transaction.on_commit(batch)
+    batch.values.update(values)
+
+
+@lru_cache(maxsize=4096)
+def cached_date_format(language, day):
+    """
+    date_format() of a date. Must be called with ``language`` active, it is
+    only part of the key.
+    """
+    return date_format(day)
+
+
+@lru_cache(maxsize=4096)
+def cached_time_format(tz, minute):
+    """The local time of an aware datetime in ``tz``, e.g. 19:30"""
+    return timezones.localtime(minute, tz).strftime("%H:%M")
+
+
+@lru_cache(maxsize=16)
+def get_display_formats(language):
+    """
+    The translated format strings of the display functions. Must be called
+    with ``language`` active, it is only part of the key.
+    """
+    return {
+        "datetime": _("{date} at {time}"),
+        "start": _("{start_date} at {start_time}"),
+        "same_day": _("{start_date} at {start_time} - {end_time}"),
+        "days": _("{start_date} at {start_time} - {end_date} at {end_time}"),
+    }
+
+
 def display_date(dtm):
-    return date_format(dtm)
+    """
+    The date part of ``dtm`` in the active language. Dates are formatted once
+    per language and process, list pages show the same few dates many times.
+    """
+    day = dtm.date() if isinstance(dtm, datetime) else dtm
+    return cached_date_format(translation.get_language(), day)
 
 
 def display_time(dtm):
-    return timezone.localtime(dtm).strftime("%H:%M")
+    """The local time of ``dtm``, formatted once per minute and timezone"""
+    return cached_time_format(
+        timezone.get_current_timezone(), dtm.replace(second=0, microsecond=0)
+    )
 
 
 def display_datetime(dtm):
-    return _("{date} at {time}").format(date=date_format(dtm), time=display_time(dtm))
+    return get_display_formats(translation.get_language())["datetime"].format(
+        date=display_date(dtm), time=display_time(dtm)
+    )
 
 
 def display_interval(start, end=None):
@@ -40,20 +158,21 @@ def display_interval(start, end=None):
 
     Remember that when changing formats, translations have to be updated, too.
     """
+    formats = get_display_formats(translation.get_language())
     if not end:
-        return _("{start_date} at {start_time}").format(
-            start_date=date_format(start), start_time=display_time(start)
+        return formats["start"].format(
+            start_date=display_date(start), start_time=display_time(start)
         )
     elif end.date() == start.date():
-        return _("{start_date} at {start_time} - {end_time}").format(
-            start_date=date_format(start),
+        return formats["same_day"].format(
+            start_date=display_date(start),
             start_time=display_time(start),
             end_time=display_time(end),
         )
     else:
-        return _("{start_date} at {start_time} - {end_date} at {end_time}").format(
-            start_date=date_format(start),
-            end_date=date_format(end),
+        return formats["days"].format(
+            start_date=display_date(start),
+            end_date=display_date(end),
             start_time=display_time(start),
             end_time=display_time(end),
         )
@@ -64,16 +183,10 @@ def timedelta_fixed_time(dtm1, **kwargs):
     Fixates the time - meaning that if you add 7 days to any timestamp, it will
     firstly apply the current timezone according to your Django settings
     """
-    tz = timezone.get_current_timezone()
-    # Firstly, force dtm1 to be in the local timezone (tzinfo), because otherwise
+    # Firstly, dtm1 is forced into the local timezone (tzinfo), because otherwise
     # it might be for instance represented as UTC. What we want to achieve is
     # to keep the time() of the original timestamp, regardless of the DST changes
-    # that can occur in the interval that the date is pushed.
-    localized_dtm1 = timezone.localtime(dtm1, tz)
-    return tz.localize(
-        (
-            datetime.combine(
-                localized_dtm1.date() + timedelta(**kwargs), localized_dtm1.time()
-            )
-        )
-    )
+    # that can occur in the interval that the date is pushed. The UTC offsets
+    # are looked up in a table of the transitions of the timezone, which is
+    # built once per process.
+    return timezones.local_days_later(dtm1, **kwargs)
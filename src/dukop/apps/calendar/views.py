@@ -1,8 +1,10 @@
+from datetime import datetime
 from datetime import timedelta
 
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.db import transaction
+from django.db.models import Prefetch
 from django.db.models import Q
 from django.shortcuts import get_object_or_404
 from django.shortcuts import redirect
@@ -22,10 +24,43 @@ from ratelimit.decorators import ratelimit
 
 from . import forms
 from . import models
+from . import occurrences
+from . import pagecache
+from . import spheres
+from . import utils
+from .templatetags.calendar_tags import get_event_time_windows
 
 
+@pagecache.cache_anonymous_page
 def index(request):
-    return render(request, "calendar/index.html")
+    today = timezone.localtime(utils.get_now()).date()
+    pagecache.add_tags(
+        request,
+        [pagecache.sphere_tag(request.sphere)]
+        + pagecache.week_tags(today, today + timedelta(days=31)),
+    )
+    # All sections start at midnight, like the template tags of the sections
+    # did: from_date=future and from_date=today were empty variables there
+    featured_event_times, todays_event_times, event_times = get_event_time_windows(
+        [
+            {"max_count": 20, "has_image": True, "days": 14},
+            {"days": 1, "max_count": 30},
+            {"days": 31},
+        ],
+        sphere=request.sphere,
+    )
+    pagecache.add_event_tags(
+        request, featured_event_times + todays_event_times + event_times
+    )
+    return render(
+        request,
+        "calendar/index.html",
+        {
+            "featured_event_times": featured_event_times,
+            "todays_event_times": todays_event_times,
+            "event_times": event_times,
+        },
+    )
 
 
 class FeedInstructionView(TemplateView):
@@ -33,7 +68,7 @@ class FeedInstructionView(TemplateView):
 
     def get_context_data(self, **kwargs):
         c = super().get_context_data(**kwargs)
-        c["spheres"] = models.Sphere.get_all_cached()
+        c["spheres"] = spheres.registry.get_all()
         return c
 
 
@@ -44,18 +79,7 @@ class EventDetailView(DetailView):
     context_object_name = "event"
 
     def get_queryset(self):
-        qs = DetailView.get_queryset(self)
-
-        if not self.request.user or not self.request.user.is_staff:
-            if self.request.user.is_authenticated:
-                qs = qs.filter(
-                    Q(published=True)
-                    | Q(owner_user=self.request.user)
-                    | Q(owner_group__members=self.request.user)
-                )
-            else:
-                qs = qs.filter(published=True)
-        return qs
+        return models.Event.objects.for_detail().visible_to(self.request.user)
 
 
 class EventCreateSuccess(EventDetailView):
@@ -267,6 +291,7 @@ class EventUpdateView(EventProcessFormMixin, UpdateView):
         return forms.EventTimeUpdateFormSet
 
 
+@method_decorator(pagecache.cache_anonymous_page, name="dispatch")
 class EventListView(ListView):
     """
     This lists all Event objects -- BUT! Notice that the listing is happening
@@ -295,30 +320,57 @@ class EventListView(ListView):
         return super().dispatch(request, *args, **kwargs)
 
     def get_queryset(self):
-        qs = DetailView.get_queryset(self)
+        pagecache.add_tags(
+            self.request,
+            [pagecache.sphere_tag(self.sphere)]
+            + pagecache.week_tags(self.pivot_date, self.pivot_date_end),
+        )
+        qs = models.OccurrenceListing.objects.filter(
+            start__gte=self.pivot_date, start__lte=self.pivot_date_end
+        )
+        recurrences = models.EventRecurrence.objects.prefetch_related(
+            Prefetch("event", queryset=models.Event.objects.bare())
+        )
+        window_start = timezone.make_aware(
+            datetime.combine(self.pivot_date, datetime.min.time())
+        )
 
         if not self.request.user or not self.request.user.is_staff:
-            q_visible_to_all = Q(event__published=True) & Q(
-                start__gte=timezone.now() - timedelta(days=self.max_days_lookback)
-            )
+            lookback = timezone.now() - timedelta(days=self.max_days_lookback)
+            q_visible_to_all = Q(published=True) & Q(start__gte=lookback)
             if self.request.user.is_authenticated:
-                qs = qs.filter(
-                    q_visible_to_all
-                    | Q(event__owner_user=self.request.user)
-                    | Q(event__owner_group__members=self.request.user)
+                q_owned = Q(owner_user=self.request.user) | Q(
+                    owner_group__members=self.request.user
+                )
+                owned_events = models.Event.objects.filter(q_owned).values("pk")
+                qs = qs.filter(q_visible_to_all | Q(event_id__in=owned_events))
+                recurrences = recurrences.filter(
+                    Q(event__published=True) | Q(event__in=owned_events)
                 )
             else:
                 qs = qs.filter(q_visible_to_all)
-
-        qs = qs.filter(start__gte=self.pivot_date, start__lte=self.pivot_date_end)
+                recurrences = recurrences.filter(event__published=True)
+            # Virtual occurrences are not exempt from the lookback, not even
+            # for the owners of an event.
+            window_start = max(window_start, lookback)
 
         if self.sphere:
-            qs = qs.filter(event__spheres=self.sphere)
-
-        return qs
+            qs = qs.for_sphere(self.sphere)
+            recurrences = recurrences.filter(event__spheres=self.sphere)
+
+        return occurrences.merge_virtual(
+            qs.event_times(models.Event.objects.bare()),
+            recurrences,
+            window_start,
+            timezone.make_aware(
+                datetime.combine(self.pivot_date_end, datetime.min.time())
+            ),
+            by_start=True,
+        )
 
     def get_context_data(self, **kwargs):
         c = super().get_context_data(**kwargs)
+        pagecache.add_event_tags(self.request, c["event_times"])
         c["pivot_date"] = self.pivot_date
         c["pivot_date_end"] = self.pivot_date_end
         c["pivot_date_next"] = self.pivot_date_end
@@ -344,7 +396,7 @@ class EventDashboard(ListView):
         return super().dispatch(request, *args, **kwargs)
 
     def get_queryset(self):
-        qs = DetailView.get_queryset(self)
+        qs = models.Event.objects.for_card().prefetch_related("times")
         qs = qs.filter(
             Q(owner_user=self.request.user) | Q(owner_group__members=self.request.user)
         ).distinct()
@@ -4,6 +4,16 @@ MANAGERS = ADMINS = [("Main admin team", "lol@dukop.dk")]
 
 DEFAULT_FROM_EMAIL = "dukop@riseup.net"
 
+# All workers have to share the cache, it holds the version counters of the
+# sphere registry and the cached feeds and pages. Checked by
+# `manage.py check --deploy`.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.memcached.PyMemcacheCache",
+        "LOCATION": "127.0.0.1:11211",
+    }
+}
+
 # For email, you wanna put something like this in production env's
 # settings.local:
 """
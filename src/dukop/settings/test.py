@@ -23,8 +23,15 @@ DATABASE_ROUTERS = ["dukop.apps.sync_old.router.SyncRouter"]
 
 EMAIL_CONFIRM_SALT = "test"
 
+# Tests run in one process
+CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
 EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
 
 # DUKOP_BACKWARDS_DAYS = 100
 
 THUMBNAIL_KVSTORE = "sorl.thumbnail.kvstores.dbm_kvstore.KVStore"
+
+# Tests look at the context of responses, which cached pages do not have. The
+# page cache is turned on by the tests of pagecache.py.
+DUKOP_PAGE_CACHE_TIMEOUT = 0
@@ -2,6 +2,7 @@ from datetime import timedelta
 
 import pytest
 from dukop.apps.calendar import models
+from dukop.apps.calendar import spheres
 from dukop.apps.calendar import utils
 
 
@@ -15,7 +16,7 @@ def single_event(db):
         description="A longer description",
         venue_name="The Place",
     )
-    event.spheres.add(models.Sphere.get_default_cached())
+    event.spheres.add(spheres.registry.get_default())
     models.EventTime.objects.create(
         event=event,
         start=start,
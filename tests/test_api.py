@@ -0,0 +1,97 @@
+import json
+from datetime import timedelta
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls.base import reverse
+from dukop.apps.calendar import models
+from dukop.apps.calendar import spheres
+from dukop.apps.calendar import utils
+
+from .fixtures_calendar import single_event  # noqa
+
+
+def get_json(client, **params):
+    response = client.get(reverse("calendar:api_events"), params)
+    assert response.status_code == 200
+    assert response["Content-Type"] == "application/json"
+    return json.loads(response.content)
+
+
+@pytest.mark.django_db()
+def test_api_cursor_pagination(client):
+    event = models.Event.objects.create(name="Event")
+    event.spheres.add(spheres.registry.get_default())
+    start = utils.get_now() + timedelta(days=1)
+    # Several times share a start, the cursor has to tell them apart
+    for i in range(7):
+        models.EventTime.objects.create(
+            event=event, start=start + timedelta(hours=i // 3)
+        )
+    expected = list(
+        models.EventTime.objects.order_by("start", "pk").values_list("pk", flat=True)
+    )
+
+    ids = []
+    params = {"limit": 2}
+    while True:
+        with CaptureQueriesContext(connection) as context:
+            page = get_json(client, **params)
+        assert not [
+            query for query in context.captured_queries if "OFFSET" in query["sql"]
+        ]
+        assert len(page["results"]) <= 2
+        ids += [row["id"] for row in page["results"]]
+        if not page["next"]:
+            break
+        assert "cursor=" in page["next"]
+        params["cursor"] = page["cursor"]
+    assert ids == expected
+
+    assert (
+        client.get(reverse("calendar:api_events"), {"cursor": "x"}).status_code == 400
+    )
+
+
+@pytest.mark.django_db()
+def test_api_fields_and_filters(client, single_event):  # noqa
+    single_event.short_description = "Short"
+    single_event.save()
+
+    row = get_json(client)["results"][0]
+    assert row["name"] == "Test event"
+    assert row["url"].startswith("https://example.com/da/event/")
+    assert "short_description" not in row
+
+    rows = get_json(client, fields="name,short_description,spheres")["results"]
+    assert rows == [
+        {
+            "name": "Test event",
+            "short_description": "Short",
+            "spheres": [spheres.registry.get_default().pk],
+        }
+    ]
+
+    assert get_json(client, sphere=spheres.registry.get_default().pk)["results"]
+    assert not get_json(client, days=1)["results"]
+    single_event.published = False
+    single_event.save()
+    assert not get_json(client)["results"]
+
+    response = client.get(reverse("calendar:api_events"), {"fields": "name,secret"})
+    assert response.status_code == 400
+
+
+@pytest.mark.django_db()
+def test_api_etag(client, single_event):  # noqa
+    url = reverse("calendar:api_events")
+    etag = client.get(url)["ETag"]
+    assert client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 304
+    assert client.get(url, {"limit": 1}, HTTP_IF_NONE_MATCH=etag).status_code == 200
+
+    single_event.name = "Renamed event"
+    single_event.save()
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert json.loads(response.content)["results"][0]["name"] == "Renamed event"
@@ -0,0 +1,203 @@
+from datetime import timedelta
+from xml.etree import ElementTree
+
+import pytest
+from django.urls.base import reverse
+from django.utils import timezone
+from dukop.apps.calendar import caldav
+from dukop.apps.calendar import models
+from dukop.apps.calendar import spheres
+from dukop.apps.calendar import utils
+
+from .fixtures_calendar import single_event  # noqa
+
+SYNC_COLLECTION = """<?xml version="1.0" encoding="utf-8" ?>
+<D:sync-collection xmlns:D="DAV:" xmlns:C="urn:ietf:params:xml:ns:caldav">
+  <D:sync-token>{}</D:sync-token>
+  <D:sync-level>1</D:sync-level>
+  <D:prop><D:getetag/><C:calendar-data/></D:prop>
+</D:sync-collection>"""
+
+
+def collection_url():
+    return reverse(
+        "calendar:caldav_collection",
+        kwargs={"sphere_id": spheres.registry.get_default().pk},
+    )
+
+
+def event_url(event):
+    return reverse(
+        "calendar:caldav_event",
+        kwargs={"sphere_id": spheres.registry.get_default().pk, "event_id": event.pk},
+    )
+
+
+def settle_changes():
+    """Ages the journal, so all its rows are in the sync token"""
+    models.EventChange.objects.update(
+        created=timezone.now() - timedelta(seconds=caldav.CHANGES_SETTLE_SECONDS)
+    )
+
+
+def sync(client, token=""):
+    """The responses of a sync-collection REPORT by href and the new token"""
+    settle_changes()
+    response = client.generic(
+        "REPORT",
+        collection_url(),
+        SYNC_COLLECTION.format(token),
+        content_type="application/xml",
+    )
+    assert response.status_code == 207
+    root = ElementTree.fromstring(response.content)
+    responses = {
+        element.findtext(caldav.dav("href")): element
+        for element in root.iter(caldav.dav("response"))
+    }
+    return responses, root.findtext(caldav.dav("sync-token"))
+
+
+def create_event(name):
+    event = models.Event.objects.create(name=name)
+    event.spheres.add(spheres.registry.get_default())
+    models.EventTime.objects.create(
+        event=event, start=utils.get_now() + timedelta(days=1)
+    )
+    return event
+
+
+@pytest.mark.django_db()
+def test_caldav_propfind(client, single_event):  # noqa
+    response = client.generic("PROPFIND", collection_url(), HTTP_DEPTH="0")
+    assert response.status_code == 207
+    root = ElementTree.fromstring(response.content)
+    assert root.find(".//" + caldav.caldav("calendar")) is not None
+    assert root.findtext(".//" + caldav.dav("sync-token")).startswith(
+        caldav.SYNC_TOKEN_PREFIX
+    )
+    assert event_url(single_event).encode() not in response.content
+
+    response = client.generic("PROPFIND", collection_url(), HTTP_DEPTH="1")
+    assert event_url(single_event).encode() in response.content
+    assert client.options(collection_url())["DAV"] == "1, 3, calendar-access"
+
+
+@pytest.mark.django_db(transaction=True)
+def test_caldav_sync_collection(client, single_event):  # noqa
+    responses, token = sync(client)
+    assert list(responses) == [event_url(single_event)]
+    assert b"SUMMARY:Test event" in ElementTree.tostring(
+        responses[event_url(single_event)]
+    )
+
+    responses, token = sync(client, token)
+    assert not responses
+
+    single_event.name = "Renamed event"
+    single_event.save()
+    other_event = create_event("Other event")
+    responses, token = sync(client, token)
+    assert set(responses) == {event_url(single_event), event_url(other_event)}
+    assert "SUMMARY:Renamed event" in responses[event_url(single_event)].findtext(
+        ".//" + caldav.caldav("calendar-data")
+    )
+
+    other_url = event_url(other_event)
+    other_event.delete()
+    responses, token = sync(client, token)
+    assert list(responses) == [other_url]
+    assert (
+        responses[other_url].findtext(caldav.dav("status")) == "HTTP/1.1 404 Not Found"
+    )
+
+    single_event.spheres.clear()
+    responses, token = sync(client, token)
+    assert list(responses) == [event_url(single_event)]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_caldav_sync_token_settles(single_event):  # noqa
+    settle_changes()
+    token = caldav.get_sync_token()
+    assert token
+    # Other transactions may still commit rows with lower ids
+    create_event("Other event")
+    assert caldav.get_sync_token() == token
+    settle_changes()
+    assert caldav.get_sync_token() > token
+
+
+@pytest.mark.django_db(transaction=True)
+def test_caldav_invalid_sync_token(client, single_event):  # noqa
+    __, token = sync(client)
+    for invalid in ("foo", caldav.format_sync_token(caldav.get_sync_token() + 1)):
+        response = client.generic(
+            "REPORT", collection_url(), SYNC_COLLECTION.format(invalid)
+        )
+        assert response.status_code == 403
+        assert b"valid-sync-token" in response.content
+
+    create_event("Other event")
+    models.EventChange.objects.update(created=utils.get_now() - timedelta(days=100))
+    assert caldav.prune_changes(days=90)
+    response = client.generic("REPORT", collection_url(), SYNC_COLLECTION.format(token))
+    assert response.status_code == 403
+
+
+@pytest.mark.django_db()
+def test_caldav_resource(client, single_event):  # noqa
+    response = client.get(event_url(single_event))
+    assert response.status_code == 200
+    assert response["Content-Type"].startswith("text/calendar")
+    assert b"SUMMARY:Test event" in response.content
+    etag = response["ETag"]
+    assert (
+        client.get(event_url(single_event), HTTP_IF_NONE_MATCH=etag).status_code == 304
+    )
+
+    unknown = models.Event.objects.create(name="Elsewhere")
+    assert client.get(event_url(unknown)).status_code == 404
+
+    draft = create_event("Draft")
+    draft.published = False
+    draft.save()
+    assert client.get(event_url(draft)).status_code == 404
+    response = client.generic("PROPFIND", collection_url(), HTTP_DEPTH="1")
+    assert event_url(draft).encode() not in response.content
+
+    response = client.generic(
+        "REPORT",
+        collection_url(),
+        """<C:calendar-multiget xmlns:D="DAV:" xmlns:C="urn:ietf:params:xml:ns:caldav">
+          <D:prop><D:getetag/></D:prop>
+          <D:href>{}</D:href>
+          <D:href>{}</D:href>
+        </C:calendar-multiget>""".format(event_url(single_event), event_url(unknown)),
+    )
+    assert response.status_code == 207
+    assert etag.encode() in response.content
+    assert b"404 Not Found" in response.content
+
+
+@pytest.mark.django_db(transaction=True)
+def test_caldav_changes_written_once(
+    single_event, django_assert_max_num_queries  # noqa
+):
+    recurrence = models.EventRecurrence.objects.create(
+        event=single_event, event_time_anchor=single_event.times.get(), every_week=True
+    )
+    recurrence.sync()
+    recurrence.end = (recurrence.event_time_anchor.start + timedelta(days=60)).date()
+    models.EventChange.objects.all().delete()
+
+    # One journal row on commit for the rows that a sync removes, not one per row
+    with django_assert_max_num_queries(20):
+        assert recurrence.sync().removed > 1
+    assert list(models.EventChange.objects.values_list("event_id", flat=True)) == [
+        single_event.pk
+    ]
+
+    with django_assert_max_num_queries(22):
+        single_event.delete()
+    assert models.EventChange.objects.count() == 2
@@ -0,0 +1,163 @@
+from datetime import timedelta
+
+import pytest
+from django.db.models import Q
+from django.urls.base import reverse
+from dukop.apps.calendar import models
+from dukop.apps.calendar import spheres
+from dukop.apps.calendar import utils
+from dukop.apps.calendar.templatetags.calendar_tags import event_description
+from dukop.apps.calendar.templatetags.calendar_tags import get_event_time_windows
+from dukop.apps.calendar.templatetags.calendar_tags import get_event_times
+
+from .fixtures_calendar import single_event  # noqa
+
+
+def create_events(count):
+    start = utils.get_now() + timedelta(hours=1)
+    for i in range(count):
+        event = models.Event.objects.create(
+            name="Event {}".format(i), description="Long description " * 100
+        )
+        event.spheres.add(spheres.registry.get_default())
+        models.EventTime.objects.create(
+            event=event, start=start, end=start + timedelta(hours=2)
+        )
+
+
+@pytest.mark.django_db()
+def test_no_default_prefetch(single_event, django_assert_num_queries):  # noqa
+    with django_assert_num_queries(1):
+        list(models.Event.objects.all())
+
+
+@pytest.mark.django_db()
+def test_for_card(single_event):  # noqa
+    single_event.description = "x" * 1000
+    single_event.save()
+    event = models.Event.objects.for_card().get(pk=single_event.pk)
+    assert "description" in event.get_deferred_fields()
+    assert len(event.description_excerpt) == models.CARD_DESCRIPTION_LENGTH
+    assert event_description(event, 100) == event_description(single_event, 100)
+
+    event = models.Event.objects.bare().get(pk=single_event.pk)
+    assert "short_description" in event.get_deferred_fields()
+
+
+@pytest.mark.django_db()
+def test_listing_queries_do_not_grow(client, django_assert_max_num_queries):
+    create_events(3)
+    with django_assert_max_num_queries(20) as context:
+        event_times = get_event_times(days=1)
+        for event_time in event_times:
+            event_time.event.images.first()
+            list(event_time.event.recurrences.all())
+            assert "description" in event_time.event.get_deferred_fields()
+    queries = len(context.captured_queries)
+
+    create_events(10)
+    with django_assert_max_num_queries(queries):
+        event_times = get_event_times(days=1)
+        assert len(event_times) == 13
+        for event_time in event_times:
+            event_time.event.images.first()
+            list(event_time.event.recurrences.all())
+
+    response = client.get(
+        reverse(
+            "calendar:event_list",
+            kwargs={"sphere_id": spheres.registry.get_default().pk},
+        )
+    )
+    assert response.status_code == 200
+
+
+@pytest.mark.django_db()
+def test_effective_end_and_future(single_event):  # noqa
+    now = utils.get_now()
+    # Nothing close to now, which moves while the test runs
+    for start_hours, duration_hours in (
+        (-72, None),
+        (-72, 48),
+        (-24, 25),
+        (-1, None),
+        (48, None),
+    ):
+        start = now + timedelta(hours=start_hours)
+        models.EventTime.objects.create(
+            event=single_event,
+            start=start,
+            end=start + timedelta(hours=duration_hours) if duration_hours else None,
+        )
+    recurrence = models.EventRecurrence.objects.create(
+        event=single_event,
+        event_time_anchor=single_event.times.last(),
+        every_week=True,
+    )
+    # Creates times in bulk
+    recurrence.sync()
+
+    for event_time in models.EventTime.objects.all():
+        assert event_time.effective_end == (event_time.end or event_time.start)
+
+    for truncate_time_today in (True, False):
+        if truncate_time_today:
+            pivot = now.replace(minute=0, hour=0, second=0)
+        else:
+            pivot = now
+        expected = models.EventTime.objects.filter(
+            Q(start__gte=pivot) | Q(end__gte=pivot)
+        )
+        assert set(models.EventTime.objects.future(truncate_time_today)) == set(
+            expected
+        )
+
+
+@pytest.mark.django_db()
+@pytest.mark.parametrize("virtual", [False, True])
+def test_event_time_windows(settings, single_event, virtual):  # noqa
+    settings.DUKOP_VIRTUAL_RECURRENCES = virtual
+    sphere = spheres.registry.get_default()
+    models.EventRecurrence.objects.create(
+        event=single_event,
+        event_time_anchor=single_event.times.get(),
+        every_week=True,
+    ).sync()
+    now = utils.get_now()
+    for hours in (-3, 1, 2, 30, 24 * 10, 24 * 20, 24 * 40):
+        event = models.Event.objects.create(name="Event {}".format(hours))
+        event.spheres.add(sphere)
+        models.EventTime.objects.create(event=event, start=now + timedelta(hours=hours))
+        if hours % 2 == 0:
+            models.EventImage.objects.create(event=event)
+    models.Event.objects.create(name="Elsewhere").times.create(start=now)
+
+    windows = [
+        {"max_count": 2, "has_image": True, "days": 14},
+        {"days": 1, "max_count": 30},
+        {"days": 31},
+        {"from_date": "future", "max_count": 4},
+    ]
+
+    def times(event_times):
+        return [(event_time.event_id, event_time.start) for event_time in event_times]
+
+    results = get_event_time_windows(windows, sphere=sphere)
+    assert [times(result) for result in results] == [
+        times(get_event_times(sphere=sphere, **window)) for window in windows
+    ]
+    assert all(results)
+
+
+@pytest.mark.django_db()
+def test_index_queries_do_not_grow(client, django_assert_max_num_queries):
+    create_events(3)
+    with django_assert_max_num_queries(30) as context:
+        response = client.get(reverse("calendar:index"))
+    assert response.content.count(b'class="table__event"') == 3
+    queries = len(context.captured_queries)
+
+    create_events(10)
+    with django_assert_max_num_queries(queries):
+        response = client.get(reverse("calendar:index"))
+    assert response.content.count(b'class="table__event"') == 13
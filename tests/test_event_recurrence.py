@@ -1,6 +1,9 @@
 import calendar
+from datetime import timedelta
+from io import StringIO
 
 import pytest
+from django.core.management import call_command
 from django.utils.timezone import localtime
 from dukop.apps.calendar import models
 from dukop.apps.calendar.utils import get_now
@@ -23,7 +26,7 @@ def test_create_weekly_recurrence(single_event):  # noqa
     """
     Create and test weekly recurrence
     """
-    original_weekday = single_event.times.first().start.weekday()
+    original_weekday = localtime(single_event.times.first().start).weekday()
     recurrence = models.EventRecurrence.objects.create(
         event=single_event,
         event_time_anchor=single_event.times.first(),
@@ -35,7 +38,7 @@ def test_create_weekly_recurrence(single_event):  # noqa
     assert recurrence.times.all().count() == expected_count
 
     for event_time in recurrence.times.all():
-        assert event_time.start.weekday() == original_weekday
+        assert localtime(event_time.start).weekday() == original_weekday
 
     recurrence.sync()
     assert recurrence.times.all().count() == expected_count
@@ -89,7 +92,7 @@ def test_create_first_week_of_month_recurrence(single_event):  # noqa
     """
     Create and test weekly recurrence
     """
-    original_weekday = single_event.times.first().start.weekday()
+    original_weekday = localtime(single_event.times.first().start).weekday()
     anchor_event_time = single_event.times.first()
     recurrence = models.EventRecurrence.objects.create(
         event=single_event,
@@ -100,9 +103,9 @@ def test_create_first_week_of_month_recurrence(single_event):  # noqa
 
     assert recurrence.times.all().first() == anchor_event_time
     for event_time in recurrence.times.all():
-        assert event_time.start.weekday() == original_weekday
+        assert localtime(event_time.start).weekday() == original_weekday
         if event_time != anchor_event_time:
-            assert event_time.start.day < 8
+            assert localtime(event_time.start).day < 8
 
     expected_counts = [default_length_days // 30, default_length_days // 30 + 1]
     assert recurrence.times.all().count() in expected_counts
@@ -115,7 +118,7 @@ def test_create_second_week_of_month_recurrence(single_event):  # noqa
     """
     Create and test weekly recurrence
     """
-    original_weekday = single_event.times.first().start.weekday()
+    original_weekday = localtime(single_event.times.first().start).weekday()
     anchor_event_time = single_event.times.first()
     recurrence = models.EventRecurrence.objects.create(
         event=single_event,
@@ -126,9 +129,9 @@ def test_create_second_week_of_month_recurrence(single_event):  # noqa
 
     assert recurrence.times.all().first() == anchor_event_time
     for event_time in recurrence.times.all():
-        assert event_time.start.weekday() == original_weekday
+        assert localtime(event_time.start).weekday() == original_weekday
         if event_time != anchor_event_time:
-            assert event_time.start.day >= 8 < 15
+            assert localtime(event_time.start).day >= 8 < 15
 
     expected_counts = [default_length_days // 30, default_length_days // 30 + 1]
     assert recurrence.times.all().count() in expected_counts
@@ -141,7 +144,7 @@ def test_create_third_week_of_month_recurrence(single_event):  # noqa
     """
     Create and test weekly recurrence
     """
-    original_weekday = single_event.times.first().start.weekday()
+    original_weekday = localtime(single_event.times.first().start).weekday()
     anchor_event_time = single_event.times.first()
     recurrence = models.EventRecurrence.objects.create(
         event=single_event,
@@ -152,9 +155,9 @@ def test_create_third_week_of_month_recurrence(single_event):  # noqa
 
     assert recurrence.times.all().first() == anchor_event_time
     for event_time in recurrence.times.all():
-        assert event_time.start.weekday() == original_weekday
+        assert localtime(event_time.start).weekday() == original_weekday
         if event_time != anchor_event_time:
-            assert event_time.start.day >= 14 < 22
+            assert localtime(event_time.start).day >= 14 < 22
 
     expected_counts = [default_length_days // 30, default_length_days // 30 + 1]
     assert recurrence.times.all().count() in expected_counts
@@ -167,7 +170,7 @@ def test_last_day_of_month_recurrence(single_event):  # noqa
     """
     Create and test weekly recurrence
     """
-    original_weekday = single_event.times.first().start.weekday()
+    original_weekday = localtime(single_event.times.first().start).weekday()
     anchor_event_time = single_event.times.first()
     recurrence = models.EventRecurrence.objects.create(
         event=single_event,
@@ -178,12 +181,12 @@ def test_last_day_of_month_recurrence(single_event):  # noqa
 
     assert recurrence.times.all().first() == anchor_event_time
     for event_time in recurrence.times.all():
-        assert event_time.start.weekday() == original_weekday
+        assert localtime(event_time.start).weekday() == original_weekday
         if event_time != anchor_event_time:
             __, last_day = calendar.monthrange(
-                event_time.start.year, event_time.start.month
+                localtime(event_time.start).year, localtime(event_time.start).month
             )
-            assert event_time.start.day > last_day - 7
+            assert localtime(event_time.start).day > last_day - 7
 
     expected_counts = [default_length_days // 30, default_length_days // 30 + 1]
     assert recurrence.times.all().count() in expected_counts
@@ -269,3 +272,124 @@ def test_recurrence_dst_backwards(single_event):  # noqa
 
     for time in recurrence.times.all():
         assert localtime(time.end).hour == localtime(first_time.end).hour
+
+
+@pytest.mark.django_db()
+def test_sync_result_counts(single_event, django_assert_max_num_queries):  # noqa
+    """
+    Sync writes the difference between existing and generated times in bulk
+    """
+    recurrence = models.EventRecurrence.objects.create(
+        event=single_event,
+        event_time_anchor=single_event.times.first(),
+        every_week=True,
+    )
+    result = recurrence.sync()
+    expected_count = default_length_days // 7 + 1
+    assert result.inserted == expected_count - 1
+    assert result.updated == 1
+    assert result.removed == 0
+
+    # Nothing has changed, so nothing should be written, regardless of the
+    # number of occurrences in the series.
+    with django_assert_max_num_queries(6):
+        result = recurrence.sync()
+    assert result == (0, 0, 0)
+
+    recurrence.end = timedelta_fixed_time(
+        recurrence.event_time_anchor.start, days=default_length_days - 7
+    ).date()
+    result = recurrence.sync()
+    assert result.inserted == 0
+    assert result.removed == 1
+    assert recurrence.times.all().count() == expected_count - 1
+
+
+@pytest.mark.django_db()
+def test_sync_queries_bounded(single_event, django_assert_max_num_queries):  # noqa
+    """
+    The signals of the rows that a sync writes or removes are handled per
+    transaction, so the queries don't grow with the number of rows
+    """
+    recurrence = models.EventRecurrence.objects.create(
+        event=single_event,
+        event_time_anchor=single_event.times.first(),
+        every_week=True,
+    )
+    with django_assert_max_num_queries(16):
+        result = recurrence.sync()
+    assert result.inserted > 16
+
+    recurrence.end = timedelta_fixed_time(
+        recurrence.event_time_anchor.start, days=default_length_days // 2
+    ).date()
+    with django_assert_max_num_queries(16):
+        result = recurrence.sync()
+    assert result.removed > 10
+
+
+@pytest.mark.django_db()
+def test_extend_recurrences(single_event):  # noqa
+    """
+    Extending a recurrence only creates the tail beyond its watermark
+    """
+    anchor_event_time = single_event.times.first()
+    recurrence = models.EventRecurrence.objects.create(
+        event=single_event,
+        event_time_anchor=anchor_event_time,
+        every_week=True,
+    )
+    recurrence.sync(maximum=30)
+    recurrence.refresh_from_db()
+    assert recurrence.materialized_until == (
+        timedelta_fixed_time(anchor_event_time.start, days=30).date()
+    )
+    materialized = {et.pk: et.modified for et in recurrence.times.all()}
+
+    call_command("calendar_extend_recurrences", horizon=90, stdout=StringIO())
+    recurrence.refresh_from_db()
+    assert recurrence.materialized_until == (
+        timedelta_fixed_time(get_now(), days=90).date()
+    )
+
+    times = list(recurrence.times.all())
+    assert len(times) > len(materialized)
+    for i, event_time in enumerate(times):
+        assert event_time.start == timedelta_fixed_time(
+            anchor_event_time.start, days=7 * i
+        )
+        if event_time.pk in materialized:
+            assert event_time.modified == materialized[event_time.pk]
+    assert localtime(times[-1].start).date() >= recurrence.materialized_until - (
+        timedelta(days=7)
+    )
+
+    # Running it again does not create anything
+    call_command("calendar_extend_recurrences", horizon=90, stdout=StringIO())
+    assert recurrence.times.all().count() == len(times)
+
+
+@pytest.mark.django_db()
+def test_extend_old_recurrence(single_event):  # noqa
+    """
+    A series whose last time is long past is extended from today, the past
+    times are not backfilled
+    """
+    anchor_event_time = single_event.times.first()
+    anchor_event_time.start = get_now() - timedelta(days=400)
+    anchor_event_time.end = anchor_event_time.start + timedelta(hours=2)
+    anchor_event_time.save()
+    recurrence = models.EventRecurrence.objects.create(
+        event=single_event,
+        event_time_anchor=anchor_event_time,
+        every_week=True,
+    )
+    anchor_event_time.recurrence = recurrence
+    anchor_event_time.save()
+    assert recurrence.materialized_until is None
+
+    call_command("calendar_extend_recurrences", horizon=90, stdout=StringIO())
+    new_times = recurrence.times.exclude(pk=anchor_event_time.pk)
+    assert new_times.count() <= 90 // 7 + 1
+    today = localtime(get_now()).date()
+    assert all(localtime(et.start).date() >= today for et in new_times)
@@ -0,0 +1,335 @@
+import re
+from datetime import timedelta
+from io import BytesIO
+
+import pytest
+from dateutil.rrule import rrulestr
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls.base import reverse
+from django.utils import timezone
+from django_ical.views import ICalFeed
+from dukop.apps.calendar import feeds
+from dukop.apps.calendar import models
+from dukop.apps.calendar import spheres
+from dukop.apps.calendar import utils
+from dukop.apps.users.models import Group
+from dukop.apps.users.models import Location
+from icalendar import Calendar
+from PIL import Image
+
+from .fixtures_calendar import single_event  # noqa
+from .fixtures_users import single_user  # noqa
+
+
+@pytest.mark.django_db()
+def test_ical_feed_cache(client, single_event):  # noqa
+    url = reverse("calendar:feed_ical")
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.streaming
+    assert b"SUMMARY:Test event" in response.getvalue()
+    assert response["Content-Type"].startswith("text/calendar")
+    etag = response["ETag"]
+    last_modified = response["Last-Modified"]
+
+    # Served from the cache
+    with CaptureQueriesContext(connection) as context:
+        response = client.get(url)
+    assert response.status_code == 200
+    assert not response.streaming
+    assert response["ETag"] == etag
+    assert not [
+        query for query in context.captured_queries if "eventtime" in query["sql"]
+    ]
+
+    assert client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 304
+    # Only the ETag is compared, see test_ical_feed_deletion
+    assert client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code == 200
+
+    single_event.name = "Renamed event"
+    single_event.save()
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response["ETag"] != etag
+    assert b"SUMMARY:Renamed event" in response.getvalue()
+
+    # A new image makes the cached feeds stale too
+    etag = response["ETag"]
+    models.EventImage.objects.create(event=single_event)
+    assert client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 200
+
+    # Each process of the tests has its own cache
+    assert feeds.get_feed_cache_timeout() == feeds.FEED_LOCAL_CACHE_TIMEOUT
+
+
+@pytest.mark.django_db()
+def test_ical_feed_deletion(client, single_event):  # noqa
+    url = reverse("calendar:feed_ical")
+    other_event = models.Event.objects.create(name="Other event")
+    other_event.spheres.add(spheres.registry.get_default())
+    other_event.times.create(start=single_event.times.get().start)
+    response = client.get(url)
+    assert b"SUMMARY:Other event" in response.getvalue()
+    etag = response["ETag"]
+    last_modified = response["Last-Modified"]
+
+    # The newest change of the remaining events stays the same
+    other_event.delete()
+    response = client.get(
+        url, HTTP_IF_NONE_MATCH=etag, HTTP_IF_MODIFIED_SINCE=last_modified
+    )
+    assert response.status_code == 200
+    assert b"SUMMARY:Other event" not in response.getvalue()
+    response = client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+    assert response.status_code == 200
+
+
+@pytest.mark.django_db()
+def test_ical_feed_per_sphere(client, single_event):  # noqa
+    default_url = reverse(
+        "calendar:feed_ical",
+        kwargs={"sphere_id": spheres.registry.get_default().pk},
+    )
+    assert b"BEGIN:VEVENT" in client.get(default_url).getvalue()
+
+    single_event.spheres.clear()
+    assert b"BEGIN:VEVENT" not in client.get(default_url).getvalue()
+    assert (
+        client.get(
+            reverse("calendar:feed_ical", kwargs={"sphere_id": 9999})
+        ).status_code
+        == 404
+    )
+
+
+@pytest.mark.django_db()
+def test_ical_feed_streaming(client, single_event, monkeypatch):  # noqa
+    event_time = single_event.times.get()
+    for days in range(1, 6):
+        models.EventTime.objects.create(
+            event=single_event,
+            start=event_time.start + timedelta(days=days),
+            end=event_time.end + timedelta(days=days),
+        )
+    monkeypatch.setattr(feeds, "FEED_CHUNK_SIZE", 2)
+    # Too large to be cached
+    monkeypatch.setattr(feeds, "FEED_CACHE_MAX_SIZE", 100)
+    url = reverse("calendar:feed_ical")
+
+    # django_ical's own rendering of the whole feed in one go
+    expected = ICalFeed.__call__(feeds.EventFeed(), RequestFactory().get(url))
+    response = client.get(url)
+    assert response.streaming
+    streamed = response.getvalue()
+
+    # DTSTAMP is the time of writing
+    def normalize_dtstamp(content):
+        return re.sub(rb"(?m)^DTSTAMP:\d{8}T\d{6}Z\r$", b"DTSTAMP:X\r", content)
+
+    assert streamed.count(b"BEGIN:VEVENT") == 6
+    assert normalize_dtstamp(streamed).count(b"DTSTAMP:X\r\n") == 6
+    assert normalize_dtstamp(streamed) == normalize_dtstamp(expected.content)
+    assert client.get(url).streaming
+
+
+def seconds(dtm):
+    """iCalendar has no microseconds"""
+    return dtm.replace(microsecond=0)
+
+
+@pytest.mark.django_db()
+@pytest.mark.parametrize(
+    "recurrence_type",
+    ["every_week", "biweekly_even", "biweekly_odd", "first_week_of_month"],
+)
+def test_ical_feed_rrule_matches_times(client, single_event, recurrence_type):  # noqa
+    recurrence = models.EventRecurrence.objects.create(
+        event=single_event,
+        event_time_anchor=single_event.times.get(),
+        **{recurrence_type: True}
+    )
+    recurrence.sync()
+
+    calendar = Calendar.from_ical(client.get(reverse("calendar:feed_ical")).getvalue())
+    series = [event for event in calendar.walk("VEVENT") if "RRULE" in event]
+    assert len(series) == 1
+    assert calendar.walk("VTIMEZONE")
+    rule = rrulestr(
+        series[0]["RRULE"].to_ical().decode(), dtstart=series[0].decoded("DTSTART")
+    )
+    stored = [
+        seconds(start)
+        for start in recurrence.times.exclude(
+            pk=recurrence.event_time_anchor_id
+        ).values_list("start", flat=True)
+    ]
+    assert stored
+    assert rule.between(stored[0], stored[-1], inc=True) == stored
+
+
+@pytest.mark.django_db()
+def test_ical_feed_series_exceptions(client, single_event):  # noqa
+    recurrence = models.EventRecurrence.objects.create(
+        event=single_event,
+        event_time_anchor=single_event.times.get(),
+        every_week=True,
+    )
+    recurrence.sync()
+    cancelled, rescheduled, deleted = recurrence.times.exclude(
+        pk=recurrence.event_time_anchor_id
+    )[:3]
+    cancelled.is_cancelled = True
+    cancelled.save()
+    rescheduled.start += timedelta(hours=1)
+    rescheduled.recurrence_auto = False
+    rescheduled.save()
+    deleted.delete()
+
+    content = client.get(reverse("calendar:feed_ical")).getvalue()
+    calendar = Calendar.from_ical(content)
+    events = calendar.walk("VEVENT")
+    # The anchor, the series and the rescheduled occurrence
+    assert len(events) == 3
+    anchor, series, override = events
+    assert "RRULE" not in anchor
+    assert override["UID"] == series["UID"]
+    assert override.decoded("RECURRENCE-ID") == seconds(
+        rescheduled.start - timedelta(hours=1)
+    )
+    assert override.decoded("DTSTART") == seconds(rescheduled.start)
+    assert [exdate.dt for exdate in series["EXDATE"].dts] == [
+        seconds(cancelled.start),
+        seconds(deleted.start),
+    ]
+
+
+def create_events_with_images(count):
+    image_file = BytesIO()
+    Image.new("RGB", (20, 20), "red").save(image_file, "PNG")
+    start = utils.get_now() + timedelta(days=1)
+    for i in range(count):
+        event = models.Event.objects.create(name="Event {}".format(i))
+        event.spheres.add(spheres.registry.get_default())
+        models.EventTime.objects.create(event=event, start=start)
+        image = models.EventImage(event=event)
+        image.image.save("test.png", ContentFile(image_file.getvalue()))
+
+
+@pytest.mark.django_db()
+def test_rss_feed_queries_do_not_grow(client, settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path)
+    url = reverse("calendar:feed_rss")
+    create_events_with_images(2)
+    with CaptureQueriesContext(connection) as context:
+        response = client.get(url)
+    assert response.content.count(b"<enclosure") == 2
+    queries = len(context.captured_queries)
+
+    create_events_with_images(10)
+    with CaptureQueriesContext(connection) as context:
+        response = client.get(url)
+    assert response.content.count(b"<enclosure") == 12
+    assert b"https://example.com/da/event/" in response.content
+    assert len(context.captured_queries) <= queries
+
+
+@pytest.mark.django_db()
+@pytest.mark.parametrize("feed_url", ["calendar:feed_ical", "calendar:feed_rss"])
+def test_feed_parameters(client, single_event, feed_url):  # noqa
+    host = Group.objects.create(name="Host")
+    location = Location.objects.create(name="Venue")
+    start = utils.get_now() + timedelta(days=2)
+    event = models.Event.objects.create(
+        name="Hosted event", host=host, location=location
+    )
+    models.EventTime.objects.create(event=event, start=start)
+
+    def count(**params):
+        response = client.get(reverse(feed_url), params)
+        assert response.status_code == 200
+        content = response.getvalue()
+        return content.count(b"BEGIN:VEVENT") + content.count(b"<item>")
+
+    assert count() == 2
+    assert count(days=7) == 1
+    assert count(to=(start + timedelta(days=1)).date().isoformat()) == 1
+    assert count(**{"from": (start + timedelta(days=1)).date().isoformat()}) == 1
+    assert count(limit=1) == 1
+    assert count(host=host.pk) == 1
+    assert count(location=location.pk) == 1
+    assert count(days=100000, limit=100000) == 2
+
+    assert client.get(reverse(feed_url), {"days": "week"}).status_code == 400
+    assert client.get(reverse(feed_url), {"to": "2021-02-30"}).status_code == 400
+    assert client.get(reverse(feed_url), {"host": 9999}).status_code == 404
+
+
+@pytest.mark.django_db()
+def test_feed_query_is_capped(rf):
+    today = timezone.localtime(utils.get_now()).date()
+    query = feeds.get_feed_query(
+        rf.get("/", {"from": "2000-01-01", "days": 100000, "limit": 100000}),
+        max_limit=10,
+    )
+    assert query.start.date() == today
+    assert query.end.date() == today + timedelta(days=feeds.FEED_MAX_DAYS - 1)
+    assert query.limit == 10
+    assert feeds.get_query_cache_key(query) != feeds.get_query_cache_key(
+        feeds.get_feed_query(rf.get("/"))
+    )
+
+
+@pytest.mark.django_db(transaction=True)
+def test_event_ical(client, single_event):  # noqa
+    url = reverse("calendar:event_ical", kwargs={"pk": single_event.pk})
+    detail = client.get(
+        reverse("calendar:event_detail", kwargs={"pk": single_event.pk})
+    )
+    assert url in detail.content.decode()
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response["Content-Type"].startswith("text/calendar")
+    assert response["Cache-Control"] == "no-cache"
+    content = response.getvalue()
+    assert content.count(b"BEGIN:VEVENT") == 1
+    assert b"SUMMARY:Test event" in content
+    etag = response["ETag"]
+    assert client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 304
+
+    # Times don't change Event.modified
+    event_time = single_event.times.get()
+    models.EventTime.objects.create(
+        event=single_event,
+        start=event_time.start + timedelta(days=1),
+        end=event_time.end + timedelta(days=1),
+    )
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response.getvalue().count(b"BEGIN:VEVENT") == 2
+
+    other_event = models.Event.objects.create(name="Other event")
+    models.EventTime.objects.create(event=other_event, start=event_time.start)
+    assert b"Other event" not in client.get(url).getvalue()
+    assert (
+        client.get(reverse("calendar:event_ical", kwargs={"pk": 9999})).status_code
+        == 404
+    )
+
+
+@pytest.mark.django_db()
+def test_event_ical_unpublished(client, single_event, single_user):  # noqa
+    url = reverse("calendar:event_ical", kwargs={"pk": single_event.pk})
+    single_event.published = False
+    single_event.owner_user = single_user
+    single_event.save()
+    assert client.get(url).status_code == 404
+
+    client.force_login(single_user)
+    response = client.get(url)
+    assert response.status_code == 200
+    assert b"SUMMARY:Test event" in response.getvalue()
+    assert "private" in response["Cache-Control"]
@@ -0,0 +1,90 @@
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+from dukop.apps.calendar import models
+from dukop.apps.calendar import spheres
+from dukop.apps.calendar.templatetags.calendar_tags import get_event_times
+
+from .fixtures_calendar import single_event  # noqa
+
+
+def listing_values():
+    return list(
+        models.OccurrenceListing.objects.order_by("pk").values(
+            *(field.attname for field in models.OccurrenceListing._meta.concrete_fields)
+        )
+    )
+
+
+@pytest.mark.django_db()
+def test_listing_follows_changes(single_event):  # noqa
+    default_sphere = spheres.registry.get_default()
+    event_time = single_event.times.get()
+    listing = models.OccurrenceListing.objects.get()
+    assert listing.event_time_id == event_time.pk
+    assert listing.effective_end == event_time.end
+    assert listing.sphere_ids == ",{},".format(default_sphere.pk)
+    assert not listing.has_image
+
+    single_event.name = "Renamed"
+    single_event.published = False
+    single_event.save()
+    image = models.EventImage.objects.create(
+        event=single_event, image="uploads/events/test.jpg"
+    )
+    other_sphere = models.Sphere.objects.create(name="Other")
+    single_event.spheres.add(other_sphere)
+    event_time.end = None
+    event_time.save()
+
+    listing = models.OccurrenceListing.objects.get()
+    assert listing.name == "Renamed"
+    assert not listing.published
+    assert listing.first_image_id == image.pk
+    assert listing.has_image
+    assert listing.sphere_ids == ",{},{},".format(default_sphere.pk, other_sphere.pk)
+    assert listing.effective_end == event_time.start
+
+    other_sphere.delete()
+    image.delete()
+    listing = models.OccurrenceListing.objects.get()
+    assert listing.sphere_ids == ",{},".format(default_sphere.pk)
+    assert not listing.has_image
+
+    default_sphere.event_set.clear()
+    assert models.OccurrenceListing.objects.get().sphere_ids == ""
+
+    models.EventImage.objects.create(
+        event=single_event, image="uploads/events/test.jpg"
+    )
+    single_event.delete()
+    assert not models.OccurrenceListing.objects.exists()
+
+
+@pytest.mark.django_db()
+def test_recurrence_sync_and_rebuild(single_event):  # noqa
+    recurrence = models.EventRecurrence.objects.create(
+        event=single_event,
+        event_time_anchor=single_event.times.first(),
+        every_week=True,
+    )
+    recurrence.sync()
+    assert models.OccurrenceListing.objects.count() == single_event.times.count()
+    assert len(get_event_times(days=60)) == 7
+
+    maintained = listing_values()
+    models.OccurrenceListing.objects.all().delete()
+    call_command("calendar_rebuild_listings", stdout=StringIO())
+    assert listing_values() == maintained
+
+
+@pytest.mark.django_db()
+def test_get_event_times_filters(single_event):  # noqa
+    assert len(get_event_times(sphere=spheres.registry.get_default())) == 1
+    assert len(get_event_times(sphere=models.Sphere.objects.create(name="X"))) == 0
+    assert len(get_event_times(published=False)) == 0
+    assert len(get_event_times(has_image=True)) == 0
+    assert len(get_event_times(has_image=False)) == 1
+    assert len(get_event_times(featured=True)) == 0
+    assert get_event_times()[0].event == single_event
@@ -0,0 +1,89 @@
+from datetime import datetime
+from datetime import timedelta
+
+import pytz
+from django.utils import timezone
+from django.utils import translation
+from django.utils.formats import date_format
+from dukop.apps.calendar import timezones
+from dukop.apps.calendar import utils
+from dukop.apps.calendar.utils import timedelta_fixed_time
+
+
+def pytz_timedelta_fixed_time(dtm1, tz, **kwargs):
+    """The original implementation, localizing with pytz on every call"""
+    localized_dtm1 = timezone.localtime(dtm1, tz)
+    return tz.localize(
+        datetime.combine(
+            localized_dtm1.date() + timedelta(**kwargs), localized_dtm1.time()
+        )
+    )
+
+
+def starts_around_dst_switches(tz):
+    """Times every 20 minutes on the days of several DST switches"""
+    for year in (1996, 2021, 2022, 2037):
+        for month, day in ((3, 26), (3, 27), (3, 28), (10, 29), (10, 30), (10, 31)):
+            for minutes in range(0, 24 * 60, 20):
+                naive = datetime(year, month, day) + timedelta(minutes=minutes)
+                yield tz.localize(naive)
+                # The same instant represented in UTC
+                yield tz.localize(naive).astimezone(pytz.utc)
+
+
+def test_identical_to_pytz():
+    for zone in ("Europe/Copenhagen", "America/New_York", "Australia/Sydney"):
+        tz = pytz.timezone(zone)
+        with timezone.override(tz):
+            for start in starts_around_dst_switches(tz):
+                for days in (-7, 1, 7, 14, 180):
+                    expected = pytz_timedelta_fixed_time(start, tz, days=days)
+                    result = timedelta_fixed_time(start, days=days)
+                    assert result == expected
+                    assert result.tzinfo is expected.tzinfo
+
+
+def test_localtime_identical_to_django():
+    tz = pytz.timezone("Europe/Copenhagen")
+    for start in starts_around_dst_switches(tz):
+        expected = timezone.localtime(start, tz)
+        result = timezones.localtime(start, tz)
+        assert result == expected
+        assert result.tzinfo is expected.tzinfo
+
+
+def test_weekly_series_keeps_wall_clock():
+    tz = pytz.timezone("Europe/Copenhagen")
+    start = tz.localize(datetime(2021, 1, 6, 19, 30))
+    with timezone.override(tz):
+        for weeks in range(53):
+            local = timezone.localtime(timedelta_fixed_time(start, days=7 * weeks))
+            assert local.date() == start.date() + timedelta(days=7 * weeks)
+            assert (local.hour, local.minute) == (19, 30)
+
+
+def test_timezone_without_transitions():
+    with timezone.override(pytz.utc):
+        start = datetime(2021, 3, 28, 1, 30, tzinfo=pytz.utc)
+        assert timedelta_fixed_time(start, days=1) == start + timedelta(days=1)
+
+
+def test_display_functions_identical_to_formatting():
+    tz = pytz.timezone("Europe/Copenhagen")
+    starts = list(starts_around_dst_switches(tz))
+    with timezone.override(tz):
+        for language in ("da", "en"):
+            with translation.override(language):
+                for start in starts:
+                    assert utils.display_date(start) == date_format(start)
+                    assert utils.display_time(start) == timezone.localtime(
+                        start
+                    ).strftime("%H:%M")
+                    assert utils.display_interval(start) == translation.gettext(
+                        "{start_date} at {start_time}"
+                    ).format(
+                        start_date=date_format(start),
+                        start_time=timezone.localtime(start).strftime("%H:%M"),
+                    )
+    # The same instant in UTC and local time is one entry
+    assert utils.cached_time_format.cache_info().hits >= len(starts)
@@ -0,0 +1,164 @@
+import calendar
+from datetime import date
+from datetime import datetime
+from datetime import timedelta
+
+import pytest
+import pytz
+from django.utils import timezone
+from dukop.apps.calendar import models
+from dukop.apps.calendar import occurrences
+from dukop.apps.calendar import timezones
+from dukop.apps.calendar.management.commands.calendar_benchmark_recurrences import (
+    stepwise_occurrences,
+)
+
+tz = pytz.timezone("Europe/Copenhagen")
+
+
+def make_recurrence(anchor_start, duration=timedelta(hours=2), **kwargs):
+    anchor = models.EventTime(start=anchor_start, end=anchor_start + duration)
+    return models.EventRecurrence(event_time_anchor=anchor, **kwargs)
+
+
+def local_starts(recurrence, start, end):
+    return [
+        timezone.localtime(occurrence_start)
+        for occurrence_start, __ in occurrences.expand(recurrence, start, end)
+    ]
+
+
+def test_weekly_keeps_wall_clock_across_dst():
+    anchor_start = tz.localize(datetime(2021, 10, 14, 19, 30))
+    recurrence = make_recurrence(anchor_start, every_week=True)
+    starts = local_starts(
+        recurrence, anchor_start, tz.localize(datetime(2022, 4, 14, 0, 0))
+    )
+    assert len(starts) == 25
+    for i, start in enumerate(starts, start=1):
+        assert start.date() == anchor_start.date() + timedelta(days=7 * i)
+        assert (start.hour, start.minute) == (19, 30)
+
+
+def wall_clock(occurrences):
+    """
+    The naive local times of (start, end) tuples. The stepwise monthly
+    generators keep the UTC offset of the anchor across DST changes, so only
+    the wall clock can be compared.
+    """
+    return [
+        (start.replace(tzinfo=None), end.replace(tzinfo=None) if end else None)
+        for start, end in occurrences
+    ]
+
+
+@pytest.mark.parametrize(
+    "type_id", [t for t, __ in models.EventRecurrence.RECURRENCE_TYPES]
+)
+@pytest.mark.parametrize(
+    "anchor_naive",
+    [
+        # Right before and after the changes to and from summer time
+        datetime(2021, 3, 24, 19, 30),
+        datetime(2021, 3, 29, 1, 15),
+        datetime(2021, 10, 27, 19, 30),
+        datetime(2021, 11, 1, 2, 30),
+    ],
+)
+def test_expand_matches_stepwise_generator(type_id, anchor_naive):
+    anchor_start = tz.localize(anchor_naive)
+    end = tz.localize(anchor_naive + timedelta(days=400))
+    recurrence = make_recurrence(anchor_start, **{type_id: True})
+    expected = wall_clock(stepwise_occurrences(recurrence, anchor_start, end))
+    actual = wall_clock(occurrences.expand(recurrence, anchor_start, end))
+    assert expected
+    if type_id not in ("every_week", "biweekly_even", "biweekly_odd"):
+        # The stepwise monthly generators start in the month after the
+        # anchor, the expansion also has the rest of the anchor's month
+        in_anchor_month = [
+            occurrence
+            for occurrence in actual
+            if occurrence[0].timetuple()[:2] == anchor_naive.timetuple()[:2]
+        ]
+        assert all(start > anchor_naive for start, __ in in_anchor_month)
+        actual = [
+            occurrence for occurrence in actual if occurrence not in in_anchor_month
+        ]
+    assert actual == expected
+
+
+def test_biweekly_parity():
+    anchor_start = tz.localize(datetime(2021, 11, 1, 18, 0))
+    end = tz.localize(datetime(2022, 6, 1))
+    for even in (True, False):
+        recurrence = make_recurrence(
+            anchor_start, biweekly_even=even, biweekly_odd=not even
+        )
+        starts = local_starts(recurrence, anchor_start, end)
+        assert starts
+        for start in starts:
+            assert start.weekday() == anchor_start.weekday()
+            assert start.isocalendar()[1] % 2 == (0 if even else 1)
+
+
+def test_monthly():
+    # A Wednesday in the first week of the month
+    anchor_start = tz.localize(datetime(2021, 9, 1, 17, 0))
+    end = tz.localize(datetime(2022, 9, 1))
+    for type_id, offset_weeks in occurrences.MONTHLY_OFFSETS:
+        recurrence = make_recurrence(anchor_start, **{type_id: True})
+        starts = local_starts(recurrence, anchor_start, end)
+        assert len(starts) in (11, 12)
+        for start in starts:
+            assert start.weekday() == 2
+            assert 7 * offset_weeks < start.day <= 7 * (offset_weeks + 1)
+            assert start.hour == 17
+
+    recurrence = make_recurrence(anchor_start, last_week_of_month=True)
+    starts = local_starts(recurrence, anchor_start, end)
+    assert len(starts) == 12
+    for start in starts:
+        __, last_day = calendar.monthrange(start.year, start.month)
+        assert start.weekday() == 2
+        assert start.day > last_day - 7
+
+
+def test_combined_types_have_no_duplicates():
+    anchor_start = tz.localize(datetime(2021, 9, 1, 17, 0))
+    recurrence = make_recurrence(
+        anchor_start,
+        biweekly_even=True,
+        first_week_of_month=True,
+        last_week_of_month=True,
+    )
+    starts = local_starts(recurrence, anchor_start, tz.localize(datetime(2022, 9, 1)))
+    assert starts == sorted(set(starts))
+
+
+def test_window():
+    anchor_start = tz.localize(datetime(2021, 1, 4, 10, 0))
+    recurrence = make_recurrence(anchor_start, every_week=True)
+    starts = local_starts(
+        recurrence,
+        tz.localize(datetime(2021, 2, 1, 12, 0)),
+        tz.localize(datetime(2021, 3, 1, 10, 0)),
+    )
+    # The date of the window start is included, the end is exclusive
+    assert [start.date() for start in starts] == [
+        date(2021, 2, 1),
+        date(2021, 2, 8),
+        date(2021, 2, 15),
+        date(2021, 2, 22),
+    ]
+
+
+def test_localize_many_identical_to_pytz():
+    naives = []
+    for year in (2021, 2022):
+        for month, day in ((3, 28), (10, 31), (3, 27), (10, 30)):
+            for minutes in range(0, 5 * 60, 15):
+                naives.append(datetime(year, month, day) + timedelta(minutes=minutes))
+    for localized, naive in zip(timezones.localize_many(naives, tz), naives):
+        expected = tz.localize(naive)
+        assert localized == expected
+        assert localized.tzinfo is expected.tzinfo
@@ -0,0 +1,124 @@
+from datetime import timedelta
+
+import pytest
+from django.contrib import messages
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.cache import cache
+from django.db import transaction
+from django.urls.base import reverse
+from dukop.apps.calendar import models
+from dukop.apps.calendar import pagecache
+from dukop.apps.calendar import spheres
+from dukop.apps.calendar import utils
+
+from .fixtures_calendar import single_event  # noqa
+from .fixtures_users import single_user  # noqa
+
+
+@pytest.fixture
+def page_cache(settings, monkeypatch):
+    # The LocMemCache of the tests stands in for a shared cache
+    monkeypatch.setattr(utils, "is_cache_shared", lambda: True)
+    settings.DUKOP_PAGE_CACHE_TIMEOUT = 300
+    cache.clear()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_index_page_cache(client, page_cache, single_event):  # noqa
+    url = reverse("calendar:index")
+    response = client.get(url)
+    assert b"Test event" in response.content
+    keys = response["Surrogate-Key"].split()
+    assert pagecache.event_tag(single_event.pk) in keys
+    assert pagecache.sphere_tag(spheres.registry.get_default()) in keys
+    assert "s-maxage=300" in response["Cache-Control"]
+
+    # Changes without signals are not seen until the page is purged
+    models.Event.objects.filter(pk=single_event.pk).update(name="Renamed event")
+    response = client.get(url)
+    assert response.context is None
+    assert b"Test event" in response.content
+    assert response["Surrogate-Key"].split() == keys
+
+    single_event.name = "Renamed event"
+    single_event.save()
+    assert b"Renamed event" in client.get(url).content
+
+    # A new event is not tagged on the page yet, its week is
+    other_event = models.Event.objects.create(name="Other event")
+    other_event.spheres.add(spheres.registry.get_default())
+    models.EventTime.objects.create(
+        event=other_event, start=utils.get_now() + timedelta(days=2)
+    )
+    assert b"Other event" in client.get(url).content
+
+
+@pytest.mark.django_db()
+def test_event_list_page_cache(client, page_cache, single_event):  # noqa
+    url = reverse(
+        "calendar:event_list",
+        kwargs={
+            "sphere_id": spheres.registry.get_default().pk,
+            "pivot_date": single_event.times.first().start.date(),
+        },
+    )
+    assert b"Test event" in client.get(url).content
+    assert client.get(url).context is None
+
+    sphere = spheres.registry.get_default()
+    sphere.name = "Renamed sphere"
+    sphere.save()
+    response = client.get(url)
+    assert response.context is not None
+    assert b"Renamed sphere" in response.content
+
+
+@pytest.mark.django_db(transaction=True)
+def test_pages_purged_once(monkeypatch, single_event):  # noqa
+    recurrence = models.EventRecurrence.objects.create(
+        event=single_event, event_time_anchor=single_event.times.get(), every_week=True
+    )
+    recurrence.sync()
+    recurrence.end = (recurrence.event_time_anchor.start + timedelta(days=60)).date()
+    purged_events = []
+    purged_spheres = []
+    monkeypatch.setattr(pagecache, "purge_events", purged_events.append)
+    monkeypatch.setattr(pagecache, "purge_spheres", purged_spheres.append)
+
+    # The rows that a sync removes are purged together on commit
+    with transaction.atomic():
+        recurrence.save()
+        assert recurrence.sync().removed > 1
+        assert not purged_events
+    assert purged_events == [{single_event.pk}]
+    assert purged_spheres == [{spheres.registry.get_default().pk}]
+
+    purged_events.clear()
+    event_id = single_event.pk
+    single_event.delete()
+    assert purged_events == [{event_id}]
+
+
+@pytest.mark.django_db()
+def test_page_cache_bypass(client, rf, page_cache, single_user):  # noqa
+    url = reverse("calendar:index")
+    client.get(url)
+
+    client.force_login(single_user)
+    response = client.get(url)
+    assert response.context is not None
+    assert "private" in response["Cache-Control"]
+    assert "Surrogate-Key" not in response
+
+    request = rf.get(url)
+    request.user = single_user
+    request._messages = CookieStorage(request)
+    assert not pagecache.has_messages(request)
+    messages.info(request, "Hello")
+    assert pagecache.has_messages(request)
+    assert not pagecache.is_cacheable(request)
+
+
+def test_page_cache_needs_shared_cache(settings):
+    settings.DUKOP_PAGE_CACHE_TIMEOUT = 300
+    assert pagecache.get_page_cache_timeout() == 0
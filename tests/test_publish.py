@@ -0,0 +1,57 @@
+import gzip
+import os
+import time
+
+import pytest
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls.base import reverse
+from django.utils import translation
+from dukop.apps.calendar import models
+from dukop.apps.calendar import publish
+from dukop.apps.calendar import spheres
+
+from .fixtures_calendar import single_event  # noqa
+
+
+@pytest.mark.django_db()
+def test_publish_feeds(client, settings, tmp_path, single_event):  # noqa
+    settings.DUKOP_FEED_PUBLISH_ROOT = tmp_path
+    settings.ALLOWED_HOSTS = ["*"]
+    root = str(tmp_path)
+
+    call_command("calendar_publish_feeds")
+    sphere_id = spheres.registry.get_default().pk
+    for language in ("da", "en"):
+        for file_name in ("all.ics", "all.rss", "{}.ics".format(sphere_id)):
+            assert os.path.exists(os.path.join(root, language, file_name + ".gz"))
+
+    ics_path = os.path.join(root, "da", "all.ics")
+    with open(ics_path, "rb") as ics_file:
+        content = ics_file.read()
+    with open(ics_path + ".gz", "rb") as gz_file:
+        assert gzip.decompress(gz_file.read()) == content
+    with translation.override("da"):
+        assert client.get(reverse("calendar:feed_ical")).getvalue() == content
+
+    # Nothing changed, nothing is written, not even for the empty feeds of
+    # the other spheres. The mtime is moved back, so a rewrite within the
+    # same second would still be seen.
+    mtime = os.stat(ics_path).st_mtime - 60
+    os.utime(ics_path, (mtime, mtime))
+    assert not publish.is_due(root)
+    assert publish.publish_feeds(root) == 0
+    assert os.stat(ics_path).st_mtime == mtime
+
+    publish.mark_changed()
+    assert not publish.is_due(root)
+    assert publish.is_due(root, now=time.time() + publish.get_debounce())
+
+
+@pytest.mark.django_db()
+def test_image_marks_feeds_changed(settings, tmp_path, single_event):  # noqa
+    """The RSS feeds have the images as enclosures"""
+    settings.DUKOP_FEED_PUBLISH_ROOT = tmp_path
+    with TestCase.captureOnCommitCallbacks(execute=True):
+        models.EventImage.objects.create(event=single_event)
+    assert os.path.exists(os.path.join(str(tmp_path), publish.CHANGED_MARKER))
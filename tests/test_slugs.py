@@ -0,0 +1,64 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from dukop.apps.calendar import models
+
+
+@pytest.mark.django_db()
+def test_free_suffixes():
+    slugs = [models.Event.objects.create(name="Fællesspisning").slug for __ in range(4)]
+    assert slugs == [
+        "fllesspisning",
+        "fllesspisning-2",
+        "fllesspisning-3",
+        "fllesspisning-4",
+    ]
+
+    models.Event.objects.filter(slug="fllesspisning-2").delete()
+    assert models.Event.objects.create(name="Fællesspisning").slug == (
+        "fllesspisning-2"
+    )
+
+
+@pytest.mark.django_db()
+def test_long_names_and_spheres():
+    name = "A very long name " * 10
+    first = models.Sphere.objects.create(name=name)
+    second = models.Sphere.objects.create(name=name)
+    assert len(first.slug) == models.SLUG_MAX_LENGTH
+    assert len(second.slug) == models.SLUG_MAX_LENGTH
+    assert second.slug.endswith("-2")
+
+    assert models.Sphere.objects.create(name="!!!").slug == "sphere"
+
+
+@pytest.mark.django_db()
+def test_one_query_per_allocation():
+    for __ in range(20):
+        models.Event.objects.create(name="Popular")
+    with CaptureQueriesContext(connection) as context:
+        assert models.Event.objects.create(name="Popular").slug == "popular-21"
+    prefix_queries = [
+        query for query in context.captured_queries if "LIKE" in query["sql"]
+    ]
+    assert len(prefix_queries) == 1
+
+
+@pytest.mark.django_db()
+def test_slug_taken_by_another_worker(monkeypatch):
+    models.Event.objects.create(name="Concert")
+    sluggify_instance = models.sluggify_instance
+    calls = []
+
+    def stale_sluggify_instance(instance, *args):
+        # The first allocation does not see the row that was just inserted
+        calls.append(instance)
+        if len(calls) == 1:
+            instance.slug = "concert"
+        else:
+            sluggify_instance(instance, *args)
+
+    monkeypatch.setattr(models, "sluggify_instance", stale_sluggify_instance)
+    event = models.Event.objects.create(name="Concert")
+    assert len(calls) == 2
+    assert event.slug == "concert-2"
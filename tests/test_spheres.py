@@ -0,0 +1,79 @@
+import pytest
+from django.urls.base import reverse
+from dukop.apps.calendar import checks
+from dukop.apps.calendar import models
+from dukop.apps.calendar import spheres
+
+
+@pytest.mark.django_db()
+def test_registry():
+    default = spheres.registry.get_default()
+    assert default.default
+    sphere = models.Sphere.objects.create(name="Odense")
+    assert spheres.registry.get_by_id_or_default(sphere.id) == sphere
+    assert spheres.registry.get_by_id_or_default(None) == default
+    assert spheres.registry.get_by_id_or_default(-1) == default
+    assert spheres.registry.get_by_slug("odense") == sphere
+    assert spheres.registry.get_all()[-1] == default
+
+
+@pytest.mark.django_db()
+def test_other_process_reloads(django_assert_num_queries):
+    # Another worker with its own registry
+    worker_registry = spheres.SphereRegistry()
+    sphere = models.Sphere.objects.create(name="Odense")
+    worker_registry.check()
+    assert worker_registry.get_by_id_or_default(sphere.id).name == "Odense"
+
+    # Checking an unchanged version does not touch the database
+    with django_assert_num_queries(0):
+        worker_registry.check()
+
+    sphere.name = "Odense C"
+    sphere.save()
+    worker_registry.check()
+    assert worker_registry.get_by_id_or_default(sphere.id).name == "Odense C"
+
+    sphere.delete()
+    worker_registry.check()
+    assert worker_registry.get_by_slug("odense") is None
+
+
+@pytest.mark.django_db()
+def test_reload_swaps_whole_state():
+    worker_registry = spheres.SphereRegistry()
+    before = worker_registry.check()
+    sphere = models.Sphere.objects.create(name="Odense")
+    after = worker_registry.check()
+
+    # A reader that already holds the old state keeps a consistent view
+    assert before is not after
+    assert sphere.id not in before.by_id
+    assert before.default in before.all
+    assert after.by_id[sphere.id] == after.by_slug["odense"] == sphere
+    assert after.version != before.version
+
+
+@pytest.mark.django_db()
+def test_middleware_sphere(client):
+    sphere = models.Sphere.objects.create(name="Odense")
+    response = client.get(reverse("calendar:index"))
+    assert response.context["SPHERE"] == spheres.registry.get_default()
+    assert sphere in response.context["SPHERES"]
+
+    session = client.session
+    session["dukop_sphere"] = sphere.id
+    session.save()
+    response = client.get(reverse("calendar:index"))
+    assert response.context["SPHERE"] == sphere
+
+
+def test_check_shared_cache(settings):
+    assert [error.id for error in checks.check_shared_cache(None)] == ["calendar.E001"]
+    settings.CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.memcached.PyMemcacheCache",
+            "LOCATION": "127.0.0.1:11211",
+        }
+    }
+    assert checks.check_shared_cache(None) == []
@@ -1,8 +1,120 @@
+from datetime import datetime
+from datetime import timedelta
+
+import pytest
+import pytz
+from django.db import connection
+from django.template.loader import render_to_string
+from django.test.utils import CaptureQueriesContext
+from dukop.apps.calendar import models
+from dukop.apps.calendar import spheres
+from dukop.apps.calendar.templatetags.calendar_tags import event_description
+from dukop.apps.calendar.templatetags.calendar_tags import event_timeline
 from dukop.apps.calendar.templatetags.calendar_tags import url_alias
 
+from .fixtures_calendar import single_event  # noqa
+
 
 def test_url_alias():
     assert url_alias("https://hej.com/test") == "hej.com"
     assert url_alias("https://hej.com") == "hej.com"
     assert url_alias("http://hej.com") == "hej.com"
     assert url_alias("http://hej.com/lala/lala/?91892") == "hej.com"
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize("event_truncate", [None, 100])
+def test_event_card_cache(rf, single_event, event_truncate):  # noqa
+    request = rf.get("/")
+    request.sphere = spheres.registry.get_default()
+
+    def render():
+        event = models.Event.objects.for_card().get(pk=single_event.pk)
+        with CaptureQueriesContext(connection) as context:
+            content = render_to_string(
+                "calendar/includes/event_card.html",
+                {
+                    "event": event,
+                    "event_time": event.times.order_by("start").first(),
+                    "event_truncate": event_truncate,
+                },
+                request,
+            )
+        return content, len(context.captured_queries)
+
+    content, queries = render()
+    assert "Test event" in content
+    cached_content, cached_queries = render()
+    assert cached_content == content
+    assert cached_queries < queries
+
+    models.EventLink.objects.create(event=single_event, link="https://example.org/")
+    content, __ = render()
+    if not event_truncate:
+        assert "example.org" in content
+
+    single_event.name = "Renamed event"
+    single_event.save()
+    content = render()[0]
+    assert "Renamed event" in content
+
+    # Recurrences are shown on all cards
+    recurrence = models.EventRecurrence.objects.create(
+        event=single_event,
+        event_time_anchor=single_event.times.get(),
+        every_week=True,
+    )
+    assert render()[0] != content
+    recurrence.delete()
+    assert render()[0] == content
+
+    # The full card lists the upcoming times
+    event_time = single_event.times.get()
+    models.EventTime.objects.create(
+        event=single_event,
+        start=event_time.start + timedelta(days=1),
+        end=event_time.end + timedelta(days=1),
+    )
+    if not event_truncate:
+        assert render()[0] != content
+
+
+@pytest.mark.django_db()
+def test_event_description_longer_than_excerpt(single_event):  # noqa
+    single_event.description = "word " * 100
+    single_event.save()
+    event = models.Event.objects.for_card().get(pk=single_event.pk)
+
+    assert len(event_description(event, 100)) < len(event_description(event, 400))
+    assert event_description(event, 400) == event_description(
+        models.Event.objects.get(pk=single_event.pk), 400
+    )
+
+
+def test_event_timeline():
+    def at(hour):
+        return datetime(2021, 6, 1, hour, tzinfo=pytz.utc)
+
+    hours = [(10, 12), (11, 13), (12, 14), (13, None), (9, 11), (15, 16)]
+    event_times = [
+        models.EventTime(start=at(start), end=at(end) if end else None)
+        for start, end in hours
+    ]
+    lanes = event_timeline(event_times, now=at(12))
+    assert sum(map(len, lanes)) == len(hours)
+    assert len(lanes) == 2
+    for lane in lanes:
+        starts = [item["event_time"].start.hour for item in lane]
+        assert starts == sorted(starts)
+        for item, following in zip(lane, lane[1:]):
+            assert item["x_end_pct"] <= following["x_start_pct"]
+    assert [[item["event_time"].start.hour for item in lane] for lane in lanes] == [
+        [9, 11, 13, 15],
+        [10, 12],
+    ]
+
+    # Events without an end still take up an hour
+    lanes = event_timeline(
+        [models.EventTime(start=at(10)), models.EventTime(start=at(10))], now=at(12)
+    )
+    assert len(lanes) == 2
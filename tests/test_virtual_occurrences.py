@@ -0,0 +1,140 @@
+import json
+from datetime import timedelta
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls.base import reverse
+from django.utils.timezone import localtime
+from dukop.apps.calendar import models
+from dukop.apps.calendar import occurrences
+from dukop.apps.calendar import spheres
+from dukop.apps.calendar.templatetags.calendar_tags import get_event_times
+from dukop.apps.calendar.utils import timedelta_fixed_time
+
+from .fixtures_calendar import single_event  # noqa
+
+
+@pytest.fixture
+def virtual_recurrence(settings, single_event):  # noqa
+    settings.DUKOP_VIRTUAL_RECURRENCES = True
+    recurrence = models.EventRecurrence.objects.create(
+        event=single_event,
+        event_time_anchor=single_event.times.first(),
+        every_week=True,
+    )
+    recurrence.sync()
+    return recurrence
+
+
+@pytest.mark.django_db()
+def test_sync_only_stores_anchor(virtual_recurrence):
+    assert virtual_recurrence.times.all().count() == 1
+
+    call_command("calendar_extend_recurrences", stdout=StringIO())
+    assert virtual_recurrence.times.all().count() == 1
+
+
+@pytest.mark.django_db()
+def test_get_event_times(virtual_recurrence):
+    anchor = virtual_recurrence.event_time_anchor
+    event_times = get_event_times(days=60)
+    starts = [event_time.start for event_time in event_times]
+    # 14 days until the anchor and then weekly for the remaining 46 days
+    assert len(starts) == 7
+    assert starts == sorted(starts)
+    for i, start in enumerate(starts):
+        assert start == timedelta_fixed_time(anchor.start, days=7 * i)
+        assert event_times[i].event == virtual_recurrence.event
+
+    assert len(get_event_times(days=60, max_count=3)) == 3
+    assert len(get_event_times(days=60, has_image=True)) == 0
+
+
+@pytest.mark.django_db()
+def test_stored_time_replaces_occurrence(virtual_recurrence):
+    anchor = virtual_recurrence.event_time_anchor
+    cancelled_start = timedelta_fixed_time(anchor.start, days=14)
+    models.EventTime.objects.create(
+        event=virtual_recurrence.event,
+        recurrence=virtual_recurrence,
+        start=cancelled_start,
+        end=cancelled_start + timedelta(hours=2),
+        is_cancelled=True,
+    )
+    event_times = get_event_times(days=60)
+    on_date = [
+        event_time
+        for event_time in event_times
+        if localtime(event_time.start).date() == localtime(cancelled_start).date()
+    ]
+    assert len(event_times) == 7
+    assert len(on_date) == 1
+    assert on_date[0].is_cancelled
+
+
+@pytest.mark.django_db()
+def test_event_list_and_feeds(client, virtual_recurrence):
+    anchor = virtual_recurrence.event_time_anchor
+    pivot_date = localtime(anchor.start).date() + timedelta(days=7)
+    response = client.get(
+        reverse(
+            "calendar:event_list",
+            kwargs={
+                "sphere_id": spheres.registry.get_default().pk,
+                "pivot_date": pivot_date.isoformat(),
+            },
+        )
+    )
+    assert response.status_code == 200
+    assert len(response.context["event_times"]) == 1
+
+    # The anchor 14 days from now and then weekly until the horizon
+    expected_count = (occurrences.VIRTUAL_HORIZON_DAYS - 14) // 7 + 1
+    response = client.get(reverse("calendar:feed_ical"))
+    assert response.status_code == 200
+    content = response.getvalue()
+    # The anchor and the series
+    assert content.count(b"BEGIN:VEVENT") == 2
+    assert b"RRULE:FREQ=WEEKLY" in content
+
+    response = client.get(reverse("calendar:feed_rss"))
+    assert response.status_code == 200
+    assert response.content.count(b"<item>") == expected_count
+
+
+@pytest.mark.django_db()
+def test_get_event_times_has_image(virtual_recurrence):
+    for __ in range(3):
+        models.EventImage.objects.create(event=virtual_recurrence.event)
+    with CaptureQueriesContext(connection) as context:
+        event_times = get_event_times(days=60, has_image=True)
+    assert len(event_times) == 7
+    assert len({event_time.start for event_time in event_times}) == 7
+    assert not [
+        query for query in context.captured_queries if "DISTINCT" in query["sql"]
+    ]
+    assert len(get_event_times(days=60, has_image=False)) == 0
+
+
+@pytest.mark.django_db()
+def test_api_and_caldav(client, virtual_recurrence):
+    """The API only lists stored times, CalDAV has the series"""
+    response = client.get(reverse("calendar:api_events"))
+    assert [row["id"] for row in json.loads(response.content)["results"]] == [
+        virtual_recurrence.event_time_anchor_id
+    ]
+
+    response = client.get(
+        reverse(
+            "calendar:caldav_event",
+            kwargs={
+                "sphere_id": spheres.registry.get_default().pk,
+                "event_id": virtual_recurrence.event_id,
+            },
+        )
+    )
+    assert response.status_code == 200
+    assert b"RRULE:FREQ=WEEKLY" in response.content